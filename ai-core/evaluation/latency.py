@@ -0,0 +1,463 @@
+"""
+Offline latency benchmark for the RAG pipeline (OmniRAGPipeline).
+
+record: runs a query set through process_query / stream_query against the live
+upstreams (Groq, Gemini, Tavily) and stores every LLM, VLM and web search response,
+with the latency it was observed at, in a fixture file.
+replay: runs the same queries against a deterministic stand-in that answers from the
+fixture after a simulated delay (the recorded one, scaled, or a fixed value per
+upstream), and reports per-stage p50/p95, total latency, time to first token and CPU
+time. Everything else (embeddings, vector search, reranking, compression, the stage
+graphs) runs for real, so local regressions show up without network noise.
+With --baseline, replay exits with status 1 when a metric regressed.
+
+Query set format (JSON):
+    {
+        "corpus": [{"filename": "guide.md", "text": "..."}],
+        "queries": [{"query": "...", "strategy": null, "history": [], "image_urls": []}]
+    }
+
+Usage:
+    python ai-core/evaluation/latency.py record queries.json fixtures/latency.json
+    python ai-core/evaluation/latency.py replay fixtures/latency.json --runs 5 --out report.json
+    python ai-core/evaluation/latency.py replay fixtures/latency.json --llm-latency 0.4 --baseline report.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"))
+
+BENCH_USER_ID = "latency-bench"
+MODES = ("process", "stream")
+# Regressions smaller than this are noise, whatever the tolerance
+MIN_REGRESSION_MS = 5.0
+
+
+class ReplayMiss(KeyError):
+    """A call the fixture has no recording for (prompts changed since it was recorded)."""
+
+
+def _call_key(kind: str, payload: Any) -> str:
+    data = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class Tape:
+    """
+    Recorded upstream responses by call key (kind + request). Identical requests are
+    kept in call order and replayed in the same order; the last one repeats.
+    """
+
+    def __init__(self, calls: Optional[Dict[str, List[Dict[str, Any]]]] = None, strict: bool = False):
+        self.calls = calls or {}
+        self.strict = strict
+        self.misses: Dict[str, int] = defaultdict(int)
+        self._cursor: Dict[str, int] = defaultdict(int)
+
+    def rewind(self):
+        self._cursor.clear()
+
+    def add(self, kind: str, payload: Any, entry: Dict[str, Any]):
+        self.calls.setdefault(_call_key(kind, payload), []).append({"kind": kind, **entry})
+
+    def next(self, kind: str, payload: Any) -> Optional[Dict[str, Any]]:
+        key = _call_key(kind, payload)
+        entries = self.calls.get(key)
+        if not entries:
+            self.misses[kind] += 1
+            if self.strict:
+                raise ReplayMiss(f"No recorded {kind} response for call {key[:12]}")
+            return None
+        index = self._cursor[key]
+        self._cursor[key] += 1
+        return entries[min(index, len(entries) - 1)]
+
+
+class SimulatedLatency:
+    """
+    Upstream delay per call kind (llm, vlm, web): a fixed value when one is set,
+    otherwise the recorded latency times `scale`, with optional seeded jitter.
+    """
+
+    def __init__(self, fixed: Optional[Dict[str, Optional[float]]] = None, scale: float = 1.0, jitter: float = 0.0, seed: int = 0):
+        self.fixed = {kind: value for kind, value in (fixed or {}).items() if value is not None}
+        self.scale = scale
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def delay(self, kind: str, recorded: float) -> float:
+        base = self.fixed.get(kind, recorded * self.scale)
+        if self.jitter:
+            base *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"fixed": self.fixed, "scale": self.scale, "jitter": self.jitter}
+
+
+def _llm_payload(messages: List[Dict[str, Any]], stream: bool) -> Dict[str, Any]:
+    # Model and sampling parameters are left out, so policy changes can be replayed
+    return {"messages": messages, "stream": stream}
+
+
+class RecordingLLM:
+    """Passes calls through to the real LLM client and records the responses."""
+
+    def __init__(self, llm_client, tape: Tape):
+        self.llm = llm_client
+        self.tape = tape
+
+    async def get_completion(self, messages: List[Dict[str, Any]], **params) -> str:
+        start = time.perf_counter()
+        response = await self.llm.get_completion(messages, **params)
+        self.tape.add("llm", _llm_payload(messages, False), {"response": response, "latency": time.perf_counter() - start})
+        return response
+
+    async def get_streaming_completion(self, messages: List[Dict[str, Any]], **params):
+        start = time.perf_counter()
+        chunks, ttft = [], None
+        async for chunk in self.llm.get_streaming_completion(messages, **params):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            chunks.append(chunk)
+            yield chunk
+        latency = time.perf_counter() - start
+        self.tape.add("llm", _llm_payload(messages, True), {"chunks": chunks, "ttft": ttft or latency, "latency": latency})
+
+
+class ReplayLLM:
+    """Deterministic stand-in for the LLM client, answering from a tape."""
+
+    def __init__(self, tape: Tape, latency: SimulatedLatency):
+        self.tape = tape
+        self.latency = latency
+
+    async def get_completion(self, messages: List[Dict[str, Any]], **params) -> str:
+        entry = self.tape.next("llm", _llm_payload(messages, False))
+        if entry is None:
+            return ""
+        await asyncio.sleep(self.latency.delay("llm", entry["latency"]))
+        return entry["response"]
+
+    async def get_streaming_completion(self, messages: List[Dict[str, Any]], **params):
+        entry = self.tape.next("llm", _llm_payload(messages, True))
+        if entry is None:
+            return
+        # First token after the (scaled) TTFT, the rest spread over the remaining time
+        total = self.latency.delay("llm", entry["latency"])
+        ttft = total * (entry["ttft"] / entry["latency"]) if entry["latency"] else 0.0
+        chunks = entry["chunks"]
+        await asyncio.sleep(ttft)
+        gap = (total - ttft) / max(1, len(chunks) - 1)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(gap)
+            yield chunk
+
+
+def _recording(tape: Tape, kind: str, fn: Callable) -> Callable:
+    async def call(*args, **kwargs):
+        start = time.perf_counter()
+        response = await fn(*args, **kwargs)
+        tape.add(kind, {"args": args, "kwargs": kwargs}, {"response": response, "latency": time.perf_counter() - start})
+        return response
+    return call
+
+
+def _replaying(tape: Tape, kind: str, latency: SimulatedLatency, empty: Callable[..., Any]) -> Callable:
+    async def call(*args, **kwargs):
+        entry = tape.next(kind, {"args": args, "kwargs": kwargs})
+        if entry is None:
+            return empty(*args, **kwargs)
+        await asyncio.sleep(latency.delay(kind, entry["latency"]))
+        return entry["response"]
+    return call
+
+
+def _bench_store(corpus: List[Dict[str, Any]], model_name: Optional[str]):
+    """Fresh vector store in a temporary directory holding only the benchmark corpus."""
+    from app.services.ai.text_extraction import make_recursive_splitter
+    from app.services.ai.vector_store import VectorStore
+
+    kwargs = {"model_name": model_name} if model_name else {}
+    store = VectorStore(storage_path=tempfile.mkdtemp(prefix="latency-bench-"), **kwargs)
+    splitter = make_recursive_splitter()
+    texts, metadatas = [], []
+    for i, doc in enumerate(corpus):
+        for j, chunk in enumerate(splitter.split_text(doc["text"])):
+            texts.append(chunk)
+            metadatas.append({
+                **doc.get("metadata", {}),
+                "user_id": BENCH_USER_ID,
+                "filename": doc.get("filename", f"doc-{i}.txt"),
+                "chunk_index": j,
+                "text": chunk,
+            })
+    store.add_texts(texts, metadatas)
+    print(f"Indexed {len(texts)} chunks from {len(corpus)} documents")
+    return store
+
+
+def _pipeline(store, llm_client, tape: Tape, latency: Optional[SimulatedLatency]):
+    """Pipeline wired to the given LLM client, with VLM and web search recorded or replayed."""
+    from app.core.config import settings
+    from app.core.tiered_cache import redis_tier
+    from app.services.ai.gemini_client import gemini_client
+    from app.services.rag.pipeline import OmniRAGPipeline
+
+    # Spans give the per-stage timings; Redis is bypassed so runs neither depend on
+    # it nor share cache entries through it
+    settings.TRACING_ENABLED = True
+    redis_tier.available = lambda: False
+
+    pipeline = OmniRAGPipeline(vector_store=store, llm_client=llm_client)
+    if latency is None:
+        pipeline.web_search.search = _recording(tape, "web", pipeline.web_search.search)
+        gemini_client.describe_images = _recording(tape, "vlm", gemini_client.describe_images)
+    else:
+        pipeline.web_search.search = _replaying(tape, "web", latency, lambda *args, **kwargs: [])
+        gemini_client.describe_images = _replaying(tape, "vlm", latency, lambda sources, *args, **kwargs: [None] * len(sources))
+    return pipeline
+
+
+def _set_caches(pipeline, enabled: bool):
+    from app.services.ai.semantic_cache import semantic_cache
+
+    semantic_cache.enabled = enabled
+    pipeline.retrieval_cache.enabled = enabled
+
+
+def _clear_caches(pipeline):
+    from app.core.tiered_cache import tiered_caches
+
+    for cache in tiered_caches.values():
+        cache._local.clear()
+    pipeline.retrieval_cache._entries.clear()
+
+
+async def _run_query(pipeline, item: Dict[str, Any], mode: str, budget_ms: Optional[int]) -> Dict[str, Any]:
+    """One query through the pipeline; total, TTFT and CPU time plus span durations by name."""
+    from app.core.tracing import tracer
+
+    trace = tracer.start_trace("latency_bench", mode=mode)
+    request = {
+        "query": item["query"],
+        "user_id": BENCH_USER_ID,
+        "history": [dict(m) for m in item.get("history") or []],
+        "strategy": item.get("strategy"),
+        "image_urls": item.get("image_urls") or None,
+        "latency_budget_ms": budget_ms,
+    }
+    ttft = None
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if mode == "stream":
+        # The image banner is sent before any work; the first token comes after a non-content event
+        started = False
+        async for event in pipeline.stream_query(**request):
+            if event["type"] != "content":
+                started = True
+            elif started and ttft is None:
+                ttft = (time.perf_counter() - start) * 1000
+    else:
+        await pipeline.process_query(**request, use_memory=False)
+    total = (time.perf_counter() - start) * 1000
+    cpu = (time.process_time() - cpu_start) * 1000
+    trace.finish()
+
+    stages = defaultdict(list)
+    for span in trace.to_dict()["spans"][1:]:
+        if not span["attributes"].get("skipped"):
+            stages[span["name"]].append(span["duration_ms"])
+    return {"total_ms": total, "ttft_ms": ttft, "cpu_ms": cpu, "stages": dict(stages)}
+
+
+async def _run_all(pipeline, tape: Tape, queries: List[Dict[str, Any]], modes: List[str], runs: int, warm: bool, budget_ms: Optional[int]) -> Dict[str, List[Dict[str, Any]]]:
+    results = {mode: [] for mode in modes}
+    _set_caches(pipeline, warm)
+    for run in range(runs):
+        tape.rewind()
+        for mode in modes:
+            for i, item in enumerate(queries):
+                if not warm:
+                    _clear_caches(pipeline)
+                # Own task, so each trace gets its own span context
+                result = await asyncio.ensure_future(_run_query(pipeline, item, mode, budget_ms))
+                results[mode].append(result)
+                ttft = f", ttft {result['ttft_ms']:.0f}ms" if result["ttft_ms"] is not None else ""
+                print(f"[run {run + 1}/{runs}] {mode} #{i + 1}: {result['total_ms']:.0f}ms{ttft}, cpu {result['cpu_ms']:.0f}ms")
+    return results
+
+
+def _summary(samples: List[float]) -> Optional[Dict[str, float]]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+
+    return {"count": len(ordered), "p50_ms": pct(0.5), "p95_ms": pct(0.95), "mean_ms": round(sum(ordered) / len(ordered), 1)}
+
+
+def build_report(results: Dict[str, List[Dict[str, Any]]], **info: Any) -> Dict[str, Any]:
+    report = {**info, "modes": {}}
+    for mode, runs in results.items():
+        stages = defaultdict(list)
+        for result in runs:
+            for name, durations in result["stages"].items():
+                stages[name].extend(durations)
+        report["modes"][mode] = {
+            "total": _summary([r["total_ms"] for r in runs]),
+            "ttft": _summary([r["ttft_ms"] for r in runs if r["ttft_ms"] is not None]),
+            "cpu": _summary([r["cpu_ms"] for r in runs]),
+            "stages": {name: _summary(durations) for name, durations in sorted(stages.items())},
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    for mode, data in report["modes"].items():
+        print(f"\n== {mode} ==")
+        print(f"{'metric':<40} {'n':>5} {'p50 ms':>10} {'p95 ms':>10}")
+        rows = [("total", data["total"]), ("ttft", data["ttft"]), ("cpu", data["cpu"])]
+        rows += [(f"  {name}", summary) for name, summary in data["stages"].items()]
+        for name, summary in rows:
+            if summary:
+                print(f"{name:<40} {summary['count']:>5} {summary['p50_ms']:>10.1f} {summary['p95_ms']:>10.1f}")
+    if report.get("replay_misses"):
+        print(f"\nReplay misses (answered empty): {report['replay_misses']}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics whose p50 or p95 grew by more than tolerance (and MIN_REGRESSION_MS) over the baseline."""
+    regressions = []
+    for mode, data in report["modes"].items():
+        old = baseline.get("modes", {}).get(mode)
+        if not old:
+            continue
+        metrics = [(name, data[name], old.get(name)) for name in ("total", "ttft", "cpu")]
+        metrics += [(name, summary, old.get("stages", {}).get(name)) for name, summary in data["stages"].items()]
+        for name, new, previous in metrics:
+            if not new or not previous:
+                continue
+            for stat in ("p50_ms", "p95_ms"):
+                if new[stat] > previous[stat] * (1 + tolerance) and new[stat] - previous[stat] > MIN_REGRESSION_MS:
+                    regressions.append(f"{mode} {name} {stat}: {previous[stat]:.1f} -> {new[stat]:.1f}")
+    return regressions
+
+
+async def record(args) -> Dict[str, Any]:
+    from app.services.ai.groq_client import groq_client
+
+    with open(args.queries, "r", encoding="utf-8") as f:
+        query_set = json.load(f)
+    tape = Tape()
+    store = _bench_store(query_set["corpus"], args.embedding_model)
+    pipeline = _pipeline(store, RecordingLLM(groq_client, tape), tape, latency=None)
+
+    # Cold caches, so every upstream call is made (and recorded) for every mode
+    results = await _run_all(pipeline, tape, query_set["queries"], args.modes, 1, warm=False, budget_ms=None)
+    fixture = {
+        "version": 1,
+        "recorded_at": datetime.utcnow().isoformat(),
+        "embedding_model": args.embedding_model,
+        "modes": args.modes,
+        "corpus": query_set["corpus"],
+        "queries": query_set["queries"],
+        "calls": tape.calls,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.fixture)), exist_ok=True)
+    with open(args.fixture, "w", encoding="utf-8") as f:
+        json.dump(fixture, f, ensure_ascii=False)
+    print(f"Recorded {sum(len(e) for e in tape.calls.values())} upstream calls to {args.fixture}")
+    return build_report(results, source="live")
+
+
+async def replay(args) -> Dict[str, Any]:
+    with open(args.fixture, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+    latency = SimulatedLatency(
+        fixed={"llm": args.llm_latency, "vlm": args.vlm_latency, "web": args.web_latency},
+        scale=args.latency_scale,
+        jitter=args.jitter,
+        seed=args.seed
+    )
+    tape = Tape(fixture["calls"], strict=args.strict)
+    store = _bench_store(fixture["corpus"], fixture.get("embedding_model"))
+    pipeline = _pipeline(store, ReplayLLM(tape, latency), tape, latency)
+
+    modes = args.modes or fixture.get("modes") or list(MODES)
+    results = await _run_all(pipeline, tape, fixture["queries"], modes, args.runs, args.warm, args.budget_ms)
+    return build_report(
+        results,
+        source="replay",
+        fixture=args.fixture,
+        runs=args.runs,
+        warm=args.warm,
+        latency=latency.describe(),
+        replay_misses=dict(tape.misses),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay upstream responses to benchmark the RAG pipeline offline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Run a query set against live upstreams and save a fixture")
+    rec.add_argument("queries", help="Query set JSON (corpus and queries)")
+    rec.add_argument("fixture", help="Fixture file to write")
+    rec.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    rec.add_argument("--embedding-model", default=None, help="Embedding model for the benchmark index (vector store default if unset)")
+
+    rep = sub.add_parser("replay", help="Benchmark against a recorded fixture")
+    rep.add_argument("fixture", help="Fixture file written by 'record'")
+    rep.add_argument("--modes", nargs="+", choices=MODES, default=None, help="Defaults to the recorded modes")
+    rep.add_argument("--runs", type=int, default=3, help="Passes over the query set")
+    rep.add_argument("--llm-latency", type=float, default=None, help="Fixed seconds per LLM call instead of the recorded latency")
+    rep.add_argument("--vlm-latency", type=float, default=None, help="Fixed seconds per VLM call")
+    rep.add_argument("--web-latency", type=float, default=None, help="Fixed seconds per web search")
+    rep.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on recorded latencies")
+    rep.add_argument("--jitter", type=float, default=0.0, help="Relative random jitter on delays, e.g. 0.1")
+    rep.add_argument("--seed", type=int, default=0)
+    rep.add_argument("--warm", action="store_true", help="Keep caches between queries and runs")
+    rep.add_argument("--budget-ms", type=int, default=None, help="Per-request latency budget passed to the pipeline")
+    rep.add_argument("--strict", action="store_true", help="Fail on calls missing from the fixture")
+    rep.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    rep.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown against the baseline")
+
+    for command in (rec, rep):
+        command.add_argument("--out", default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(record(args) if args.command == "record" else replay(args))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.command == "replay" and args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
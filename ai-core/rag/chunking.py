@@ -1,64 +1,172 @@
-from typing import List
+from array import array
+from functools import lru_cache
+from typing import List, Tuple
 import re
 
+DEFAULT_TOKENIZER = "BAAI/bge-large-en-v1.5"
+
+# Fallback when no HF tokenizer is available: words and single punctuation marks.
+# Wordpiece splits rarer words further, so limits measured with it are approximate.
+_FALLBACK_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# Break preferences, strongest first. A gap is the text between two adjacent tokens.
+BREAK_PARAGRAPH = 4
+BREAK_LINE = 3
+BREAK_SENTENCE = 2
+BREAK_WORD = 1
+BREAK_NONE = 0  # Inside a word (subword continuation)
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(name: str = DEFAULT_TOKENIZER):
+    """Load (once per process) the fast tokenizer of the embedding model, or None."""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+        return tokenizer if tokenizer.is_fast else None
+    except Exception:
+        return None
+
+
 class SemanticChunker:
     """
-    Implements recursive character splitting to maintain logical context.
-    Ensures that logical paragraphs and sections remain intact.
+    Token-accurate chunker that works on character offsets into the original string.
+
+    The text is tokenized once (in batched blocks) with the embedding model's tokenizer,
+    then chunks are cut greedily at the strongest boundary (paragraph > line > sentence >
+    word) that keeps them within chunk_size tokens. Every token is visited a constant
+    number of times, so the cost is linear in the input size, and no chunk exceeds the
+    model window (max_tokens minus reserved_tokens for special tokens and instruction
+    prefixes).
     """
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
-        self.chunk_size = chunk_size
-        self.chunk_overlap = chunk_overlap
-        self.separators = ["\n\n", "\n", " ", ""]
+    BLOCK_CHARS = 64 * 1024  # Characters per tokenizer input block
+    BLOCK_BATCH = 16         # Blocks per tokenizer call
+
+    def __init__(
+        self,
+        chunk_size: int = 400,
+        chunk_overlap: int = 50,
+        tokenizer_name: str = DEFAULT_TOKENIZER,
+        max_tokens: int = 512,
+        reserved_tokens: int = 16
+    ):
+        self.max_chunk_tokens = max_tokens - reserved_tokens
+        self.chunk_size = max(1, min(chunk_size, self.max_chunk_tokens))
+        self.chunk_overlap = max(0, min(chunk_overlap, self.chunk_size // 2))
+        self.tokenizer = load_tokenizer(tokenizer_name)
 
     def split_text(self, text: str) -> List[str]:
         """
-        Splits text into chunks using recursive character splitting.
+        Splits text into chunks of at most chunk_size tokens.
         """
-        if not text:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """(start, end) character offsets of each chunk in text."""
+        if not text or not text.strip():
+            return []
+
+        starts, ends = self._token_offsets(text)
+        n = len(starts)
+        if n == 0:
             return []
 
-        return self._recursive_split(text, self.separators)
+        offsets = []
+        start = 0
+        while start < n:
+            hard_end = min(start + self.chunk_size, n)
+            end = hard_end if hard_end == n else self._best_break(text, starts, ends, start, hard_end)
+            offsets.append((starts[start], ends[end - 1]))
+            if end >= n:
+                break
+
+            next_start = max(end - self.chunk_overlap, start + 1)
+            # Never start a chunk in the middle of a word
+            while next_start < end and self._break_strength(text, ends[next_start - 1], starts[next_start]) == BREAK_NONE:
+                next_start += 1
+            start = next_start
+
+        return offsets
 
-    def _recursive_split(self, text: str, separators: List[str]) -> List[str]:
+    def _best_break(self, text: str, starts, ends, start: int, hard_end: int) -> int:
         """
-        Internal recursive method to split text.
+        Token index to end the chunk at (exclusive), scanning back from hard_end.
+        Looks no further back than half a chunk so chunks stay reasonably full.
         """
-        final_chunks = []
-
-        # If text is already smaller than chunk size, return it
-        if len(text) <= self.chunk_size:
-            return [text]
-
-        # Find the best separator to use
-        separator = separators[0] if separators else ""
-        new_separators = separators[1:] if len(separators) > 1 else []
-
-        splits = text.split(separator) if separator else list(text)
-
-        current_chunk = ""
-        for s in splits:
-            if len(current_chunk) + len(s) + len(separator) <= self.chunk_size:
-                current_chunk += (separator if current_chunk else "") + s
-            else:
-                if current_chunk:
-                    # If current_chunk is too big, we might need to split it further
-                    if len(current_chunk) > self.chunk_size:
-                        final_chunks.extend(self._recursive_split(current_chunk, new_separators))
-                    else:
-                        final_chunks.append(current_chunk)
-
-                # Start new chunk with overlap if possible
-                if self.chunk_overlap > 0 and current_chunk:
-                    overlap_start = max(0, len(current_chunk) - self.chunk_overlap)
-                    current_chunk = current_chunk[overlap_start:] + (separator if current_chunk else "") + s
-                else:
-                    current_chunk = s
-
-        if current_chunk:
-            final_chunks.append(current_chunk)
-
-        return final_chunks
+        floor = start + max(1, (hard_end - start) // 2)
+        best_end = hard_end
+        best_strength = -1
+        for i in range(hard_end, floor - 1, -1):
+            strength = self._break_strength(text, ends[i - 1], starts[i])
+            if strength > best_strength:
+                best_strength = strength
+                best_end = i
+                if strength == BREAK_PARAGRAPH:
+                    break
+        return best_end
+
+    @staticmethod
+    def _break_strength(text: str, prev_end: int, next_start: int) -> int:
+        if prev_end >= next_start:
+            return BREAK_NONE
+        gap = text[prev_end:next_start]
+        if "\n\n" in gap or gap.count("\n") > 1:
+            return BREAK_PARAGRAPH
+        if "\n" in gap:
+            return BREAK_LINE
+        if prev_end > 0 and text[prev_end - 1] in ".!?":
+            return BREAK_SENTENCE
+        return BREAK_WORD
+
+    def _token_offsets(self, text: str) -> Tuple[array, array]:
+        """Character start/end of every token, tokenized in whitespace-aligned blocks."""
+        starts = array("q")
+        ends = array("q")
+
+        if self.tokenizer is None:
+            for match in _FALLBACK_TOKEN.finditer(text):
+                starts.append(match.start())
+                ends.append(match.end())
+            return starts, ends
+
+        batch: List[Tuple[int, str]] = []
+        for block_start, block in self._blocks(text):
+            batch.append((block_start, block))
+            if len(batch) >= self.BLOCK_BATCH:
+                self._tokenize_batch(batch, starts, ends)
+                batch = []
+        if batch:
+            self._tokenize_batch(batch, starts, ends)
+        return starts, ends
+
+    def _blocks(self, text: str):
+        pos = 0
+        n = len(text)
+        while pos < n:
+            end = min(pos + self.BLOCK_CHARS, n)
+            if end < n:
+                # Cut at whitespace so no word straddles two blocks
+                cut = text.rfind(" ", pos + self.BLOCK_CHARS // 2, end)
+                cut = max(cut, text.rfind("\n", pos + self.BLOCK_CHARS // 2, end))
+                if cut > pos:
+                    end = cut
+            yield pos, text[pos:end]
+            pos = end
+
+    def _tokenize_batch(self, batch: List[Tuple[int, str]], starts: array, ends: array):
+        encoded = self.tokenizer(
+            [block for _, block in batch],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        for (block_start, _), offsets in zip(batch, encoded["offset_mapping"]):
+            for token_start, token_end in offsets:
+                if token_end > token_start:
+                    starts.append(block_start + token_start)
+                    ends.append(block_start + token_end)
+
 
 def get_chunker(method: str = "recursive", **kwargs):
     if method == "recursive":
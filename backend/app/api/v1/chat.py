@@ -248,7 +248,8 @@ async def send_message(
             session_id=session_id,
             image_urls=message_in.image_urls,
             image_ids=message_in.image_ids,
-            db=db
+            db=db,
+            context_fingerprint=context_meta.get("context_fingerprint")
         )
     except Exception as e:
         assistant_reply = f"I apologize, but I encountered an error: {str(e)}"
@@ -344,7 +345,8 @@ async def stream_message(
                 session_id=session_id,
                 image_urls=message_in.image_urls,
                 image_ids=message_in.image_ids,
-                db=db
+                db=db,
+                context_fingerprint=context_meta.get("context_fingerprint")
             ):
                 full_content += chunk
                 yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
@@ -1,4 +1,5 @@
 from typing import Any, List, Optional
+import asyncio
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
 from sqlalchemy.orm import Session
 import os
@@ -10,6 +11,7 @@ from app.models.code import CodeProject
 from app.schemas.code import CodeProject as CodeProjectSchema, CodeProjectCreate, CodeProjectUpdate
 from app.services.storage.supabase import storage_service
 from app.services.ai.vector_store import vector_store
+from app.services.ai.code_indexer import code_indexer
 from datetime import datetime
 
 router = APIRouter()
@@ -80,20 +82,19 @@ async def upload_project_files(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cloud storage error: {str(e)}")
 
-    # 2. Index in FAISS for RAG
+    # 2. Index source symbols in FAISS for code search/RAG
     try:
-        # For simplicity, we assume text extraction or use a library for source code
-        text_content = content.decode('utf-8', errors='ignore')
-        if len(text_content.strip()) > 0:
-            vector_store.add_texts(
-                texts=[text_content],
-                metadatas=[{
-                    "project_id": project_id,
-                    "user_id": current_user.id,
-                    "filename": file.filename,
-                    "type": "code_source"
-                }]
-            )
+        # Archive walk, parsing and embedding are blocking
+        stats = await asyncio.to_thread(
+            code_indexer.index_upload,
+            file_name=file.filename,
+            content=content,
+            metadata={
+                "project_id": project_id,
+                "user_id": current_user.id
+            }
+        )
+        print(f"Indexed {stats['symbols']} symbols from {stats['files']} files for project {project_id}")
     except Exception as e:
         print(f"FAISS indexing error: {e}")
 
@@ -103,6 +104,44 @@ async def upload_project_files(
 
     return project
 
+@router.get("/{project_id}/search")
+def search_project_code(
+    *,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    project_id: str,
+    q: str,
+    k: int = 10,
+) -> Any:
+    """
+    Search indexed symbols of a code project. Each hit points at a file and line range.
+    """
+    project = db.query(CodeProject).filter(CodeProject.id == project_id, CodeProject.user_id == current_user.id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Code project not found")
+
+    results = vector_store.search(
+        query=q,
+        user_id=current_user.id,
+        doc_type="code_symbol",
+        k=k,
+        alpha=0.5,
+        metadata_filter={"project_id": project_id}
+    )
+    return [
+        {
+            "path": res["metadata"].get("path"),
+            "symbol": res["metadata"].get("symbol"),
+            "kind": res["metadata"].get("kind"),
+            "language": res["metadata"].get("language"),
+            "start_line": res["metadata"].get("start_line"),
+            "end_line": res["metadata"].get("end_line"),
+            "score": res["score"],
+            "snippet": res["content"]
+        }
+        for res in results
+    ]
+
 @router.get("/{project_id}", response_model=CodeProjectSchema)
 def get_code_project(
     *,
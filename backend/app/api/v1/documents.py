@@ -13,6 +13,7 @@ from app.services.ai.vector_store import vector_store
 from app.services.ai.document_processor import document_processor
 from app.core.mongodb import mongodb
 from datetime import datetime
+from loguru import logger
 
 router = APIRouter()
 
@@ -215,14 +216,16 @@ async def upload_document(
     try:
         await document_processor.process_and_index(
             file_content=content,
-            file_type=file.content_type or extension,
+            file_name=file.filename,
             metadata={
                 "document_id": file_id,
                 "user_id": current_user.id,
                 "title": title or file.filename,
                 "filename": file.filename,
                 "session_id": session_id # Tag chunks with session_id if available
-            }
+            },
+            # Versioned via PUT /{document_id}/content: recursive chunks keep edits local
+            use_semantic=False
         )
     except Exception as e:
         print(f"FAISS indexing error: {e}")
@@ -256,6 +259,63 @@ async def upload_document(
 
     return db_obj
 
+@router.put("/{document_id}/content", response_model=DocumentSchema)
+async def update_document_content(
+    *,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    document_id: str,
+    file: UploadFile = File(...),
+) -> Any:
+    """
+    Replace the file behind an existing document and incrementally re-index it.
+    Only chunks that changed since the previous version are embedded.
+    """
+    document = db.query(Document).filter(Document.id == document_id, Document.user_id == current_user.id).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    content = await file.read()
+
+    # 1. Overwrite the stored file in place
+    if document.file_path:
+        try:
+            await storage_service.upload_file(
+                bucket="documents",
+                path=document.file_path,
+                file_content=content,
+                content_type=file.content_type,
+                upsert=True
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Cloud storage error: {str(e)}")
+
+    # 2. Diff chunks against the indexed version
+    try:
+        await document_processor.reindex_document(
+            file_content=content,
+            file_name=file.filename,
+            metadata={
+                "document_id": document_id,
+                "user_id": current_user.id,
+                "title": document.title,
+                "filename": file.filename
+            }
+        )
+    except Exception as e:
+        # The stored file is already replaced: report the stale index instead of a success
+        logger.error(f"FAISS re-indexing error for document {document_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Re-indexing failed, the search index still holds the previous version: {str(e)}")
+
+    # 3. Refresh Postgres metadata
+    document.filename = file.filename
+    document.file_type = file.content_type
+    document.size = len(content)
+    db.add(document)
+    db.commit()
+    db.refresh(document)
+    return document
+
 @router.get("/{document_id}/trace", response_model=List[ThinkingTraceSchema])
 async def get_document_trace(
     *,
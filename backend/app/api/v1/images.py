@@ -61,6 +61,15 @@ async def batch_image_operation(
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported action: {request.action}")
 
+async def _refresh_urls(images: List[Image]):
+    """Set fresh signed URLs on images and their variants."""
+    records = [obj for img in images for obj in (img, *img.variants)]
+    if not records:
+        return
+    urls = await storage_service.get_file_urls("images", [obj.storage_path for obj in records])
+    for obj in records:
+        obj.public_url = urls.get(obj.storage_path)
+
 @router.get("/", response_model=List[ImageResponse])
 async def list_images(
     db: Session = Depends(get_db),
@@ -75,13 +84,8 @@ async def list_images(
         .order_by(Image.created_at.desc())\
         .offset(skip).limit(limit).all()
 
-    # Generate fresh signed URLs for each image and its variants
-    for img in images:
-        img.public_url = await storage_service.get_file_url("images", img.storage_path)
-
-        # Variants are refreshed in the response via relationship
-        for variant in img.variants:
-            variant.public_url = await storage_service.get_file_url("images", variant.storage_path)
+    # Generate fresh signed URLs for each image and its variants (one batched cache lookup)
+    await _refresh_urls(images)
 
     return images
 
@@ -98,12 +102,8 @@ async def get_image(
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    # Refresh signed URL for original
-    image.public_url = await storage_service.get_file_url("images", image.storage_path)
-
-    # Refresh signed URLs for all variants
-    for variant in image.variants:
-        variant.public_url = await storage_service.get_file_url("images", variant.storage_path)
+    # Refresh signed URLs for the original and all variants
+    await _refresh_urls([image])
 
     return image
 
@@ -170,15 +170,9 @@ async def search_images(
 
     # Sort them by the order returned by vector store (relevance)
     id_to_img = {str(img.id): img for img in images}
-    sorted_images = []
-    for img_id in image_ids:
-        if img_id in id_to_img:
-            img = id_to_img[img_id]
-            # Refresh signed URLs
-            img.public_url = await storage_service.get_file_url("images", img.storage_path)
-            for variant in img.variants:
-                variant.public_url = await storage_service.get_file_url("images", variant.storage_path)
-            sorted_images.append(img)
+    sorted_images = [id_to_img[img_id] for img_id in image_ids if img_id in id_to_img]
+    # Refresh signed URLs
+    await _refresh_urls(sorted_images)
 
     return sorted_images
 
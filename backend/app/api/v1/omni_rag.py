@@ -13,6 +13,12 @@ from app.services.ai.router import ai_router
 from app.services.ai.vector_store import vector_store
 from app.services.ai.groq_client import groq_client
 from app.services.ai.document_processor import document_processor
+from app.services.ai.model_policy import stage_metrics
+from app.services.chat.post_response import post_response_queue
+from app.services.rag.deadline import resolve_budget_ms, stage_latency
+from app.core.tracing import tracer, to_otlp
+from app.core.config import settings
+from bson import ObjectId
 from datetime import datetime
 import time
 import uuid
@@ -34,6 +40,8 @@ class OmniRAGRequest(BaseModel):
     include_metadata: bool = True
     image_urls: Optional[List[str]] = []
     image_ids: Optional[List[str]] = []
+    latency_budget_ms: Optional[int] = None  # Capped by the user's tier budget
+    debug: bool = False  # Include the request's span trace in the response metadata
 
 class OmniRAGResponse(BaseModel):
     query: str
@@ -43,6 +51,12 @@ class OmniRAGResponse(BaseModel):
     metadata: dict
     latency: float
 
+def _remaining_ms(budget_ms: Optional[int], start_time: float) -> Optional[int]:
+    """What is left of the request's latency budget after session and context setup"""
+    if budget_ms is None:
+        return None
+    return max(0, budget_ms - int((time.time() - start_time) * 1000))
+
 @router.post("/query", response_model=OmniRAGResponse)
 async def process_omni_rag_query(
     request: OmniRAGRequest,
@@ -53,6 +67,8 @@ async def process_omni_rag_query(
     Process query using Omni-RAG pipeline with persistence
     """
     start_time = time.time()
+    budget_ms = resolve_budget_ms(getattr(current_user, "plan", None), request.latency_budget_ms)
+    trace = tracer.start_trace("omni_rag.query", user_id=str(current_user.id), latency_budget_ms=budget_ms)
 
     # 1. Get or create session
     session_id = request.session_id
@@ -85,11 +101,12 @@ async def process_omni_rag_query(
 
     # 3. Build optimized context using Hierarchical Memory
     from app.services.chat.context import build_context
-    history, _, context_meta = await build_context(
-        session_id=session_id,
-        user_id=str(current_user.id),
-        query=request.query
-    )
+    with tracer.span("build_context"):
+        history, _, context_meta = await build_context(
+            session_id=session_id,
+            user_id=str(current_user.id),
+            query=request.query
+        )
 
     try:
         # 4. Process through Omni-RAG
@@ -102,11 +119,15 @@ async def process_omni_rag_query(
             image_urls=request.image_urls,
             image_ids=request.image_ids,
             db=db,
-            memory_summary=context_meta.get("memory_summary")
+            memory_summary=context_meta.get("memory_summary"),
+            latency_budget_ms=_remaining_ms(budget_ms, start_time)
         )
 
         # Inject memory metadata into result
         result['metadata'].update(context_meta)
+        if trace is not None:
+            result['metadata']['trace_id'] = trace.trace_id
+        review = result.pop('review', None)
 
         # 5. Save assistant message
         # Flatten metadata for schema consistency with chat.py and ChatMessage schema
@@ -121,7 +142,16 @@ async def process_omni_rag_query(
             **rag_metadata
         }
         if mongodb.db is not None:
-            await mongodb.db.chat_messages.insert_one(assistant_msg_data)
+            res = await mongodb.db.chat_messages.insert_one(assistant_msg_data)
+            msg_id = str(res.inserted_id)
+        else:
+            msg_id = str(uuid.uuid4())
+        result['metadata']['message_id'] = msg_id
+
+        # Critique, quality scoring and memory write run after the response is sent;
+        # clients can follow GET /messages/{message_id}/review for the result
+        if review:
+            await post_response_queue.submit("answer_review", {**review, "message_id": msg_id}, key=msg_id)
 
         # 6. Update session title if needed
         if session.title.endswith("..."):
@@ -133,6 +163,9 @@ async def process_omni_rag_query(
         db.commit()
 
         latency = time.time() - start_time
+        tracer.save(trace, user_id=str(current_user.id), session_id=session_id, message_id=msg_id)
+        if request.debug and trace is not None:
+            result['metadata']['trace'] = trace.to_dict()
 
         return OmniRAGResponse(
             query=request.query,
@@ -145,6 +178,7 @@ async def process_omni_rag_query(
 
     except Exception as e:
         logger.error(f"Error in Omni-RAG query: {str(e)}")
+        tracer.save(trace, status="error", user_id=str(current_user.id), session_id=session_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/documents/upload")
@@ -248,10 +282,11 @@ async def get_omni_rag_stats(
     """
     try:
         # Filter metadata for user's documents
-        user_docs_meta = [
-            m for m in vector_store.metadata
-            if str(m.get('user_id')) == str(current_user.id)
-        ]
+        with vector_store.lock:
+            user_docs_meta = [
+                m for m in vector_store.metadata
+                if str(m.get('user_id')) == str(current_user.id) and not m.get('deleted')
+            ]
 
         doc_ids = set(m.get('document_id') for m in user_docs_meta if m.get('document_id'))
 
@@ -264,6 +299,79 @@ async def get_omni_rag_stats(
         logger.error(f"Error fetching stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/messages/{message_id}/review")
+async def stream_message_review(
+    message_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    SSE stream with one 'review' event (confidence, critique, quality) for an answer,
+    sent as soon as its post-response review is done.
+    """
+    async def event_generator():
+        result = None
+        if mongodb.db is not None:
+            try:
+                msg = await mongodb.db.chat_messages.find_one(
+                    {"_id": ObjectId(message_id), "user_id": current_user.id}
+                )
+            except Exception:
+                msg = None
+            if msg is None:
+                yield f"data: {json.dumps({'type': 'error', 'content': 'Message not found'})}\n\n"
+                return
+            if msg.get("review_pending") is False:
+                result = {k: msg.get(k) for k in ("confidence", "critique", "overall_quality_score", "quality_tier") if k in msg}
+
+        if result is None:
+            result = await post_response_queue.wait_result(message_id, settings.POST_RESPONSE_PUSH_TIMEOUT)
+
+        if result:
+            yield f"data: {json.dumps({'type': 'review', 'message_id': message_id, **result})}\n\n"
+        else:
+            yield f"data: {json.dumps({'type': 'review_pending', 'message_id': message_id})}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+@router.get("/stage-metrics")
+async def get_stage_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Per-stage LLM accounting (calls, models, latency percentiles, tokens, escalations)
+    for tuning the stage policy.
+    """
+    return stage_metrics.snapshot()
+
+@router.get("/traces/{trace_id}")
+async def get_trace(
+    trace_id: str,
+    format: str = "json",
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stored span trace of one request; format=otlp returns it as an OTLP/JSON
+    ExportTraceServiceRequest for import into any OpenTelemetry backend.
+    """
+    trace = await tracer.load(trace_id, user_id=str(current_user.id))
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return to_otlp(trace) if format == "otlp" else trace
+
+@router.get("/retrieval-cache")
+async def get_retrieval_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Hit rate and size of the retrieval result cache"""
+    return omni_rag_pipeline.retrieval_cache.snapshot()
+
+@router.get("/stage-latency")
+async def get_stage_latency(
+    current_user: User = Depends(get_current_user)
+):
+    """Projected cost of the optional stages used to enforce latency budgets"""
+    return stage_latency.snapshot()
+
 @router.get("/graph/communities")
 async def get_graph_communities(
     current_user: User = Depends(get_current_user)
@@ -339,6 +447,11 @@ async def stream_omni_rag_query(
     """
     Process query and stream response using Omni-RAG pipeline with persistence
     """
+    start_time = time.time()
+    budget_ms = resolve_budget_ms(getattr(current_user, "plan", None), request.latency_budget_ms)
+    # The root span stays current for the response task that runs event_generator
+    trace = tracer.start_trace("omni_rag.stream", user_id=str(current_user.id), latency_budget_ms=budget_ms)
+
     # 1. Get or create session
     session_id = request.session_id
     if not session_id:
@@ -370,15 +483,17 @@ async def stream_omni_rag_query(
 
     # 3. Build optimized context using Hierarchical Memory
     from app.services.chat.context import build_context
-    history, _, context_meta = await build_context(
-        session_id=session_id,
-        user_id=str(current_user.id),
-        query=request.query
-    )
+    with tracer.span("build_context"):
+        history, _, context_meta = await build_context(
+            session_id=session_id,
+            user_id=str(current_user.id),
+            query=request.query
+        )
 
     async def event_generator():
         full_response = ""
         final_metadata = {}
+        review = None
         final_metadata.update(context_meta) # Start with memory metadata
 
         try:
@@ -394,14 +509,25 @@ async def stream_omni_rag_query(
                 image_urls=request.image_urls,
                 image_ids=request.image_ids,
                 db=db,
-                memory_summary=context_meta.get("memory_summary")
+                memory_summary=context_meta.get("memory_summary"),
+                latency_budget_ms=_remaining_ms(budget_ms, start_time)
             ):
+                if event['type'] == 'review':
+                    # Post-response work for this answer; not sent to the client
+                    review = event['review']
+                    continue
                 if event['type'] == 'content':
                     full_response += event['content']
                 elif event['type'] == 'metadata':
                     final_metadata.update(event)
+                elif event['type'] == 'refinement':
+                    # Late results (e.g. CRAG's verdict) replace the provisional metadata
+                    final_metadata.update({k: v for k, v in event.items() if k not in ('type', 'stage')})
                 yield f"data: {json.dumps(event)}\n\n"
 
+            if trace is not None:
+                final_metadata['trace_id'] = trace.trace_id
+
             # Save assistant message after stream ends
             # Flatten metadata for schema consistency with ChatMessage schema
             assistant_msg_data = {
@@ -411,7 +537,8 @@ async def stream_omni_rag_query(
                 "content": full_response,
                 "timestamp": datetime.now(),
                 "retrieved_docs": final_metadata.get('retrieved_docs', []),
-                **final_metadata
+                **final_metadata,
+                **({"review_pending": True} if review else {})
             }
             if mongodb.db is not None:
                 res = await mongodb.db.chat_messages.insert_one(assistant_msg_data)
@@ -431,10 +558,24 @@ async def stream_omni_rag_query(
             session.updated_at = datetime.now()
             db.commit()
 
+            if review:
+                await post_response_queue.submit("answer_review", {**review, "message_id": msg_id}, key=msg_id)
+
             yield f"data: {json.dumps({'type': 'done', 'message_id': msg_id, 'title': generated_title})}\n\n"
 
+            tracer.save(trace, user_id=str(current_user.id), session_id=session_id, message_id=msg_id)
+            if request.debug and trace is not None:
+                yield f"data: {json.dumps({'type': 'trace', 'trace': trace.to_dict()})}\n\n"
+
+            # Push confidence and critique once the background review finishes
+            if review:
+                result = await post_response_queue.wait_result(msg_id, settings.POST_RESPONSE_PUSH_TIMEOUT)
+                if result:
+                    yield f"data: {json.dumps({'type': 'review', 'message_id': msg_id, **result})}\n\n"
+
         except Exception as e:
             logger.error(f"Error in Omni-RAG streaming: {str(e)}")
+            tracer.save(trace, status="error", user_id=str(current_user.id), session_id=session_id)
             yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -10,6 +10,10 @@ from app.models.research import ResearchPaper
 from app.schemas.research import ResearchPaper as ResearchPaperSchema, ResearchPaperCreate, ResearchPaperUpdate
 from app.services.storage.supabase import storage_service
 from app.services.ai.vector_store import vector_store
+from app.services.ai.document_processor import document_processor
+from app.services.ai.section_detector import detect_sections, split_references
+from app.core.mongodb import mongodb
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime
 
 router = APIRouter()
@@ -59,21 +63,46 @@ async def upload_research_paper(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cloud storage error: {str(e)}")
 
-    # 2. Index in FAISS for RAG
+    # 2. Extract, split into sections and index in FAISS for RAG
     try:
-        # For simplicity, we assume text extraction or use a library
-        # Here we just try to decode if it's text-based
-        text_content = content.decode('utf-8', errors='ignore')
-        if len(text_content.strip()) > 0:
-            vector_store.add_texts(
-                texts=[text_content],
-                metadatas=[{
-                    "paper_id": file_id,
-                    "user_id": current_user.id,
-                    "title": title or file.filename,
-                    "type": "research_paper"
-                }]
-            )
+        # PDF extraction is CPU-bound (and parallel for long papers); keep it off the event loop
+        text = await run_in_threadpool(document_processor.extract_text, content, file.filename)
+        sections = detect_sections(text) if text.strip() else []
+
+        texts = []
+        metadatas = []
+        references = []
+        for section in sections:
+            if section["name"] == "references":
+                # References are kept for citation lookups but never embedded
+                references.extend(split_references(section["text"]))
+                continue
+            if section["name"] == "abstract" and not abstract:
+                abstract = section["text"][:2000]
+
+            chunks = document_processor.recursive_splitter.split_text(section["text"])
+            texts.extend(chunks)
+            metadatas.extend(document_processor.build_chunk_metadatas(chunks, {
+                "document_id": file_id,
+                "paper_id": file_id,
+                "user_id": current_user.id,
+                "title": title or file.filename,
+                "filename": file.filename,
+                "type": "research_paper",
+                "section": section["name"],
+                "section_title": section["title"]
+            }))
+
+        # One embedding batch for every section of the paper, also off the event loop
+        await run_in_threadpool(vector_store.add_texts, texts, metadatas)
+
+        if references and mongodb.db is not None:
+            await mongodb.db.paper_references.insert_one({
+                "paper_id": file_id,
+                "user_id": current_user.id,
+                "references": references,
+                "created_at": datetime.now()
+            })
     except Exception as e:
         print(f"FAISS indexing error: {e}")
 
@@ -155,6 +184,14 @@ async def delete_research_paper(
         except Exception:
             pass
 
+    # Delete section chunks and stored references
+    try:
+        vector_store.delete_document(paper_id)
+    except Exception as e:
+        print(f"FAISS deletion error: {e}")
+    if mongodb.db is not None:
+        await mongodb.db.paper_references.delete_many({"paper_id": paper_id})
+
     db.delete(paper)
     db.commit()
     return paper
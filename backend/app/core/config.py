@@ -19,12 +19,60 @@ class Settings(BaseSettings):
     # AI Services
     GROQ_API_KEY: Optional[str] = None
     GROQ_API_KEYS: Optional[str] = None # Comma-separated list for rotation
+    GROQ_REQUESTS_PER_MINUTE: int = 30  # Per key and model
+    GROQ_TOKENS_PER_MINUTE: int = 12000  # Per key and model, refined from response headers
+    GROQ_QUEUE_TIMEOUT: float = 120.0  # Max seconds a call waits for a key with headroom
+    LLM_STAGE_POLICY: Optional[str] = None  # JSON overrides, e.g. {"hyde": {"model": "llama-3.3-70b-versatile"}}
+    GROQ_STREAM_MAX_FAILOVERS: int = 2  # Key switches allowed within one streamed answer
+    GROQ_HEDGE_ENABLED: bool = True
+    GROQ_HEDGE_PERCENTILE: float = 0.95  # Backup fires when TTFT exceeds this percentile
+    GROQ_HEDGE_MIN_DELAY: float = 0.5
+    GROQ_HEDGE_DEFAULT_DELAY: float = 2.0  # Until enough TTFT samples are collected
+    LLM_TOKENIZER: Optional[str] = None  # Hugging Face tokenizer of the Groq models; cl100k_base approximation if unset
+    QUERY_PLANNER_ENABLED: bool = True  # One JSON call for rewrite, variants, HyDE passages and complexity
+    PROMPT_TOKEN_BUDGET: int = 6000  # Input tokens for a generation prompt (system, documents, memory, history)
+    COMPRESSION_TOKEN_BUDGET: int = 1500  # Tokens of extracted sentences kept across the top documents
+    COMPRESSION_CROSS_ENCODER: bool = False  # Blend reranker cross-encoder scores into sentence selection
+    LATENCY_BUDGET_MS: int = 15000  # Per request; optional stages are skipped when they would exceed it (0 disables)
+    LATENCY_BUDGET_TIERS: Optional[str] = None  # JSON, plan tier -> ms, e.g. {"free": 10000, "pro": 20000}
+    STREAM_DEFER_CRAG: bool = False  # Opt-in: stream from reranked documents, CRAG's verdict (and web sources) only follows as a refinement event
     GEMINI_API_KEY: Optional[str] = None
+    GEMINI_MAX_CONCURRENCY: int = 3  # In-flight Gemini requests per process
+    GEMINI_BATCH_MAX_IMAGES: int = 8  # Images per multi-image request
     OPENROUTER_API_KEY: Optional[str] = None
     PHI2_LOCAL_PATH: Optional[str] = None
 
+    # Post-response tasks (critique, quality scoring, memory writes)
+    POST_RESPONSE_WORKERS: int = 2
+    POST_RESPONSE_MAX_PENDING: int = 500
+    POST_RESPONSE_PUSH_TIMEOUT: float = 45.0  # How long an SSE stream stays open for the review
+    POST_RESPONSE_SWEEP_INTERVAL: float = 10.0  # Seconds between re-queues of tasks deferred by a full queue
+
+    # Tracing
+    TRACING_ENABLED: bool = True  # Per-request span traces, stored in MongoDB
+    OTEL_EXPORTER_OTLP_ENDPOINT: Optional[str] = None  # e.g. http://localhost:4318; traces are pushed as OTLP/JSON
+
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_SOCKET_TIMEOUT: float = 0.5
+    REDIS_BREAKER_FAILURES: int = 3  # Consecutive errors before Redis is bypassed
+    REDIS_BREAKER_COOLDOWN: float = 30.0  # Seconds before a probe is let through again
+
+    # Two-tier cache (in-process LRU in front of Redis)
+    CACHE_LOCAL_MAX_ENTRIES: int = 2048  # Per namespace
+    CACHE_LOCAL_TTL: int = 300
+    CACHE_COMPRESS_MIN_BYTES: int = 512  # zstd above this size
+
+    # Retrieval result cache (reranked documents per query and corpus version)
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_TTL: int = 900  # Bounds staleness of web search results
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 5000
+
+    # Semantic response cache
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_TTL: int = 3600
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 500  # Per user
 
     # MongoDB
     MONGODB_URL: Optional[str] = None
@@ -0,0 +1,122 @@
+import logging
+from typing import Any, Dict, Optional
+
+import certifi
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# One long-lived client per upstream, so pool limits and timeouts are per host.
+# "fetch" serves arbitrary image URLs.
+CLIENT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "gemini": {
+        "timeout": httpx.Timeout(60.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+    },
+    "tavily": {
+        "timeout": httpx.Timeout(10.0, connect=3.0),
+        "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
+    },
+    "otlp": {
+        "timeout": httpx.Timeout(5.0, connect=2.0),
+        "limits": httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=60.0),
+    },
+    "fetch": {
+        "timeout": httpx.Timeout(20.0, connect=5.0),
+        "limits": httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30.0),
+        "follow_redirects": True,
+    },
+}
+
+
+class _ClientMetrics:
+    """Counts requests and newly opened connections, from httpx trace events."""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.http2_requests = 0
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    async def trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+        elif event_name == "http2.send_request_headers.started":
+            self.http2_requests += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "http2_requests": self.http2_requests,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+        }
+
+
+class HTTPClients:
+    clients: Dict[str, httpx.AsyncClient] = {}
+    metrics: Dict[str, _ClientMetrics] = {}
+
+
+http_clients = HTTPClients()
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    profile = CLIENT_PROFILES.get(name, CLIENT_PROFILES["fetch"])
+    metrics = http_clients.metrics.setdefault(name, _ClientMetrics())
+    return httpx.AsyncClient(
+        verify=certifi.where(),
+        http2=HTTP2_AVAILABLE,
+        event_hooks={"request": [metrics.on_request]},
+        **profile
+    )
+
+
+async def init_http_clients():
+    for name in CLIENT_PROFILES:
+        if name not in http_clients.clients:
+            http_clients.clients[name] = _create_client(name)
+    logger.info(f"HTTP client pool ready ({', '.join(CLIENT_PROFILES)}; http2={HTTP2_AVAILABLE})")
+
+
+async def close_http_clients():
+    for name, client in list(http_clients.clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"Error closing HTTP client {name}: {e}")
+    http_clients.clients = {}
+    logger.info("Closed HTTP client pool")
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """
+    Shared client for an upstream. Created by the app lifespan; scripts and workers
+    that run without it get one lazily.
+    """
+    client: Optional[httpx.AsyncClient] = http_clients.clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        http_clients.clients[name] = client
+    return client
+
+
+def get_http_metrics() -> Dict[str, Any]:
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "clients": {name: metrics.snapshot() for name, metrics in http_clients.metrics.items()},
+    }
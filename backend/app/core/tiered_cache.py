@@ -0,0 +1,291 @@
+"""
+Two-tier cache: a bounded in-process LRU/TTL tier in front of a shared Redis tier.
+
+Hot keys are served from process memory without a network round trip. Redis values
+are JSON, zstd-compressed above a size threshold, and batch lookups use one
+pipelined MGET. A circuit breaker stops calling Redis after repeated failures and
+lets a single probe through once the cool-down has passed, so one hiccup no
+longer disables Redis for the life of the process.
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Header of every value written to Redis. Starts with a NUL byte, which no plain
+# text value written before encoding was introduced can start with.
+_HEADER = b"\x00tc1"
+_RAW = _HEADER + b"r"
+_ZSTD = _HEADER + b"z"
+
+
+class LegacyValue(ValueError):
+    """A Redis value without the header, in a namespace that has no legacy values."""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failures` consecutive errors -> half-open probe after `cooldown` seconds."""
+
+    def __init__(self, failures: int, cooldown: float):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.probe_started = 0.0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # One probe at a time; a probe that never reported back (cancelled) is replaced
+        if state == "half_open" and (not self.probing or time.monotonic() - self.probe_started >= self.cooldown):
+            self.probing = True
+            self.probe_started = time.monotonic()
+            return True
+        return False
+
+    def success(self):
+        if self.opened_at is not None:
+            logger.info("Redis reachable again, closing circuit")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.max_failures:
+            if self.opened_at is None or self.probing:
+                self.trips += 1
+                logger.warning(f"Redis circuit open for {self.cooldown}s after {self.failures} failure(s)")
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class RedisTier:
+    """Shared Redis connection with value encoding and a circuit breaker."""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.REDIS_BREAKER_FAILURES, settings.REDIS_BREAKER_COOLDOWN)
+        self._compressor = zstandard.ZstdCompressor(level=3) if ZSTD_AVAILABLE else None
+        self._decompressor = zstandard.ZstdDecompressor() if ZSTD_AVAILABLE else None
+        try:
+            self.client = redis.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Redis cache not available at {settings.REDIS_URL}: {e}")
+            self.client = None
+
+    def encode(self, value: Any) -> bytes:
+        data = json.dumps(value).encode()
+        if self._compressor and len(data) >= settings.CACHE_COMPRESS_MIN_BYTES:
+            return _ZSTD + self._compressor.compress(data)
+        return _RAW + data
+
+    def decode(self, data: bytes, legacy_plain: bool = False) -> Any:
+        marker, body = data[:len(_RAW)], data[len(_RAW):]
+        if marker == _ZSTD:
+            return json.loads(self._decompressor.decompress(body))
+        if marker == _RAW:
+            return json.loads(body)
+        if legacy_plain:
+            # Plain string written before values were encoded
+            return data.decode()
+        raise LegacyValue("value without cache header")
+
+    def available(self) -> bool:
+        return self.client is not None and self.breaker.allow()
+
+    async def get_many(self, keys: List[str]) -> List[Tuple[Optional[bytes], Optional[int]]]:
+        """(value, remaining ttl in ms) per key, with one pipelined MGET + PTTL round trip."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.mget(keys)
+        for key in keys:
+            pipe.pttl(key)
+        results = await pipe.execute()
+        return list(zip(results[0], results[1:]))
+
+    async def set_many(self, items: Dict[str, bytes], expire: int):
+        pipe = self.client.pipeline(transaction=False)
+        for key, data in items.items():
+            pipe.set(key, data, ex=expire)
+        await pipe.execute()
+
+    async def delete(self, keys: List[str]):
+        await self.client.delete(*keys)
+
+
+class TieredCache:
+    """
+    Namespaced two-tier cache. Values must be JSON-serializable.
+    Local entries never outlive their Redis TTL.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        default_ttl: int = 3600,
+        local_max_entries: Optional[int] = None,
+        local_ttl: Optional[int] = None,
+        legacy_plain: bool = False
+    ):
+        self.namespace = namespace
+        # Keys may hold plain strings written before values had a header
+        self.legacy_plain = legacy_plain
+        self.default_ttl = default_ttl
+        self.local_max_entries = local_max_entries or settings.CACHE_LOCAL_MAX_ENTRIES
+        self.local_ttl = local_ttl if local_ttl is not None else settings.CACHE_LOCAL_TTL
+        self._local: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "sets": 0, "redis_errors": 0, "decode_errors": 0, "evictions": 0}
+        tiered_caches[namespace] = self
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    # Local tier
+
+    def _local_get(self, key: str) -> Tuple[bool, Any]:
+        entry = self._local.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._local[key]
+            return False, None
+        self._local.move_to_end(key)
+        return True, value
+
+    def _local_set(self, key: str, value: Any, ttl: float):
+        ttl = min(ttl, self.local_ttl)
+        if ttl <= 0:
+            return
+        self._local[key] = (time.monotonic() + ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_max_entries:
+            self._local.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # Public API
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Iterable[str]) -> List[Optional[Any]]:
+        keys = list(keys)
+        results: List[Optional[Any]] = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            hit, value = self._local_get(key)
+            if hit:
+                self.stats["local_hits"] += 1
+                results[i] = value
+            else:
+                missing.append(i)
+
+        if missing and redis_tier.available():
+            fetched = None
+            try:
+                fetched = await redis_tier.get_many([self._key(keys[i]) for i in missing])
+                redis_tier.breaker.success()
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                redis_tier.breaker.failure()
+                logger.error(f"Redis get error ({self.namespace}): {e}")
+
+            # A value that cannot be decoded is a miss for its key only, not a Redis failure
+            for i, (data, pttl) in zip(missing, fetched or []):
+                if data is None:
+                    continue
+                try:
+                    value = redis_tier.decode(data, self.legacy_plain)
+                except Exception as e:
+                    self.stats["decode_errors"] += 1
+                    logger.warning(f"Ignoring undecodable cache value ({self.namespace}:{keys[i]}): {e!r}")
+                    continue
+                results[i] = value
+                self.stats["redis_hits"] += 1
+                ttl = pttl / 1000 if pttl and pttl > 0 else self.local_ttl
+                self._local_set(keys[i], value, ttl)
+
+        self.stats["misses"] += sum(1 for i in missing if results[i] is None)
+        return results
+
+    async def set(self, key: str, value: Any, expire: Optional[int] = None):
+        await self.set_many({key: value}, expire)
+
+    async def set_many(self, items: Dict[str, Any], expire: Optional[int] = None):
+        expire = expire or self.default_ttl
+        for key, value in items.items():
+            self._local_set(key, value, expire)
+        self.stats["sets"] += len(items)
+
+        if items and redis_tier.available():
+            try:
+                await redis_tier.set_many(
+                    {self._key(k): redis_tier.encode(v) for k, v in items.items()}, expire
+                )
+                redis_tier.breaker.success()
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                redis_tier.breaker.failure()
+                logger.error(f"Redis set error ({self.namespace}): {e}")
+
+    async def delete(self, key: str):
+        self._local.pop(key, None)
+        if redis_tier.available():
+            try:
+                await redis_tier.delete([self._key(key)])
+                redis_tier.breaker.success()
+            except Exception as e:
+                self.stats["redis_errors"] += 1
+                redis_tier.breaker.failure()
+                logger.error(f"Redis delete error ({self.namespace}): {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["local_hits"] + self.stats["redis_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "local_entries": len(self._local),
+            "local_hit_ratio": round(self.stats["local_hits"] / lookups, 3) if lookups else None,
+            "redis_hit_ratio": round(self.stats["redis_hits"] / lookups, 3) if lookups else None,
+            "hit_ratio": round((lookups - self.stats["misses"]) / lookups, 3) if lookups else None,
+        }
+
+
+tiered_caches: Dict[str, TieredCache] = {}
+redis_tier = RedisTier()
+
+
+def get_cache_metrics() -> Dict[str, Any]:
+    return {
+        "redis": {
+            "circuit": redis_tier.breaker.state,
+            "trips": redis_tier.breaker.trips,
+            "compression": "zstd" if ZSTD_AVAILABLE else None,
+        },
+        "caches": {name: cache.snapshot() for name, cache in tiered_caches.items()},
+    }
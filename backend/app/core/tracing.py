@@ -0,0 +1,204 @@
+"""
+Lightweight span tracing for request pipelines.
+
+A trace is started per request; spans opened while it is active (pipeline stages,
+LLM and model calls) nest through contextvars, so concurrent stages started from a
+span become its children. Attributes such as model, token counts, cache hits and
+key-queue wait are attached with `tracer.annotate()` from wherever they are known.
+Finished traces are stored in MongoDB and can be exported as OTLP/JSON, either on
+request or pushed to a collector when OTEL_EXPORTER_OTLP_ENDPOINT is set.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "traces"
+MAX_SPANS = 500
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "ok"
+        self.attributes = dict(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": end_ns,
+            "offset_ms": round((self.start_ns - self.trace.start_ns) / 1e6, 1),
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 1),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = os.urandom(16).hex()
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.saved = False
+        self.root = Span(self, name, None, attributes)
+        self.spans.append(self.root)
+
+    def finish(self, status: str = "ok"):
+        if self.root.end_ns is None:
+            self.root.end_ns = time.time_ns()
+            self.root.status = status
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": self.root.to_dict()["duration_ms"],
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Dict[str, Any]) -> Dict[str, Any]:
+    """A stored trace (Trace.to_dict()) as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = [
+        {
+            "traceId": trace["trace_id"],
+            "spanId": span["span_id"],
+            **({"parentSpanId": span["parent_id"]} if span["parent_id"] else {}),
+            "name": span["name"],
+            "kind": 2 if span["parent_id"] is None else 1,  # SERVER for the root, INTERNAL otherwise
+            "startTimeUnixNano": str(span["start_ns"]),
+            "endTimeUnixNano": str(span["end_ns"]),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span["attributes"].items() if v is not None],
+            "status": {"code": 1} if span["status"] == "ok" else {"code": 2, "message": span["status"]},
+        }
+        for span in trace["spans"]
+    ]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": settings.PROJECT_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class Tracer:
+    def __init__(self):
+        self._pending: set = set()
+
+    def start_trace(self, name: str, **attributes: Any) -> Optional[Trace]:
+        """Start a trace and make its root span current for this context."""
+        if not settings.TRACING_ENABLED:
+            return None
+        trace = Trace(name, attributes)
+        _current_span.set(trace.root)
+        return trace
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        """Child span of the current one; a no-op outside a trace."""
+        parent = _current_span.get()
+        if parent is None or len(parent.trace.spans) >= MAX_SPANS:
+            yield None
+            return
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        parent.trace.spans.append(span)
+        _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+            span.attributes.setdefault("error", repr(e)[:200])
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            # Not reset(token): a span held open across the yields of an async
+            # generator may be closed from another context
+            _current_span.set(parent)
+
+    def annotate(self, **attributes: Any):
+        """Attach attributes to the current span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def add(self, key: str, amount: float = 1):
+        """Accumulate a numeric attribute on the current span (e.g. tokens over retries)."""
+        span = _current_span.get()
+        if span is not None:
+            span.attributes[key] = span.attributes.get(key, 0) + amount
+
+    def set_status(self, status: str):
+        span = _current_span.get()
+        if span is not None:
+            span.status = status
+
+    def save(self, trace: Optional[Trace], status: str = "ok", **fields: Any):
+        """Finish the trace and store / export it in the background."""
+        if trace is None or trace.saved:
+            return
+        trace.saved = True
+        trace.finish(status)
+        task = asyncio.ensure_future(self._store(trace.to_dict(), fields))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _store(self, trace: Dict[str, Any], fields: Dict[str, Any]):
+        from app.core.mongodb import mongodb
+        if mongodb.db is not None:
+            try:
+                await mongodb.db[COLLECTION].insert_one({**trace, **fields, "created_at": datetime.utcnow()})
+            except Exception as e:
+                logger.error(f"Could not store trace {trace['trace_id']}: {e}")
+
+        if settings.OTEL_EXPORTER_OTLP_ENDPOINT:
+            from app.core.http_client import get_http_client
+            try:
+                response = await get_http_client("otlp").post(
+                    f"{settings.OTEL_EXPORTER_OTLP_ENDPOINT.rstrip('/')}/v1/traces", json=to_otlp(trace)
+                )
+                response.raise_for_status()
+            except Exception as e:
+                logger.error(f"Could not export trace {trace['trace_id']}: {e}")
+
+    async def load(self, trace_id: str, **filters: Any) -> Optional[Dict[str, Any]]:
+        from app.core.mongodb import mongodb
+        if mongodb.db is None:
+            return None
+        return await mongodb.db[COLLECTION].find_one({"trace_id": trace_id, **filters}, {"_id": 0})
+
+
+tracer = Tracer()
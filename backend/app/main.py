@@ -4,10 +4,15 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import HTTPException as FastAPIHTTPException
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from contextlib import asynccontextmanager
+import asyncio
 import traceback
 
 from app.core.config import settings
 from app.core.mongodb import connect_to_mongo, close_mongo_connection
+from app.core.http_client import init_http_clients, close_http_clients, get_http_metrics
+from app.core.tiered_cache import get_cache_metrics
+from app.services.chat.post_response import post_response_queue
+from app.services.ai.vector_store import vector_store
 from app.api.v1.auth import router as auth_router
 from app.api.v1.chat import router as chat_router
 from app.api.v1.code import router as code_router
@@ -22,10 +27,19 @@ from app.api.v1.memory import router as memory_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Connect to MongoDB
+    # Startup: Connect to MongoDB and open the outbound HTTP pool
     await connect_to_mongo()
+    await init_http_clients()
+    # Uploads index from worker threads; cache invalidation must still run on the loop
+    vector_store.bind_loop(asyncio.get_running_loop())
+    if not vector_store.acquire_writer_lock():
+        # e.g. a bulk ingest is running; whichever process saves last wins
+        print(f"WARNING: Another process holds {vector_store.writer_lock_file}; the vector store files will be overwritten by whichever process saves last")
+    await post_response_queue.start()
     yield
-    # Shutdown: Close MongoDB connection
+    # Shutdown: Close MongoDB connection and HTTP clients
+    await post_response_queue.stop()
+    await close_http_clients()
     await close_mongo_connection()
 
 app = FastAPI(
@@ -102,6 +116,21 @@ def root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics/http")
+def http_metrics():
+    """Outbound HTTP pool usage: requests, new connections and reuse ratio per upstream."""
+    return get_http_metrics()
+
+@app.get("/metrics/post-response")
+def post_response_metrics():
+    """Background review queue: submitted, completed, retried and queued tasks."""
+    return post_response_queue.snapshot()
+
+@app.get("/metrics/cache")
+def cache_metrics():
+    """Two-tier cache hit ratios per namespace and tier, and the Redis circuit state."""
+    return get_cache_metrics()
+
 # Include routers
 app.include_router(auth_router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
 app.include_router(chat_router, prefix=f"{settings.API_V1_STR}/chat", tags=["chat"])
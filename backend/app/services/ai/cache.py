@@ -1,45 +1,46 @@
-import redis.asyncio as redis
 import json
 import hashlib
-from typing import Any, Optional
-from app.core.config import settings
-import logging
+import re
+from typing import Any, Dict, List, Optional
+from app.core.tiered_cache import TieredCache
+
+
+def prompt_hash(prompt: Any) -> str:
+    """Stable hash of a prompt (messages and, optionally, generation parameters)."""
+    prompt_str = json.dumps(prompt, sort_keys=True)
+    return hashlib.md5(prompt_str.encode()).hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation folded, for query-keyed caches."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+def query_key(query: str, *context: Any) -> str:
+    """
+    Cache key for output generated from a query (HyDE passage, rewrite, variants):
+    the normalized query plus whatever else the prompt depends on.
+    """
+    return prompt_hash([normalize_query(query), *context])
+
+
+def history_key(history: Optional[List[Dict[str, str]]], turns: int = 5) -> List[Any]:
+    """The last turns of a conversation, normalized, as part of a cache key."""
+    return [(m.get("role"), normalize_query(m.get("content") or "")) for m in (history or [])[-turns:]]
 
-logger = logging.getLogger(__name__)
 
 class AICache:
+    """Exact-prompt response cache (in-process LRU in front of Redis)."""
+
     def __init__(self):
-        try:
-            self.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
-            self.redis_available = True
-        except Exception as e:
-            logger.warning(f"Redis cache not available at {settings.REDIS_URL}: {e}")
-            self.redis = None
-            self.redis_available = False
-
-    def _generate_key(self, prompt: Any) -> str:
-        prompt_str = json.dumps(prompt, sort_keys=True)
-        return f"ai_cache:{hashlib.md5(prompt_str.encode()).hexdigest()}"
+        # Same key names as the pre-tiered cache, whose plain string values stay readable
+        self.cache = TieredCache("ai_cache", default_ttl=3600, legacy_plain=True)
 
     async def get(self, prompt: Any) -> Optional[str]:
-        if not self.redis_available:
-            return None
-        try:
-            key = self._generate_key(prompt)
-            return await self.redis.get(key)
-        except Exception as e:
-            logger.error(f"Redis get error: {e}")
-            self.redis_available = False
-            return None
+        return await self.cache.get(prompt_hash(prompt))
 
     async def set(self, prompt: Any, response: str, expire: int = 3600):
-        if not self.redis_available:
-            return
-        try:
-            key = self._generate_key(prompt)
-            await self.redis.set(key, response, ex=expire)
-        except Exception as e:
-            logger.error(f"Redis set error: {e}")
-            self.redis_available = False
+        await self.cache.set(prompt_hash(prompt), response, expire=expire)
 
 ai_cache = AICache()
@@ -0,0 +1,43 @@
+"""
+Content-hash diff between the indexed chunks of a document and a new version.
+
+Kept apart from the vector store so the diff can be reasoned about (and tested)
+without an index: chunks whose text is unchanged keep their rows and vectors,
+everything else is embedded or tombstoned.
+"""
+
+import hashlib
+from typing import Dict, List, NamedTuple, Tuple
+
+
+def content_hash(text: str) -> str:
+    """Stable hash of a chunk's text, used to diff document versions."""
+    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class ChunkDiff(NamedTuple):
+    kept: List[Tuple[int, int]]  # (position in the new version, existing row)
+    added: List[int]             # positions in the new version that need embedding
+    removed: List[int]           # existing rows no chunk of the new version matched
+
+
+def diff_chunks(existing: List[Tuple[int, str]], hashes: List[str]) -> ChunkDiff:
+    """
+    existing is [(row, content_hash)] of the indexed chunks, hashes the content hashes
+    of the new version in order. Repeated chunks match as many rows as they have.
+    """
+    rows: Dict[str, List[int]] = {}
+    for row, digest in existing:
+        rows.setdefault(digest, []).append(row)
+
+    kept = []
+    added = []
+    for position, digest in enumerate(hashes):
+        matches = rows.get(digest)
+        if matches:
+            kept.append((position, matches.pop()))
+        else:
+            added.append(position)
+
+    removed = [row for remaining in rows.values() for row in remaining]
+    return ChunkDiff(kept, added, removed)
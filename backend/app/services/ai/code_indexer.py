@@ -0,0 +1,332 @@
+import ast
+import io
+import os
+import re
+import tarfile
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.services.ai.vector_store import vector_store
+
+LANGUAGE_BY_EXTENSION = {
+    "py": "python", "js": "javascript", "jsx": "javascript", "mjs": "javascript",
+    "ts": "typescript", "tsx": "typescript", "java": "java", "go": "go", "rs": "rust",
+    "c": "c", "h": "c", "cc": "cpp", "cpp": "cpp", "hpp": "cpp", "cs": "csharp",
+    "php": "php", "rb": "ruby", "kt": "kotlin", "swift": "swift", "scala": "scala",
+    "sol": "solidity", "sh": "shell", "sql": "sql", "md": "markdown", "yaml": "yaml",
+    "yml": "yaml", "toml": "toml", "json": "json", "html": "html", "css": "css",
+}
+
+# Languages whose blocks are delimited by braces
+BRACE_LANGUAGES = {
+    "javascript", "typescript", "java", "go", "rust", "c", "cpp", "csharp",
+    "php", "kotlin", "swift", "scala", "solidity",
+}
+
+SKIP_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "vendor", "third_party", "bower_components",
+    "dist", "build", "out", "target", ".next", "__pycache__", ".venv", "venv", "env",
+    "site-packages", ".tox", ".mypy_cache", ".pytest_cache", "coverage", ".idea", ".vscode",
+}
+
+SKIP_FILE_SUFFIXES = (".min.js", ".min.css", ".lock", "-lock.json", ".map")
+
+# Declaration starts for brace languages (top-level or class members)
+BRACE_DECLARATION = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:public|private|protected|internal|static|final|abstract|async|override|pub(?:\(crate\))?|\s)*"
+    r"(?P<kind>function|class|interface|struct|enum|trait|impl|fn|func|contract|type|def)\s+"
+    r"(?:\([^)]*\)\s*)?"  # Go method receiver
+    r"(?P<name>[A-Za-z_$][\w$]*)"
+)
+# `const foo = (...) =>` / `const foo = function`
+ARROW_DECLARATION = re.compile(
+    r"^\s*(?:export\s+)?(?:const|let|var)\s+(?P<name>[A-Za-z_$][\w$]*)\s*=\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)"
+)
+
+
+class CodeIndexer:
+    """
+    Indexes uploaded source files and archives at symbol granularity.
+    Archives are read member by member, binaries and vendored directories are skipped,
+    and every function/class becomes its own vector with path and line metadata.
+    """
+
+    MAX_FILE_SIZE = 1024 * 1024          # Larger files are almost always generated
+    MAX_FILES = 20000
+    MAX_TOTAL_BYTES = 200 * 1024 * 1024
+    MAX_SYMBOL_LINES = 150               # Longer symbols are split into windows
+    WINDOW_LINES = 60
+    WINDOW_OVERLAP = 10
+    EMBED_BATCH_SIZE = 128
+
+    def detect_language(self, path: str) -> Optional[str]:
+        ext = path.rsplit(".", 1)[-1].lower() if "." in os.path.basename(path) else ""
+        return LANGUAGE_BY_EXTENSION.get(ext)
+
+    def _should_skip(self, path: str, size: int) -> bool:
+        parts = [p for p in path.replace("\\", "/").split("/") if p]
+        if not parts or any(p in SKIP_DIRS for p in parts[:-1]):
+            return True
+        if parts[-1].endswith(SKIP_FILE_SUFFIXES):
+            return True
+        return size <= 0 or size > self.MAX_FILE_SIZE or self.detect_language(path) is None
+
+    @staticmethod
+    def _is_binary(data: bytes) -> bool:
+        return b"\0" in data[:8192]
+
+    def iter_source_files(self, file_name: str, content: bytes) -> Iterator[Tuple[str, str]]:
+        """Yield (path, source) for each indexable file; archives are streamed member by member."""
+        total_bytes = 0
+        files = 0
+
+        def accept(path: str, data: bytes) -> Optional[str]:
+            if self._is_binary(data):
+                return None
+            return data.decode("utf-8", errors="ignore")
+
+        lower_name = file_name.lower()
+        if lower_name.endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or self._should_skip(info.filename, info.file_size):
+                        continue
+                    if files >= self.MAX_FILES or total_bytes + info.file_size > self.MAX_TOTAL_BYTES:
+                        print(f"Code indexing limit reached for {file_name}, skipping remaining files")
+                        break
+                    source = accept(info.filename, archive.read(info))
+                    if source is not None:
+                        files += 1
+                        total_bytes += info.file_size
+                        yield info.filename, source
+
+        elif lower_name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+            with tarfile.open(fileobj=io.BytesIO(content), mode="r|*") as archive:
+                for member in archive:
+                    if not member.isfile() or self._should_skip(member.name, member.size):
+                        continue
+                    if files >= self.MAX_FILES or total_bytes + member.size > self.MAX_TOTAL_BYTES:
+                        print(f"Code indexing limit reached for {file_name}, skipping remaining files")
+                        break
+                    handle = archive.extractfile(member)
+                    if handle is None:
+                        continue
+                    source = accept(member.name, handle.read())
+                    if source is not None:
+                        files += 1
+                        total_bytes += member.size
+                        yield member.name, source
+
+        elif not self._should_skip(file_name, len(content)):
+            source = accept(file_name, content)
+            if source is not None:
+                yield file_name, source
+
+    def extract_symbols(self, path: str, source: str, language: str) -> List[Dict[str, Any]]:
+        """Split a source file into symbol chunks with 1-based inclusive line ranges."""
+        lines = source.splitlines()
+        if not lines:
+            return []
+
+        symbols = []
+        if language == "python":
+            symbols = self._python_symbols(source, lines)
+        elif language in BRACE_LANGUAGES:
+            symbols = self._brace_symbols(lines)
+
+        symbols = self._fill_gaps(symbols, lines, os.path.basename(path))
+
+        chunks = []
+        for symbol in symbols:
+            start, end = symbol["start_line"], symbol["end_line"]
+            if end - start + 1 <= self.MAX_SYMBOL_LINES:
+                chunks.append({**symbol, "code": "\n".join(lines[start - 1:end])})
+                continue
+            # Oversized symbol: keep the name, split the body into overlapping windows
+            step = self.WINDOW_LINES - self.WINDOW_OVERLAP
+            for part, window_start in enumerate(range(start, end + 1, step)):
+                window_end = min(window_start + self.WINDOW_LINES - 1, end)
+                chunks.append({
+                    **symbol,
+                    "start_line": window_start,
+                    "end_line": window_end,
+                    "part": part + 1,
+                    "code": "\n".join(lines[window_start - 1:window_end])
+                })
+                if window_end == end:
+                    break
+        return [c for c in chunks if c["code"].strip()]
+
+    def _python_symbols(self, source: str, lines: List[str]) -> List[Dict[str, Any]]:
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            return []
+
+        def span(node) -> Tuple[int, int]:
+            start = min([d.lineno for d in getattr(node, "decorator_list", [])] + [node.lineno])
+            return start, node.end_lineno or node.lineno
+
+        symbols = []
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                start, end = span(node)
+                symbols.append({"name": node.name, "kind": "function", "start_line": start, "end_line": end})
+            elif isinstance(node, ast.ClassDef):
+                start, end = span(node)
+                methods = [n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+                if end - start + 1 <= self.MAX_SYMBOL_LINES or not methods:
+                    symbols.append({"name": node.name, "kind": "class", "start_line": start, "end_line": end})
+                    continue
+                # Large class: header up to the first method, then one chunk per method
+                first_method_start = span(methods[0])[0]
+                symbols.append({"name": node.name, "kind": "class", "start_line": start, "end_line": max(start, first_method_start - 1)})
+                for method in methods:
+                    m_start, m_end = span(method)
+                    symbols.append({"name": f"{node.name}.{method.name}", "kind": "method", "start_line": m_start, "end_line": m_end})
+        return symbols
+
+    @staticmethod
+    def _fill_gaps(symbols: List[Dict[str, Any]], lines: List[str], module_name: str) -> List[Dict[str, Any]]:
+        """Add module-level chunks for non-blank code not covered by any symbol (imports, constants, scripts)."""
+        covered = bytearray(len(lines) + 2)
+        for symbol in symbols:
+            for i in range(symbol["start_line"], symbol["end_line"] + 1):
+                covered[i] = 1
+
+        filled = list(symbols)
+        run_start = None
+        for i in range(1, len(lines) + 2):
+            uncovered = i <= len(lines) and not covered[i]
+            if uncovered and run_start is None:
+                run_start = i
+            elif not uncovered and run_start is not None:
+                run = [j for j in range(run_start, i) if lines[j - 1].strip()]
+                if run:
+                    filled.append({"name": module_name, "kind": "module", "start_line": run[0], "end_line": run[-1]})
+                run_start = None
+        return sorted(filled, key=lambda s: s["start_line"])
+
+    def _brace_symbols(self, lines: List[str]) -> List[Dict[str, Any]]:
+        """Declaration regex plus a brace-matching pass; each line is scanned at most once."""
+        symbols = []
+        i = 0
+        n = len(lines)
+        while i < n:
+            match = BRACE_DECLARATION.match(lines[i]) or ARROW_DECLARATION.match(lines[i])
+            if not match:
+                i += 1
+                continue
+            kind = match.groupdict().get("kind") or "function"
+            end = self._find_block_end(lines, i)
+            if end is None:
+                i += 1
+                continue
+            # Oversized classes are windowed by extract_symbols, keeping the class name
+            symbols.append({"name": match.group("name"), "kind": kind, "start_line": i + 1, "end_line": end + 1})
+            i = end + 1
+        return symbols
+
+    @staticmethod
+    def _find_block_end(lines: List[str], start: int, max_lookahead: int = 5) -> Optional[int]:
+        depth = 0
+        opened = False
+        in_block_comment = False
+        for j in range(start, len(lines)):
+            line = lines[j]
+            k = 0
+            quote = None
+            while k < len(line):
+                ch = line[k]
+                nxt = line[k + 1] if k + 1 < len(line) else ""
+                if in_block_comment:
+                    if ch == "*" and nxt == "/":
+                        in_block_comment = False
+                        k += 1
+                elif quote:
+                    if ch == "\\":
+                        k += 1
+                    elif ch == quote:
+                        quote = None
+                elif ch == "/" and nxt == "/":
+                    break
+                elif ch == "/" and nxt == "*":
+                    in_block_comment = True
+                    k += 1
+                elif ch in ("'", '"', "`"):
+                    quote = ch
+                elif ch == "{":
+                    depth += 1
+                    opened = True
+                elif ch == "}":
+                    depth -= 1
+                    if opened and depth == 0:
+                        return j
+                k += 1
+            if not opened:
+                # Declaration without a body (prototype, type alias, one-liner)
+                if line.rstrip().endswith(";"):
+                    return j
+                if j - start >= max_lookahead:
+                    return None
+        return None
+
+    def _embedding_text(self, path: str, language: str, chunk: Dict[str, Any]) -> str:
+        part = f" (part {chunk['part']})" if chunk.get("part") else ""
+        header = f"{language} {chunk['kind']} {chunk['name']}{part} in {path}:{chunk['start_line']}-{chunk['end_line']}"
+        return f"{header}\n{chunk['code']}"
+
+    def index_upload(self, file_name: str, content: bytes, metadata: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Index an uploaded source file or archive. metadata must carry project_id and user_id.
+        Re-uploading a file replaces its previous symbols.
+        Blocking (parsing, embedding): run it off the event loop.
+        """
+        stats = {"files": 0, "symbols": 0}
+        texts: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+
+        def flush_batch():
+            if texts:
+                vector_store.add_texts(list(texts), list(metadatas), persist=False)
+                texts.clear()
+                metadatas.clear()
+
+        # Previously indexed files of the project, looked up once rather than per file
+        prefix = f"code:{metadata['project_id']}:"
+        indexed = vector_store.document_rows(prefix)
+
+        for path, source in self.iter_source_files(file_name, content):
+            language = self.detect_language(path)
+            document_id = f"{prefix}{path}"
+            rows = indexed.pop(document_id, None)
+            if rows:
+                vector_store.delete_document(document_id, persist=False, rows=rows)
+
+            for chunk in self.extract_symbols(path, source, language):
+                text = self._embedding_text(path, language, chunk)
+                texts.append(text)
+                metadatas.append({
+                    **metadata,
+                    "document_id": document_id,
+                    "type": "code_symbol",
+                    "filename": path,
+                    "path": path,
+                    "language": language,
+                    "symbol": chunk["name"],
+                    "kind": chunk["kind"],
+                    "start_line": chunk["start_line"],
+                    "end_line": chunk["end_line"],
+                    "text": text
+                })
+                stats["symbols"] += 1
+            stats["files"] += 1
+
+            if len(texts) >= self.EMBED_BATCH_SIZE:
+                flush_batch()
+
+        flush_batch()
+        vector_store.flush()
+        vector_store.maybe_compact()
+        return stats
+
+code_indexer = CodeIndexer()
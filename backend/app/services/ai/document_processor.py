@@ -1,11 +1,7 @@
-import pdfplumber
-import docx
-import io
-from typing import List, Dict, Any
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import List, Dict, Any, Optional, Tuple
 from langchain_experimental.text_splitter import SemanticChunker
 from app.services.ai.vector_store import vector_store
-from app.services.ai.ocr_client import ocr_client
+from app.services.ai.text_extraction import extract_text, make_recursive_splitter
 
 class SentenceTransformerWrapper:
     def __init__(self, model):
@@ -15,15 +11,14 @@ class SentenceTransformerWrapper:
     def embed_query(self, text):
         return self.model.encode([text])[0].tolist()
 
+# Recorded on every chunk, so a new version of a document is split the same way
+CHUNKER_RECURSIVE = "recursive"
+CHUNKER_SEMANTIC = "semantic"
+
 class DocumentProcessor:
     def __init__(self):
         # Fallback recursive splitter
-        self.recursive_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=120,
-            length_function=len,
-            is_separator_regex=False,
-        )
+        self.recursive_splitter = make_recursive_splitter()
 
         # Advanced Semantic Chunker (State-of-the-art)
         # It uses the same embedding model as vector_store for consistency
@@ -33,66 +28,66 @@ class DocumentProcessor:
         )
 
     def extract_text(self, file_content: bytes, file_name: str) -> str:
-        text = ""
-        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else ""
-
-        if file_ext == "pdf":
-            with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-                    else:
-                        # Attempt OCR on empty pages (scanned)
-                        try:
-                            # Convert page to image for OCR
-                            page_image = page.to_image().original
-                            img_byte_arr = io.BytesIO()
-                            page_image.save(img_byte_arr, format='PNG')
-                            ocr_text = ocr_client.extract_text(img_byte_arr.getvalue())
-                            if ocr_text:
-                                text += "[OCR]: " + ocr_text + "\n"
-                        except Exception as e:
-                            print(f"OCR Error on PDF page: {e}")
-
-        elif file_ext in ["docx", "doc"]:
-            doc = docx.Document(io.BytesIO(file_content))
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-        elif file_ext in ["png", "jpg", "jpeg", "webp"]:
-            # Direct OCR for image files
-            text = ocr_client.extract_text(file_content)
-        else:
-            # Fallback to plain text
-            try:
-                text = file_content.decode("utf-8", errors="ignore")
-            except Exception:
-                text = ""
-        return text
+        return extract_text(file_content, file_name)
 
-    async def process_and_index(self, file_content: bytes, file_name: str, metadata: Dict[str, Any], use_semantic: bool = True):
-        text = self.extract_text(file_content, file_name)
-        if not text.strip():
-            return 0
+    def split_text(self, text: str, use_semantic: bool = True) -> List[str]:
+        return self._split(text, use_semantic)[0]
 
+    def _split(self, text: str, use_semantic: bool) -> Tuple[List[str], str]:
+        """(chunks, chunker actually used)"""
         if use_semantic:
             try:
                 # Semantic chunking provides much better context preservation
-                chunks = self.semantic_splitter.split_text(text)
+                return self.semantic_splitter.split_text(text), CHUNKER_SEMANTIC
             except Exception as e:
                 print(f"Semantic chunking failed: {e}, falling back to recursive")
-                chunks = self.recursive_splitter.split_text(text)
-        else:
-            chunks = self.recursive_splitter.split_text(text)
+        return self.recursive_splitter.split_text(text), CHUNKER_RECURSIVE
 
+    def build_chunk_metadatas(self, chunks: List[str], metadata: Dict[str, Any], chunker: Optional[str] = None) -> List[Dict[str, Any]]:
         chunk_metadatas = []
         for i, chunk in enumerate(chunks):
             chunk_meta = metadata.copy()
+            if chunker:
+                chunk_meta["chunker"] = chunker
             chunk_meta["chunk_index"] = i
             chunk_meta["text"] = chunk # Store text in metadata for retrieval
             chunk_metadatas.append(chunk_meta)
+        return chunk_metadatas
 
-        vector_store.add_texts(chunks, chunk_metadatas)
+    async def process_and_index(self, file_content: bytes, file_name: str, metadata: Dict[str, Any], use_semantic: bool = True):
+        """
+        Documents that will get new versions should pass use_semantic=False: the recursive
+        splitter is deterministic, so a later version re-chunks identically except around
+        the edits (see reindex_document). Semantic boundaries shift on any edit.
+        """
+        text = self.extract_text(file_content, file_name)
+        if not text.strip():
+            return 0
+
+        chunks, chunker = self._split(text, use_semantic)
+        vector_store.add_texts(chunks, self.build_chunk_metadatas(chunks, metadata, chunker))
         return len(chunks)
 
+    def _document_chunker(self, document_id: str) -> str:
+        with vector_store.lock:
+            for i in vector_store.get_document_chunks(document_id):
+                return vector_store.metadata[i].get("chunker", CHUNKER_RECURSIVE)
+        return CHUNKER_RECURSIVE
+
+    async def reindex_document(self, file_content: bytes, file_name: str, metadata: Dict[str, Any], use_semantic: Optional[bool] = None) -> Dict[str, int]:
+        """
+        Re-index a new version of an existing document (metadata must carry document_id).
+        Only chunks whose content changed are embedded; removed chunks are tombstoned.
+        By default the new version is split with the chunker the indexed one was.
+        """
+        if use_semantic is None:
+            use_semantic = self._document_chunker(metadata["document_id"]) == CHUNKER_SEMANTIC
+        text = self.extract_text(file_content, file_name)
+        chunks, chunker = self._split(text, use_semantic) if text.strip() else ([], None)
+        return vector_store.update_document(
+            metadata["document_id"],
+            chunks,
+            self.build_chunk_metadatas(chunks, metadata, chunker)
+        )
+
 document_processor = DocumentProcessor()
@@ -1,11 +1,28 @@
 import base64
-import httpx
-import certifi
 import asyncio
-from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from app.core.config import settings
+from app.core.http_client import get_http_client
+from app.core.tiered_cache import TieredCache
+from app.core.tracing import tracer
 from loguru import logger
 
+# Enhanced perception prompt for better RAG context
+PERCEPTION_PROMPT = (
+    "Analyze this image in detail for a RAG (Retrieval-Augmented Generation) system. "
+    "1. Describe the main subject, setting, and composition. "
+    "2. Extract ALL visible text verbatim, preserving line breaks if possible. "
+    "3. Identify any charts, diagrams, or technical elements and describe their content. "
+    "4. Mention colors, textures, and specific objects if relevant. "
+    "Do not interpret, infer, or provide subjective opinions. Do not answer questions. "
+    "Be objective and thorough."
+)
+# Bump when PERCEPTION_PROMPT changes so cached descriptions are regenerated
+PROMPT_VERSION = 1
+
 class GeminiClient:
     """
     Client for Gemini 2.0 Flash API to handle visual perception.
@@ -17,92 +34,166 @@ class GeminiClient:
         self.model = "gemini-flash-latest"
         # Use v1beta for Gemini models to ensure multimodal support and latest features
         self.url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent?key={self.api_key}"
+        # Shared by every caller in the process
+        self.limiter = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENCY)
+        self._paused_until = 0.0
+        self.cache = TieredCache("vlm_desc", default_ttl=7 * 86400)
+
+    async def _load_image(self, image_source: str) -> Optional[Tuple[bytes, str]]:
+        """(image bytes, mime type) from a URL, data URL or bare base64 string."""
+        if image_source.startswith("http"):
+            # Fetch image from URL
+            try:
+                response = await get_http_client("fetch").get(image_source)
+                response.raise_for_status()
+                return response.content, response.headers.get("content-type", "image/jpeg")
+            except Exception as e:
+                logger.error(f"Error fetching image from URL: {e}")
+                return None
+
+        mime_type = "image/jpeg"
+        image_data = image_source
+        if "," in image_source:
+            header, image_data = image_source.split(",", 1)
+            if header.startswith("data:") and ";" in header:
+                mime_type = header[5:header.index(";")]
+        try:
+            return base64.b64decode(image_data), mime_type
+        except Exception as e:
+            logger.error(f"Invalid base64 image data: {e}")
+            return None
+
+    def _cache_key(self, image_bytes: bytes) -> str:
+        # Content hash, so re-signed URLs of the same file still hit
+        return f"{self.model}:{PROMPT_VERSION}:{hashlib.sha256(image_bytes).hexdigest()}"
 
     async def describe_image(self, image_source: str) -> Optional[str]:
         """
         Describe the image using Gemini 2.0 Flash.
         image_source can be a base64 string or a URL.
         Strictly follows the 'perception-only' rule.
-        Includes exponential backoff for 429 errors.
         Returns None if analysis fails.
         """
+        return (await self.describe_images([image_source]))[0]
+
+    async def describe_images(self, image_sources: List[str]) -> List[Optional[str]]:
+        """
+        Describe several images with as few Gemini round trips as possible:
+        cached descriptions (by content hash) are reused, the rest go out in one
+        multi-image request per batch. Falls back to per-image calls (bounded by the
+        shared limiter) if a batch answer cannot be split per image.
+        Returns one description (or None) per source, in order.
+        """
         if not self.api_key:
             logger.error("Gemini API key not found")
-            return None
-
-        image_data = ""
-        mime_type = "image/jpeg"
+            return [None] * len(image_sources)
+
+        images = await asyncio.gather(*[self._load_image(src) for src in image_sources])
+        keys = [self._cache_key(img[0]) if img else None for img in images]
+        cached = await self.cache.get_many([k for k in keys if k])
+        by_key = dict(zip([k for k in keys if k], cached))
+        tracer.annotate(images=len(image_sources), cache_hits=sum(1 for c in cached if c))
+
+        # Unique uncached images, in first-seen order
+        pending: Dict[str, Tuple[bytes, str]] = {}
+        for key, img in zip(keys, images):
+            if key and not by_key.get(key) and key not in pending:
+                pending[key] = img
+
+        pending_keys = list(pending)
+        batch_size = max(1, settings.GEMINI_BATCH_MAX_IMAGES)
+        batches = [pending_keys[i:i + batch_size] for i in range(0, len(pending_keys), batch_size)]
+        results = await asyncio.gather(*[self._describe_batch([pending[k] for k in batch]) for batch in batches])
+
+        fresh = {}
+        for batch, descriptions in zip(batches, results):
+            for key, desc in zip(batch, descriptions):
+                if desc:
+                    fresh[key] = desc
+        if fresh:
+            by_key.update(fresh)
+            await self.cache.set_many(fresh)
+
+        return [by_key.get(key) if key else None for key in keys]
+
+    async def _describe_batch(self, images: List[Tuple[bytes, str]]) -> List[Optional[str]]:
+        if len(images) == 1:
+            return [await self._describe_single(images[0])]
 
-        if image_source.startswith("http"):
-            # Fetch image from URL
-            try:
-                async with httpx.AsyncClient(verify=certifi.where()) as client:
-                    response = await client.get(image_source)
-                    response.raise_for_status()
-                    image_bytes = response.content
-                    image_data = base64.b64encode(image_bytes).decode("utf-8")
-                    mime_type = response.headers.get("content-type", "image/jpeg")
-            except Exception as e:
-                logger.error(f"Error fetching image from URL: {e}")
-                return None
-        else:
-            if "," in image_source:
-                image_data = image_source.split(",")[1]
-            else:
-                image_data = image_source
-
-        # Enhanced perception prompt for better RAG context
         prompt = (
-            "Analyze this image in detail for a RAG (Retrieval-Augmented Generation) system. "
-            "1. Describe the main subject, setting, and composition. "
-            "2. Extract ALL visible text verbatim, preserving line breaks if possible. "
-            "3. Identify any charts, diagrams, or technical elements and describe their content. "
-            "4. Mention colors, textures, and specific objects if relevant. "
-            "Do not interpret, infer, or provide subjective opinions. Do not answer questions. "
-            "Be objective and thorough."
+            f"You are given {len(images)} images. Analyze each one independently for a RAG system, "
+            "following these rules for every image:\n" + PERCEPTION_PROMPT + "\n"
+            f"Return a JSON array of exactly {len(images)} strings, the i-th string describing the i-th image."
         )
+        parts = [{"text": prompt}] + [self._image_part(img) for img in images]
+        text = await self._generate({
+            "contents": [{"parts": parts}],
+            "generationConfig": {"responseMimeType": "application/json"}
+        })
+
+        try:
+            descriptions = json.loads(text) if text else None
+            if isinstance(descriptions, list) and len(descriptions) == len(images):
+                return [str(d).strip() or None for d in descriptions]
+            logger.warning(f"Gemini batch answer did not match {len(images)} images, describing one by one")
+        except ValueError:
+            logger.warning("Gemini batch answer was not valid JSON, describing one by one")
+
+        return list(await asyncio.gather(*[self._describe_single(img) for img in images]))
+
+    async def _describe_single(self, image: Tuple[bytes, str]) -> Optional[str]:
+        return await self._generate({
+            "contents": [{"parts": [{"text": PERCEPTION_PROMPT}, self._image_part(image)]}]
+        })
+
+    @staticmethod
+    def _image_part(image: Tuple[bytes, str]) -> Dict[str, Any]:
+        image_bytes, mime_type = image
+        return {"inlineData": {"mimeType": mime_type, "data": base64.b64encode(image_bytes).decode("utf-8")}}
+
+    async def _generate(self, payload: Dict[str, Any]) -> Optional[str]:
+        """
+        POST generateContent under the shared limiter, with exponential backoff.
+        A 429 pauses every caller, not only the one that received it.
+        """
+        with tracer.span("vlm.generate", model=self.model,
+                         images=sum(1 for p in payload["contents"][0]["parts"] if "inlineData" in p)):
+            return await self._generate_with_retries(payload)
 
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inlineData": {
-                                "mimeType": mime_type,
-                                "data": image_data
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
-
+    async def _generate_with_retries(self, payload: Dict[str, Any]) -> Optional[str]:
         max_retries = 3
         base_delay = 2.0
 
         for attempt in range(max_retries):
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            tracer.annotate(attempts=attempt + 1)
             try:
-                async with httpx.AsyncClient(verify=certifi.where(), timeout=60.0) as client:
-                    response = await client.post(self.url, json=payload)
-
-                    if response.status_code == 429:
-                        delay = base_delay * (2 ** attempt)
-                        logger.warning(f"Gemini API rate limited (429). Retrying in {delay}s... (Attempt {attempt + 1}/{max_retries})")
-                        await asyncio.sleep(delay)
-                        continue
-
-                    response.raise_for_status()
-                    data = response.json()
-
-                    if "candidates" in data and data["candidates"]:
-                        content = data["candidates"][0].get("content", {})
-                        parts = content.get("parts", [])
-                        if parts:
-                            return parts[0].get("text", "").strip()
-
-                    logger.warning(f"Gemini API returned unexpected structure: {data}")
-                    return None
+                queued = time.monotonic()
+                async with self.limiter:
+                    tracer.add("queue_wait_ms", round((time.monotonic() - queued) * 1000, 1))
+                    response = await get_http_client("gemini").post(self.url, json=payload)
+
+                if response.status_code == 429:
+                    delay = base_delay * (2 ** attempt)
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    logger.warning(f"Gemini API rate limited (429). Retrying in {delay}s... (Attempt {attempt + 1}/{max_retries})")
+                    continue
+
+                response.raise_for_status()
+                data = response.json()
+                usage = data.get("usageMetadata") or {}
+                tracer.annotate(input_tokens=usage.get("promptTokenCount"), output_tokens=usage.get("candidatesTokenCount"))
+
+                if "candidates" in data and data["candidates"]:
+                    content = data["candidates"][0].get("content", {})
+                    parts = content.get("parts", [])
+                    if parts:
+                        return parts[0].get("text", "").strip()
+
+                logger.warning(f"Gemini API returned unexpected structure: {data}")
+                return None
 
             except Exception as e:
                 if attempt == max_retries - 1:
@@ -120,17 +211,13 @@ class GeminiClient:
         Wrapper to match the interface expected by AIRouter.
         Extracts images from messages and gets descriptions.
         """
-        descriptions = []
-
         # AIRouter sends perception_prompt with images in content list
-        for msg in messages:
-            if isinstance(msg.get("content"), list):
-                for item in msg["content"]:
-                    if item.get("type") == "image_url":
-                        img_url = item["image_url"]["url"]
-                        desc = await self.describe_image(img_url)
-                        if desc:
-                            descriptions.append(desc)
+        image_urls = [
+            item["image_url"]["url"]
+            for msg in messages if isinstance(msg.get("content"), list)
+            for item in msg["content"] if item.get("type") == "image_url"
+        ]
+        descriptions = [d for d in await self.describe_images(image_urls) if d] if image_urls else []
 
         return "\n\n".join(descriptions) if descriptions else "No images to describe."
 
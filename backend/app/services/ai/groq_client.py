@@ -8,10 +8,39 @@ Author: Engunity AI Team
 Date: 2026-01-10
 """
 
+import asyncio
 import os
+import time
+from collections import deque
 from groq import AsyncGroq
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from app.core.config import settings
+from app.core.tracing import tracer
+from app.services.ai.cache import prompt_hash
+from app.services.ai.singleflight import SingleFlight
+from app.services.ai.key_scheduler import KeyLease, KeyScheduler, LLMPriority, estimate_tokens
+from app.services.ai.token_budget import fit_messages, input_token_limit
+
+
+class TTFTTracker:
+    """Recent time-to-first-token samples; the hedging deadline is a high percentile of them."""
+
+    def __init__(self, percentile: float, min_delay: float, default_delay: float, window: int = 200, min_samples: int = 20):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def deadline(self) -> float:
+        if len(self.samples) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(self.samples)
+        value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return max(self.min_delay, value)
 
 
 class GroqClient:
@@ -23,6 +52,10 @@ class GroqClient:
     - Automatic system prompt injection
     - Configurable temperature and max tokens
     - Error handling and retries
+    - Identical concurrent requests share one upstream call (singleflight)
+    - Keys chosen by rate-limit headroom; calls queue while all keys are saturated
+    - Priority classes (LLMPriority) so background work cannot starve chat
+    - Streams fail over to another key mid-answer and hedge slow first tokens
     
     Usage:
         client = GroqClient()
@@ -49,7 +82,7 @@ class GroqClient:
         self.max_tokens = max_tokens
         self.temperature = temperature
         self.clients = []
-        self.current_client_index = 0
+        self.inflight = SingleFlight()
 
         # Load API keys from config
         api_keys = []
@@ -65,6 +98,19 @@ class GroqClient:
                 self.clients.append(AsyncGroq(api_key=key))
             print(f"INFO: GroqClient initialized with {len(self.clients)} API keys for rotation.")
 
+        self.scheduler = KeyScheduler(
+            self.clients,
+            requests_per_minute=settings.GROQ_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.GROQ_TOKENS_PER_MINUTE,
+            queue_timeout=settings.GROQ_QUEUE_TIMEOUT
+        )
+        self.ttft = TTFTTracker(
+            percentile=settings.GROQ_HEDGE_PERCENTILE,
+            min_delay=settings.GROQ_HEDGE_MIN_DELAY,
+            default_delay=settings.GROQ_HEDGE_DEFAULT_DELAY
+        )
+        self.stream_stats = {"failovers": 0, "hedges_fired": 0, "hedges_won": 0}
+
         # System prompt for Engunity AI
         self.system_prompt = (
             "You are Engunity AI, an expert assistant specializing in:\n"
@@ -78,85 +124,88 @@ class GroqClient:
             "Explain complex concepts with examples when appropriate."
         )
 
-    def _get_next_client(self) -> AsyncGroq:
+    @staticmethod
+    def _is_rate_limit(error: Exception) -> bool:
+        return any(x in str(error).lower() for x in ["rate_limit", "quota", "429"])
+
+    @staticmethod
+    def _error_headers(error: Exception):
+        return getattr(getattr(error, "response", None), "headers", None)
+
+    def _prepare_messages(self, messages: List[Dict[str, str]], model: str, max_tokens: int) -> List[Dict[str, str]]:
         """
-        Round-robin selection of the next available Groq client.
+        Inject the system prompt if missing, keep only fields the Groq API accepts and
+        trim the prompt so it fits the model's input limit.
         """
-        if not self.clients:
-            raise Exception("Groq AI is disabled: No API keys available.")
-
-        client = self.clients[self.current_client_index]
-        self.current_client_index = (self.current_client_index + 1) % len(self.clients)
-        return client
+        if not any(msg.get("role") == "system" for msg in messages):
+            messages = [{"role": "system", "content": self.system_prompt}, *messages]
+        messages = [
+            {k: v for k, v in msg.items() if k in ["role", "content", "name"]}
+            for msg in messages
+        ]
+        return fit_messages(messages, input_token_limit(model, max_tokens))
 
     async def get_completion(
         self,
         messages: List[Dict[str, str]],
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        priority: LLMPriority = LLMPriority.INTERACTIVE_CRITICAL
     ) -> str:
         """
         Get chat completion from Groq API with key rotation.
+        Concurrent calls with the same prompt and parameters are coalesced.
+        INTERACTIVE_OPTIONAL calls raise LLMCallShed when all keys are saturated.
         """
         if not self.clients:
             raise Exception("Groq AI is disabled: No API keys available.")
 
-        # Try multiple clients in case of rate limits
-        attempts = 0
-        max_attempts = len(self.clients)
+        model = model if model is not None else self.model
+        max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+        request = {
+            "model": model,
+            "messages": self._prepare_messages(messages, model, max_tokens),
+            "max_tokens": max_tokens,
+            "temperature": temperature if temperature is not None else self.temperature
+        }
+        return await self.inflight.do(prompt_hash(request), lambda: self._complete(request, priority))
+
+    async def _complete(self, request: Dict, priority: LLMPriority) -> str:
+        estimated = estimate_tokens(request["messages"], request["max_tokens"])
+        # Try multiple keys in case of rate limits, never the same key twice
+        tried = set()
         last_error = None
 
-        while attempts < max_attempts:
-            client = self._get_next_client()
+        while len(tried) < len(self.clients):
+            lease = await self.scheduler.acquire(request["model"], estimated, excluded=tried, priority=priority)
+            tried.add(lease.key.index)
+            tracer.add("queue_wait_ms", round(lease.queue_wait * 1000, 1))
+            tracer.annotate(key=lease.key.index, attempts=len(tried))
             try:
-                # Inject system prompt if not present
-                if not any(msg.get("role") == "system" for msg in messages):
-                    messages_with_system = [
-                        {"role": "system", "content": self.system_prompt},
-                        *messages
-                    ]
-                else:
-                    messages_with_system = messages
-
-                # Sanitize messages for Groq API (only keep role and content)
-                sanitized_messages = [
-                    {k: v for k, v in msg.items() if k in ["role", "content", "name"]}
-                    for msg in messages_with_system
-                ]
-
-                # Use provided overrides or defaults
-                temp = temperature if temperature is not None else self.temperature
-                max_tok = max_tokens if max_tokens is not None else self.max_tokens
-                target_model = model if model is not None else self.model
-
-                # Call Groq API
-                response = await client.chat.completions.create(
-                    model=target_model,
-                    messages=sanitized_messages,
-                    max_tokens=max_tok,
-                    temperature=temp,
-                    stream=False
-                )
-
-                # Extract and return content
-                content = response.choices[0].message.content
-
-                if not content:
-                    raise Exception("Groq API returned empty response")
-
-                return content
-
+                # Call Groq API; the raw response carries the rate-limit headers
+                raw = await lease.client.chat.completions.with_raw_response.create(**request, stream=False)
+                response = raw.parse()
             except Exception as e:
                 last_error = str(e)
-                # If it's a rate limit or quota error, try next key
-                if any(x in last_error.lower() for x in ["rate_limit", "quota", "429"]):
-                    print(f"WARNING: Key {attempts} rate limited, rotating to next key...")
-                    attempts += 1
+                if self._is_rate_limit(e):
+                    print(f"WARNING: Key {lease.key.index} rate limited, rotating to next key...")
+                    self.scheduler.mark_rate_limited(lease, self._error_headers(e))
                     continue
-                else:
-                    # For other errors, re-raise immediately
-                    raise Exception(f"Groq API error: {last_error}")
+                # For other errors, re-raise immediately
+                self.scheduler.release(lease, self._error_headers(e))
+                raise Exception(f"Groq API error: {last_error}")
+
+            usage = getattr(response, "usage", None)
+            self.scheduler.release(lease, raw.headers, getattr(usage, "total_tokens", None))
+            if usage is not None:
+                tracer.annotate(input_tokens=usage.prompt_tokens, output_tokens=usage.completion_tokens)
+
+            # Extract and return content
+            content = response.choices[0].message.content
+            if not content:
+                raise Exception("Groq API error: Groq API returned empty response")
+            return content
 
         raise Exception(f"All {len(self.clients)} Groq API keys failed. Last error: {last_error}")
 
@@ -164,55 +213,172 @@ class GroqClient:
         self,
         messages: List[Dict[str, str]],
         temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        priority: LLMPriority = LLMPriority.INTERACTIVE_CRITICAL,
+        model: Optional[str] = None
     ):
         """
         Get streaming chat completion from Groq API with key rotation.
-        Note: Rotation for streaming is handled at the start of the stream.
+        If the stream breaks, it resumes on another key from the partial answer.
+        Concurrent identical requests are served from one upstream stream.
         """
         if not self.clients:
             raise Exception("Groq AI is disabled: No API keys available.")
 
-        # For streaming, we pick a client and stick with it for that request
-        client = self._get_next_client()
+        model = model if model is not None else self.model
+        max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+        request = {
+            "model": model,
+            "messages": self._prepare_messages(messages, model, max_tokens),
+            "max_tokens": max_tokens,
+            "temperature": temperature if temperature is not None else self.temperature
+        }
+        async for chunk in self.inflight.stream(prompt_hash(request), lambda: self._stream(request, priority)):
+            yield chunk
+
+    async def _stream(self, request: Dict, priority: LLMPriority):
+        """
+        Stream with failover: when a stream breaks after some output, the request is
+        re-sent on another key with the partial answer as an assistant prefix, and only
+        the continuation is yielded. The first attempt is hedged (see _start_stream).
+        """
+        emitted = ""
+        tried = set()
+        failovers = 0
+
+        while True:
+            attempt = request
+            if emitted:
+                # Groq continues a trailing assistant message (prefill)
+                attempt = {
+                    **request,
+                    "messages": [*request["messages"], {"role": "assistant", "content": emitted}],
+                    "max_tokens": max(1, request["max_tokens"] - len(emitted) // 4)
+                }
 
+            try:
+                stream, first = await self._start_stream(attempt, priority, tried, hedge=not emitted)
+                if first is not None:
+                    emitted += first
+                    yield first
+                async for chunk in stream:
+                    emitted += chunk
+                    yield chunk
+                return
+            except Exception as e:
+                if failovers >= settings.GROQ_STREAM_MAX_FAILOVERS or len(tried) >= len(self.clients):
+                    raise
+                failovers += 1
+                self.stream_stats["failovers"] += 1
+                tracer.add("failovers")
+                print(f"WARNING: Groq stream failed after {len(emitted)} chars, resuming on another key: {e}")
+
+    async def _start_stream(
+        self,
+        request: Dict,
+        priority: LLMPriority,
+        tried: set,
+        hedge: bool
+    ) -> Tuple[AsyncIterator[str], Optional[str]]:
+        """
+        Open a stream and wait for its first chunk. If hedging is on and no token arrives
+        within the TTFT deadline, a backup request is started on a second key (only if one
+        is free right now); whichever produces a token first wins and the other is cancelled.
+        Returns (stream, first_chunk); first_chunk is None for an empty response.
+        """
+        estimated = estimate_tokens(request["messages"], request["max_tokens"])
+        lease = await self.scheduler.acquire(request["model"], estimated, excluded=tried, priority=priority)
+        tried.add(lease.key.index)
+        tracer.add("queue_wait_ms", round(lease.queue_wait * 1000, 1))
+        tracer.annotate(key=lease.key.index)
+
+        primary = self._stream_on(request, lease)
+        candidates = {asyncio.ensure_future(primary.__anext__()): (primary, lease)}
+
+        if (
+            hedge and settings.GROQ_HEDGE_ENABLED
+            and priority == LLMPriority.INTERACTIVE_CRITICAL and len(self.clients) > 1
+        ):
+            done, _ = await asyncio.wait(set(candidates), timeout=self.ttft.deadline())
+            if not done:
+                backup_lease = self.scheduler.try_acquire(request["model"], estimated, excluded=tried, priority=priority)
+                if backup_lease is not None:
+                    tried.add(backup_lease.key.index)
+                    self.stream_stats["hedges_fired"] += 1
+                    tracer.annotate(hedged=True)
+                    backup = self._stream_on(request, backup_lease)
+                    candidates[asyncio.ensure_future(backup.__anext__())] = (backup, backup_lease)
+
+        pending = set(candidates)
+        error = None
         try:
-            # Inject system prompt
-            if not any(msg.get("role") == "system" for msg in messages):
-                messages_with_system = [
-                    {"role": "system", "content": self.system_prompt},
-                    *messages
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [
+                    task for task in done
+                    if task.exception() is None or isinstance(task.exception(), StopAsyncIteration)
                 ]
-            else:
-                messages_with_system = messages
-
-            # Sanitize messages for Groq API (only keep role and content)
-            sanitized_messages = [
-                {k: v for k, v in msg.items() if k in ["role", "content", "name"]}
-                for msg in messages_with_system
-            ]
-
-            temp = temperature if temperature is not None else self.temperature
-            max_tok = max_tokens if max_tokens is not None else self.max_tokens
-
-            # Stream response
-            stream = await client.chat.completions.create(
-                model=self.model,
-                messages=sanitized_messages,
-                max_tokens=max_tok,
-                temperature=temp,
-                stream=True
-            )
+                if not winners:
+                    error = next(iter(done)).exception()
+                    continue
+
+                winner = winners[0]
+                # Cancel the losing attempt(s)
+                for other in (done | pending) - {winner}:
+                    await self._cancel_attempt(other, *candidates[other])
+                pending = set()
+                stream, winner_lease = candidates[winner]
+                if winner_lease is not lease:
+                    self.stream_stats["hedges_won"] += 1
+                first = None if winner.exception() is not None else winner.result()
+                return stream, first
+        except BaseException:
+            for task in pending:
+                await self._cancel_attempt(task, *candidates[task])
+            raise
+        raise error
+
+    async def _cancel_attempt(self, task: asyncio.Future, stream, lease: KeyLease):
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        await stream.aclose()
+        # The generator may have been cancelled before it started
+        self.scheduler.release(lease)
+
+    async def _stream_on(self, request: Dict, lease: KeyLease):
+        """One upstream streaming call on a leased key."""
+        estimated = lease.estimated_tokens
+        headers = None
+        output_chars = 0
+        started = time.monotonic()
+        try:
+            raw = await lease.client.chat.completions.with_raw_response.create(**request, stream=True)
+            headers = raw.headers
+            stream = raw.parse()
 
             async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    if output_chars == 0:
+                        self.ttft.observe(time.monotonic() - started)
+                    output_chars += len(content)
+                    yield content
 
         except Exception as e:
-            # Handle rate limit at start of stream
-            if any(x in str(e).lower() for x in ["rate_limit", "quota", "429"]):
-                 raise Exception(f"Groq streaming rate limit: {str(e)}. Try again to rotate keys.")
+            if self._is_rate_limit(e):
+                self.scheduler.mark_rate_limited(lease, self._error_headers(e))
+                raise Exception(f"Groq streaming rate limit: {str(e)}")
+            self.scheduler.release(lease, self._error_headers(e) or headers)
             raise Exception(f"Groq streaming error: {str(e)}")
+        finally:
+            # No-op if the lease was already returned above
+            self.scheduler.release(
+                lease, headers,
+                used_tokens=estimated - request["max_tokens"] + output_chars // 4
+            )
 
 
 # Singleton instance
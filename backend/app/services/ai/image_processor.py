@@ -304,50 +304,49 @@ class ImageProcessorService:
         Prioritizes existing descriptions and metadata in the DB.
         """
         visual_blocks = []
-        urls_to_process = []
 
-        # 1. Check database for existing descriptions if IDs provided
+        # 1. Check database for existing descriptions if IDs provided (one query for all ids)
         if image_ids and db:
             from app.models.image import Image as ImageModel
+            try:
+                db_images = {
+                    str(img.id): img
+                    for img in db.query(ImageModel).filter(ImageModel.id.in_(image_ids)).all()
+                }
+            except Exception as e:
+                print(f"Error fetching images {image_ids} from DB for context: {e}")
+                db_images = {}
+
             for img_id in image_ids:
-                try:
-                    db_image = db.query(ImageModel).filter(ImageModel.id == img_id).first()
-                    if db_image:
-                        tags_str = f" [Tags: {', '.join(db_image.tags)}]" if db_image.tags else ""
-                        safety_str = " (NSFW Flag)" if (hasattr(db_image, 'nsfw_score') and db_image.nsfw_score and db_image.nsfw_score > 0.8) else ""
-
-                        content = []
-                        if db_image.scene_description:
-                            content.append(f"Description: {db_image.scene_description}")
-                        if db_image.detected_text:
-                            content.append(f"Extracted Text: {db_image.detected_text}")
-
-                        visual_blocks.append(f"Image ({db_image.filename}){tags_str}{safety_str}: {' | '.join(content)}")
-                    else:
-                        # Refresh signed URL to ensure Gemini can access it if needed
-                        # Note: storage_service might need refresh for non-db images too
-                        pass
-                except Exception as e:
-                    print(f"Error fetching image {img_id} from DB for context: {e}")
+                db_image = db_images.get(str(img_id))
+                if not db_image:
+                    continue
+                tags_str = f" [Tags: {', '.join(db_image.tags)}]" if db_image.tags else ""
+                safety_str = " (NSFW Flag)" if (hasattr(db_image, 'nsfw_score') and db_image.nsfw_score and db_image.nsfw_score > 0.8) else ""
 
-        # 2. Add raw URLs provided in the request
-        if image_urls:
-            urls_to_process.extend(image_urls)
+                content = []
+                if db_image.scene_description:
+                    content.append(f"Description: {db_image.scene_description}")
+                if db_image.detected_text:
+                    content.append(f"Extracted Text: {db_image.detected_text}")
 
-        # 3. Generate descriptions for missing ones
-        if urls_to_process:
+                visual_blocks.append(f"Image ({db_image.filename}){tags_str}{safety_str}: {' | '.join(content)}")
+
+        # 2. Generate descriptions for raw URLs provided in the request
+        if image_urls:
             from app.services.ai.gemini_client import gemini_client
-            # Deduplicate URLs
-            unique_urls = list(set(urls_to_process))
+            # Deduplicate URLs, keeping request order
+            unique_urls = list(dict.fromkeys(image_urls))
 
-            # Serialize requests to avoid 429 Too Many Requests
-            for url in unique_urls:
-                try:
-                    desc = await gemini_client.describe_image(url)
-                    if desc:
-                        visual_blocks.append(f"Image {len(visual_blocks) + 1}: {desc}")
-                except Exception as e:
-                    print(f"Error generating description for {url}: {e}")
+            # Batched: cached by content hash, misses described in one multi-image request
+            try:
+                descriptions = await gemini_client.describe_images(unique_urls)
+            except Exception as e:
+                print(f"Error generating descriptions for {len(unique_urls)} images: {e}")
+                descriptions = []
+            for desc in descriptions:
+                if desc:
+                    visual_blocks.append(f"Image {len(visual_blocks) + 1}: {desc}")
 
         if not visual_blocks:
             return ""
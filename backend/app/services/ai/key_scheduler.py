@@ -0,0 +1,368 @@
+"""
+Rate-limit-aware scheduling of LLM calls across API keys.
+
+Each (key, model) pair has two token buckets, one for requests per minute and one
+for tokens per minute. Local estimates are charged when a call starts and
+corrected with the provider's rate-limit headers and reported usage once it
+returns. A call goes to the key with the most headroom; when every key is
+saturated the call waits in a queue until a bucket refills instead of failing.
+
+Calls carry an LLMPriority. Lower classes may only use a key while it keeps a
+reserved share of its budget free, queued calls are served strictly by priority,
+and interactive-optional calls are shed instead of queued when keys are saturated.
+"""
+
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from enum import IntEnum
+from typing import Any, Dict, List, Mapping, Optional
+
+from app.services.ai.token_budget import token_counter
+
+
+class LLMPriority(IntEnum):
+    """Lower values are served first."""
+    INTERACTIVE_CRITICAL = 0  # The answer the user is waiting for
+    INTERACTIVE_OPTIONAL = 1  # Quality stages on the request path that have a fallback
+    BACKGROUND = 2            # Indexing, summaries, titles, critique
+
+
+# Share of each bucket a key must still have free after granting a call of this class
+PRIORITY_RESERVE = {
+    LLMPriority.INTERACTIVE_CRITICAL: 0.0,
+    LLMPriority.INTERACTIVE_OPTIONAL: 0.1,
+    LLMPriority.BACKGROUND: 0.3,
+}
+
+
+class LLMCallShed(Exception):
+    """An optional call was dropped because every key is saturated."""
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int = 0) -> int:
+    """Token count of a prompt (with the LLM tokenizer when available) plus its completion budget."""
+    return token_counter.count_messages(messages) + max_tokens
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Parse Groq reset durations such as "7.66s", "2m59.56s", "1h2m3s" or "120ms" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        # now may predate a bucket created after the caller read the clock
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (amount is capped at capacity)."""
+        missing = min(amount, self.capacity) - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], reset_seconds: Optional[float], now: float):
+        """Adopt the provider's view of this bucket."""
+        if limit:
+            self.capacity = float(limit)
+            self.rate = max(self.rate, self.capacity / 60.0)
+        if remaining is not None:
+            self.tokens = min(self.capacity, float(remaining))
+            if reset_seconds and remaining < self.capacity:
+                # The window fully refills by the reset time
+                self.rate = max(self.rate, (self.capacity - remaining) / reset_seconds)
+        self.updated = now
+
+
+class KeyState:
+    """One API key and its per-model buckets."""
+
+    def __init__(self, index: int, client: Any, requests_per_minute: int, tokens_per_minute: int):
+        self.index = index
+        self.client = client
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self.blocked_until: Dict[str, float] = {}
+        self.in_flight = 0
+
+    def model_buckets(self, model: str) -> Dict[str, TokenBucket]:
+        if model not in self.buckets:
+            self.buckets[model] = {
+                "requests": TokenBucket(self.requests_per_minute),
+                "tokens": TokenBucket(self.tokens_per_minute)
+            }
+        return self.buckets[model]
+
+    def wait_time(self, model: str, tokens: int, now: float, reserve: float = 0.0) -> float:
+        """Seconds until this key can take the call while leaving reserve of each bucket free."""
+        buckets = self.model_buckets(model)
+        for bucket in buckets.values():
+            bucket.refill(now)
+        return max(
+            self.blocked_until.get(model, 0.0) - now,
+            buckets["requests"].wait_time(1 + reserve * buckets["requests"].capacity),
+            buckets["tokens"].wait_time(tokens + reserve * buckets["tokens"].capacity),
+            0.0
+        )
+
+    def headroom(self, model: str) -> float:
+        """Share of the tighter of the two buckets still available."""
+        buckets = self.model_buckets(model)
+        return min(b.tokens / b.capacity for b in buckets.values())
+
+    def consume(self, model: str, tokens: int):
+        buckets = self.model_buckets(model)
+        buckets["requests"].tokens -= 1
+        buckets["tokens"].tokens -= min(tokens, buckets["tokens"].capacity)
+        self.in_flight += 1
+
+
+class KeyLease:
+    """A granted slot on one key; report the outcome through KeyScheduler.release."""
+
+    def __init__(self, key: KeyState, model: str, estimated_tokens: int, priority: LLMPriority):
+        self.key = key
+        self.model = model
+        self.estimated_tokens = estimated_tokens
+        self.priority = priority
+        self.queue_wait = 0.0
+        self.released = False
+
+    @property
+    def client(self) -> Any:
+        return self.key.client
+
+
+class KeyScheduler:
+    def __init__(
+        self,
+        clients: List[Any],
+        requests_per_minute: int = 30,
+        tokens_per_minute: int = 12000,
+        queue_timeout: float = 120.0
+    ):
+        self.keys = [KeyState(i, c, requests_per_minute, tokens_per_minute) for i, c in enumerate(clients)]
+        self.queue_timeout = queue_timeout
+        self._waiters: List[tuple] = []  # heap of (priority, seq, future, model, tokens, excluded)
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {"granted": 0, "queued": 0, "rate_limited": 0, "timeouts": 0, "shed": 0, "preempted": 0}
+
+    def _pick(self, model: str, tokens: int, now: float, excluded=(), priority=LLMPriority.INTERACTIVE_CRITICAL) -> Optional[KeyState]:
+        reserve = PRIORITY_RESERVE[priority]
+        ready = [
+            key for key in self.keys
+            if key.index not in excluded and key.wait_time(model, tokens, now, reserve) == 0.0
+        ]
+        if not ready:
+            return None
+        return max(ready, key=lambda k: (k.headroom(model), -k.in_flight))
+
+    def _queued_ahead(self, priority: LLMPriority) -> bool:
+        return any(entry[0] <= priority and not entry[2].done() for entry in self._waiters)
+
+    async def acquire(
+        self,
+        model: str,
+        estimated_tokens: int,
+        excluded=(),
+        priority: LLMPriority = LLMPriority.INTERACTIVE_CRITICAL
+    ) -> KeyLease:
+        """
+        Lease the key with the most headroom for model, waiting if all keys are saturated.
+        Raises LLMCallShed instead of waiting for INTERACTIVE_OPTIONAL calls.
+        """
+        if not self.keys:
+            raise Exception("Groq AI is disabled: No API keys available.")
+        excluded = frozenset(excluded)
+        if len(excluded) >= len(self.keys):
+            excluded = frozenset()
+
+        now = time.monotonic()
+        if not self._queued_ahead(priority):
+            key = self._pick(model, estimated_tokens, now, excluded, priority)
+            if key is not None:
+                return self._grant(key, model, estimated_tokens, priority)
+
+        if priority == LLMPriority.INTERACTIVE_OPTIONAL:
+            self.stats["shed"] += 1
+            raise LLMCallShed("LLM keys saturated, optional stage skipped")
+
+        if priority == LLMPriority.INTERACTIVE_CRITICAL and any(
+            entry[0] == LLMPriority.BACKGROUND and not entry[2].done() for entry in self._waiters
+        ):
+            # Jumps ahead of queued background work
+            self.stats["preempted"] += 1
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future, model, estimated_tokens, excluded)
+        heapq.heappush(self._waiters, entry)
+        self.stats["queued"] += 1
+        self._schedule()
+
+        try:
+            lease = await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self._abandon(future)
+            raise Exception(f"All Groq API keys saturated for {self.queue_timeout:.0f}s; request timed out in queue")
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        lease.queue_wait = time.monotonic() - now
+        return lease
+
+    def try_acquire(
+        self,
+        model: str,
+        estimated_tokens: int,
+        excluded=(),
+        priority: LLMPriority = LLMPriority.INTERACTIVE_CRITICAL
+    ) -> Optional[KeyLease]:
+        """Lease a key only if one is free right now (used for hedged requests)."""
+        excluded = frozenset(excluded)
+        if len(excluded) >= len(self.keys) or self._queued_ahead(priority):
+            return None
+        key = self._pick(model, estimated_tokens, time.monotonic(), excluded, priority)
+        return self._grant(key, model, estimated_tokens, priority) if key is not None else None
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # Granted just as we gave up: hand the slot back
+            self.release(future.result())
+        else:
+            future.cancel()
+
+    def _grant(self, key: KeyState, model: str, tokens: int, priority: LLMPriority) -> KeyLease:
+        key.consume(model, tokens)
+        self.stats["granted"] += 1
+        return KeyLease(key, model, tokens, priority)
+
+    def _dispatch(self):
+        """Serve queued calls strictly in priority order; lower classes never overtake the head."""
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            priority, _, future, model, tokens, excluded = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            key = self._pick(model, tokens, now, excluded, priority)
+            if key is None:
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(self._grant(key, model, tokens, priority))
+        self._schedule()
+
+    def _schedule(self):
+        """Wake the dispatcher when the queue head could next be served."""
+        if self._timer is not None or not self._waiters:
+            return
+        priority, _, _, model, tokens, excluded = self._waiters[0]
+        reserve = PRIORITY_RESERVE[priority]
+        now = time.monotonic()
+        delays = [k.wait_time(model, tokens, now, reserve) for k in self.keys if k.index not in excluded]
+        delay = min(delays) if delays else 1.0
+        self._timer = asyncio.get_running_loop().call_later(max(delay, 0.01), self._dispatch)
+
+    def release(
+        self,
+        lease: KeyLease,
+        headers: Optional[Mapping[str, str]] = None,
+        used_tokens: Optional[int] = None
+    ):
+        """Return a lease, correcting the local estimate with actual usage and rate-limit headers."""
+        if lease.released:
+            return
+        lease.released = True
+        key = lease.key
+        key.in_flight = max(0, key.in_flight - 1)
+        now = time.monotonic()
+        buckets = key.model_buckets(lease.model)
+
+        if used_tokens is not None:
+            buckets["tokens"].tokens = min(
+                buckets["tokens"].capacity,
+                buckets["tokens"].tokens + lease.estimated_tokens - used_tokens
+            )
+
+        if headers:
+            self._sync_headers(key, lease.model, headers, now)
+
+        if self._waiters:
+            self._dispatch()
+
+    def _sync_headers(self, key: KeyState, model: str, headers: Mapping[str, str], now: float):
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        buckets = key.model_buckets(model)
+        buckets["tokens"].refill(now)
+        buckets["tokens"].sync(
+            number("x-ratelimit-limit-tokens"),
+            number("x-ratelimit-remaining-tokens"),
+            parse_reset(headers.get("x-ratelimit-reset-tokens")),
+            now
+        )
+        # Groq's request headers describe the daily quota: block the key once it is used up
+        if number("x-ratelimit-remaining-requests") == 0:
+            reset = parse_reset(headers.get("x-ratelimit-reset-requests")) or 60.0
+            key.blocked_until[model] = now + reset
+
+    def mark_rate_limited(self, lease: KeyLease, headers: Optional[Mapping[str, str]] = None):
+        """The provider rejected the call with a 429: block the key until it says it may retry."""
+        self.stats["rate_limited"] += 1
+        retry_after = parse_reset((headers or {}).get("retry-after")) or 5.0
+        lease.key.blocked_until[lease.model] = time.monotonic() + retry_after
+        buckets = lease.key.model_buckets(lease.model)
+        buckets["tokens"].tokens = min(buckets["tokens"].tokens, 0.0)
+        self.release(lease, headers)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "stats": dict(self.stats),
+            "queued": {
+                p.name.lower(): sum(1 for e in self._waiters if e[0] == p and not e[2].done())
+                for p in LLMPriority
+            },
+            "keys": [
+                {
+                    "index": key.index,
+                    "in_flight": key.in_flight,
+                    "models": {
+                        model: {
+                            "requests": round(b["requests"].tokens, 1),
+                            "tokens": round(b["tokens"].tokens),
+                            "blocked_for": round(max(0.0, key.blocked_until.get(model, 0.0) - now), 1)
+                        }
+                        for model, b in key.buckets.items()
+                    }
+                }
+                for key in self.keys
+            ]
+        }
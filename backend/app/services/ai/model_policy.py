@@ -0,0 +1,258 @@
+"""
+Declarative per-stage LLM policy (RAG pipeline stages, titles, history summaries).
+
+Every LLM call is made on behalf of a named stage. The stage decides the model,
+max_tokens, temperature and priority; cheap auxiliary stages run on the fast model
+and escalate to the strong one when their output fails validation. Latency, token
+and escalation counters are kept per stage so the policy can be tuned.
+"""
+
+import json
+import re
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.tracing import tracer
+from app.services.ai.key_scheduler import LLMPriority, estimate_tokens
+
+FAST_MODEL = "llama-3.1-8b-instant"
+STRONG_MODEL = "llama-3.3-70b-versatile"
+
+# stage -> call parameters. None means "use the call site's / client's value".
+STAGE_POLICIES: Dict[str, Dict[str, Any]] = {
+    "query_plan": {"model": FAST_MODEL, "max_tokens": 900, "temperature": 0.3,
+                   "priority": LLMPriority.INTERACTIVE_OPTIONAL, "escalate_to": STRONG_MODEL},
+    "rewrite": {"model": FAST_MODEL, "max_tokens": 100, "temperature": 0.2,
+                "priority": LLMPriority.INTERACTIVE_OPTIONAL, "escalate_to": STRONG_MODEL},
+    "multi_query": {"model": FAST_MODEL, "max_tokens": 150, "temperature": 0.6,
+                    "priority": LLMPriority.INTERACTIVE_OPTIONAL, "escalate_to": STRONG_MODEL},
+    "hyde": {"model": FAST_MODEL, "max_tokens": 200, "temperature": 0.3,
+             "priority": LLMPriority.INTERACTIVE_OPTIONAL},
+    "crag_eval": {"model": FAST_MODEL, "max_tokens": 10, "temperature": 0.1,
+                  "priority": LLMPriority.INTERACTIVE_OPTIONAL, "escalate_to": STRONG_MODEL},
+    "partial_answer": {"model": FAST_MODEL, "max_tokens": 250, "temperature": 0.2,
+                       "priority": LLMPriority.INTERACTIVE_CRITICAL, "escalate_to": STRONG_MODEL},
+    "direct_answer": {"model": STRONG_MODEL, "max_tokens": None, "temperature": None,
+                      "priority": LLMPriority.INTERACTIVE_CRITICAL},
+    "generation": {"model": STRONG_MODEL, "max_tokens": None, "temperature": 0.3,
+                   "priority": LLMPriority.INTERACTIVE_CRITICAL},
+    "synthesis": {"model": STRONG_MODEL, "max_tokens": None, "temperature": 0.3,
+                  "priority": LLMPriority.INTERACTIVE_CRITICAL},
+    "refine": {"model": FAST_MODEL, "max_tokens": 2048, "temperature": 0.5,
+               "priority": LLMPriority.INTERACTIVE_OPTIONAL},
+    "critique": {"model": FAST_MODEL, "max_tokens": 300, "temperature": 0.1,
+                 "priority": LLMPriority.BACKGROUND, "escalate_to": STRONG_MODEL},
+    "entity_extraction": {"model": FAST_MODEL, "max_tokens": 2048, "temperature": 0.1,
+                          "priority": LLMPriority.BACKGROUND, "escalate_to": STRONG_MODEL},
+    "community_summary": {"model": FAST_MODEL, "max_tokens": 300, "temperature": None,
+                          "priority": LLMPriority.BACKGROUND},
+    "memory_summary": {"model": FAST_MODEL, "max_tokens": 200, "temperature": 0.3,
+                       "priority": LLMPriority.INTERACTIVE_OPTIONAL},
+    "title": {"model": FAST_MODEL, "max_tokens": 20, "temperature": 0.3,
+              "priority": LLMPriority.BACKGROUND},
+}
+
+
+def _valid_json(text: str) -> bool:
+    text = text.strip()
+    if "```" in text:
+        text = text.split("```json")[-1] if "```json" in text else text.split("```")[1]
+        text = text.split("```")[0]
+    try:
+        json.loads(text.strip())
+        return True
+    except ValueError:
+        return False
+
+
+# stage -> check on the cheap model's output; failing it triggers escalation
+STAGE_VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    "query_plan": _valid_json,
+    "rewrite": lambda out: 0 < len(out.strip()) <= 300 and "\n\n" not in out.strip(),
+    "multi_query": lambda out: len([q for q in out.split("\n") if q.strip()]) >= 2,
+    "crag_eval": lambda out: any(r in out.upper() for r in ("CORRECT", "AMBIGUOUS", "INCORRECT")),
+    "partial_answer": lambda out: len(out.strip()) > 20,
+    "critique": lambda out: re.search(r"0\.\d+|1\.0", out) is not None,
+    "entity_extraction": _valid_json,
+}
+
+
+def _load_policies() -> Dict[str, Dict[str, Any]]:
+    """Defaults merged with the LLM_STAGE_POLICY JSON override from settings."""
+    policies = {stage: dict(policy) for stage, policy in STAGE_POLICIES.items()}
+    if settings.LLM_STAGE_POLICY:
+        try:
+            for stage, override in json.loads(settings.LLM_STAGE_POLICY).items():
+                if "priority" in override:
+                    override["priority"] = LLMPriority[override["priority"].upper()]
+                policies.setdefault(stage, {}).update(override)
+        except Exception as e:
+            logger.error(f"Ignoring invalid LLM_STAGE_POLICY: {e}")
+    return policies
+
+
+class StageMetrics:
+    """Per-stage call, latency, token and escalation counters."""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def _stage(self, stage: str) -> Dict[str, Any]:
+        if stage not in self.stages:
+            self.stages[stage] = {
+                "calls": 0, "errors": 0, "escalations": 0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "models": {}, "latencies": deque(maxlen=self.window)
+            }
+        return self.stages[stage]
+
+    def record(self, stage: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int, error: bool = False):
+        data = self._stage(stage)
+        data["calls"] += 1
+        data["errors"] += int(error)
+        data["prompt_tokens"] += prompt_tokens
+        data["completion_tokens"] += completion_tokens
+        data["models"][model] = data["models"].get(model, 0) + 1
+        data["latencies"].append(seconds)
+
+    def record_escalation(self, stage: str):
+        self._stage(stage)["escalations"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        result = {}
+        for stage, data in self.stages.items():
+            latencies = sorted(data["latencies"])
+
+            def pct(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+
+            result[stage] = {
+                **{k: v for k, v in data.items() if k != "latencies"},
+                "p50_ms": pct(0.5),
+                "p95_ms": pct(0.95),
+                "escalation_rate": round(data["escalations"] / data["calls"], 3) if data["calls"] else 0.0
+            }
+        return result
+
+
+stage_metrics = StageMetrics()
+
+
+class StageClient:
+    """
+    LLM client bound to one stage. Same interface as GroqClient, so components that
+    take an llm_client can be handed one; the stage policy overrides call-site values.
+    """
+
+    def __init__(self, llm_client, stage: str, policy: Dict[str, Any]):
+        self.llm = llm_client
+        self.stage = stage
+        self.policy = policy
+        self.validate = STAGE_VALIDATORS.get(stage)
+
+    def _params(self, temperature, max_tokens, model, priority) -> Dict[str, Any]:
+        def pick(name, fallback):
+            value = self.policy.get(name)
+            return value if value is not None else fallback
+
+        params = {
+            "temperature": pick("temperature", temperature),
+            "max_tokens": pick("max_tokens", max_tokens),
+            "model": pick("model", model),
+        }
+        resolved_priority = pick("priority", priority)
+        if resolved_priority is not None:
+            params["priority"] = resolved_priority
+        return params
+
+    async def _call(self, messages: List[Dict[str, str]], params: Dict[str, Any], escalated: bool = False) -> str:
+        start = time.perf_counter()
+        prompt_tokens = estimate_tokens(messages)
+        model = params.get("model") or "default"
+        with tracer.span(f"llm.{self.stage}", stage=self.stage, model=model, escalated=escalated,
+                         input_tokens=prompt_tokens, max_tokens=params.get("max_tokens")) as span:
+            try:
+                result = await self.llm.get_completion(messages, **params)
+            except Exception:
+                stage_metrics.record(self.stage, model, time.perf_counter() - start, prompt_tokens, 0, error=True)
+                raise
+            completion_tokens = len(result) // 4
+            if span is not None:
+                # The client annotates the provider's usage on this span; estimates only fill gaps
+                completion_tokens = span.attributes.setdefault("output_tokens", completion_tokens)
+                prompt_tokens = span.attributes.get("input_tokens", prompt_tokens)
+        stage_metrics.record(self.stage, model, time.perf_counter() - start, prompt_tokens, completion_tokens)
+        return result
+
+    async def get_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+        priority: Optional[LLMPriority] = None
+    ) -> str:
+        params = self._params(temperature, max_tokens, model, priority)
+        result = await self._call(messages, params)
+
+        escalate_to = self.policy.get("escalate_to")
+        if self.validate and escalate_to and params.get("model") != escalate_to and not self.validate(result):
+            logger.info(f"Stage '{self.stage}' output failed validation on {params.get('model')}, escalating to {escalate_to}")
+            stage_metrics.record_escalation(self.stage)
+            result = await self._call(messages, {**params, "model": escalate_to}, escalated=True)
+        return result
+
+    async def get_streaming_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        priority: Optional[LLMPriority] = None
+    ):
+        params = self._params(temperature, max_tokens, None, priority)
+        start = time.perf_counter()
+        chars = 0
+        error = False
+        model = params.get("model") or "default"
+        with tracer.span(f"llm.{self.stage}", stage=self.stage, model=model, streaming=True,
+                         input_tokens=estimate_tokens(messages), max_tokens=params.get("max_tokens")) as span:
+            try:
+                async for chunk in self.llm.get_streaming_completion(messages, **params):
+                    if chars == 0 and span is not None:
+                        span.attributes["ttft_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                    chars += len(chunk)
+                    yield chunk
+            except Exception:
+                error = True
+                raise
+            finally:
+                if span is not None:
+                    span.attributes.setdefault("output_tokens", chars // 4)
+                stage_metrics.record(self.stage, model, time.perf_counter() - start, estimate_tokens(messages), chars // 4, error=error)
+
+
+class ModelPolicy:
+    """Hands out StageClients for an underlying LLM client."""
+
+    def __init__(self, llm_client):
+        self.llm = llm_client
+        self.policies = _load_policies()
+        self._clients: Dict[str, StageClient] = {}
+
+    def for_stage(self, stage: str) -> StageClient:
+        if stage not in self._clients:
+            self._clients[stage] = StageClient(self.llm, stage, self.policies.get(stage, {}))
+        return self._clients[stage]
+
+
+def _default_policy() -> ModelPolicy:
+    from app.services.ai.groq_client import groq_client
+    return ModelPolicy(groq_client)
+
+
+model_policy = _default_policy()
@@ -1,9 +1,23 @@
 from typing import List, Dict, Any, Optional
 from app.services.ai.groq_client import groq_client
 from app.services.ai.cache import ai_cache
+from app.services.ai.semantic_cache import semantic_cache
 from app.services.ai.logger import ai_logger
+from app.services.ai.model_policy import model_policy
 
 class AIRouter:
+    @staticmethod
+    def _semantic_key(messages: List[Dict[str, str]], context_fingerprint: Optional[str]) -> Optional[str]:
+        """
+        Semantic cache fingerprint for the final user turn, or None when it should not be used.
+        Includes the previous assistant reply so follow-ups ("and the second one?") only
+        match within the same conversational state.
+        """
+        if context_fingerprint is None or not messages or messages[-1]["role"] != "user":
+            return None
+        previous_reply = next((m["content"] for m in reversed(messages[:-1]) if m["role"] == "assistant"), None)
+        return semantic_cache.fingerprint([], context_fingerprint, previous_reply)
+
     async def route_request(
         self,
         messages: List[Dict[str, str]],
@@ -12,7 +26,8 @@ class AIRouter:
         preference: str = "performance",
         image_urls: Optional[List[str]] = None,
         image_ids: Optional[List[str]] = None,
-        db = None
+        db = None,
+        context_fingerprint: Optional[str] = None
     ) -> str:
         # 0. Visual Perception
         visual_context = ""
@@ -43,12 +58,28 @@ class AIRouter:
                 )
             return cached_response
 
+        # 1b. Semantic cache: paraphrases of an earlier question over the same context
+        semantic_key = None if visual_context else self._semantic_key(messages, context_fingerprint)
+        if semantic_key and user_id:
+            cached_response = await semantic_cache.get(user_id, messages[-1]["content"], semantic_key)
+            if cached_response:
+                await ai_logger.log_event(
+                    event_type="ai_semantic_cache_hit",
+                    user_id=user_id,
+                    session_id=session_id,
+                    model="semantic-cache",
+                    details={"query": messages[-1]["content"], "response": cached_response}
+                )
+                return cached_response
+
         # 2. Route to LLM (Groq for now)
         # Simple routing logic: Performance uses Groq (Llama3)
         response = await groq_client.get_completion(messages)
 
         # 3. Cache the response in Redis
         await ai_cache.set(messages, response)
+        if semantic_key and user_id:
+            await semantic_cache.set(user_id, messages[-1]["content"], semantic_key, response)
 
         # 4. Log the AI interaction to MongoDB
         if user_id:
@@ -69,7 +100,8 @@ class AIRouter:
         session_id: Optional[str] = None,
         image_urls: Optional[List[str]] = None,
         image_ids: Optional[List[str]] = None,
-        db = None
+        db = None,
+        context_fingerprint: Optional[str] = None
     ):
         """
         Route request for streaming completion.
@@ -91,6 +123,13 @@ class AIRouter:
             if messages and messages[-1]["role"] == "user":
                 messages[-1]["content"] = f"{visual_context}\n\nUser Question: {messages[-1]['content']}"
 
+        semantic_key = None if visual_context else self._semantic_key(messages, context_fingerprint)
+        if semantic_key and user_id:
+            cached_response = await semantic_cache.get(user_id, messages[-1]["content"], semantic_key)
+            if cached_response:
+                yield cached_response
+                return
+
         full_content = ""
 
         async for chunk in groq_client.get_streaming_completion(messages):
@@ -109,6 +148,8 @@ class AIRouter:
 
         # Optionally cache the full result
         await ai_cache.set(messages, full_content)
+        if semantic_key and user_id:
+            await semantic_cache.set(user_id, messages[-1]["content"], semantic_key, full_content)
 
     async def generate_title(self, user_message: str) -> str:
         """
@@ -126,13 +167,8 @@ class AIRouter:
         ]
 
         try:
-            # Use the faster/smaller model for title generation
-            title = await groq_client.get_completion(
-                prompt,
-                temperature=0.3,
-                max_tokens=20,
-                model="llama-3.1-8b-instant"
-            )
+            # The "title" stage runs on the faster/smaller model in the background class
+            title = await model_policy.for_stage("title").get_completion(prompt)
             # Clean up the response just in case
             return title.strip().strip('"').strip("'").split('\n')[0][:50]
         except Exception as e:
@@ -0,0 +1,109 @@
+import re
+from typing import Dict, List
+
+# Canonical section name -> heading variants found in papers
+SECTION_HEADINGS = {
+    "abstract": ["abstract", "summary"],
+    "introduction": ["introduction", "overview", "motivation"],
+    "background": ["background", "related work", "related works", "literature review", "preliminaries", "prior work"],
+    "methods": [
+        "method", "methods", "methodology", "approach", "proposed method", "proposed approach",
+        "materials and methods", "model", "system design", "architecture", "experimental setup", "implementation"
+    ],
+    "results": ["results", "experiments", "experimental results", "evaluation", "findings", "analysis"],
+    "discussion": ["discussion", "limitations", "threats to validity", "future work"],
+    "conclusion": ["conclusion", "conclusions", "concluding remarks", "summary and conclusion"],
+    "acknowledgements": ["acknowledgements", "acknowledgments", "acknowledgement", "acknowledgment"],
+    "references": ["references", "bibliography", "works cited", "literature cited"],
+    "appendix": ["appendix", "appendices", "supplementary material"],
+}
+
+_HEADING_TO_SECTION = {variant: name for name, variants in SECTION_HEADINGS.items() for variant in variants}
+
+# Optional numbering ("3.", "3.1", "III.", "A.") followed by a known heading
+_HEADING_PATTERN = re.compile(
+    r"^\s*(?:(?P<number>\d+(?:\.\d+)*|[IVXLC]+|[A-H])[.)]?\s+)?"
+    r"(?P<heading>[A-Za-z][A-Za-z &-]{2,60}?)\s*(?P<end>[:.]?)\s*$"
+)
+# "3", "IV": a top-level section number, which also ends the references section
+_MAIN_SECTION_NUMBER = re.compile(r"^(?:\d+|[IVXLC]+)$")
+# "Abstract—We propose ..." / "Abstract: We propose ..."
+_INLINE_ABSTRACT = re.compile(r"^\s*abstract\s*[-—–:.]\s*(?P<body>\S.*)$", re.IGNORECASE)
+
+# Reference entries usually start with "[12]", "12." or "12 "
+_REFERENCE_START = re.compile(r"^\s*(?:\[\d+\]|\d{1,3}\.\s|\d{1,3}\s+[A-Z])")
+
+_MAX_HEADING_LENGTH = 80
+
+
+def _match_heading(line: str, allow_period: bool = False):
+    """
+    (section name, number or None) if line is a heading. Headings are numbered or
+    capitalized; a trailing period ("Abstract.") is only accepted when allow_period is
+    set, so a wrapped body line such as "references." is never a heading.
+    """
+    if len(line) > _MAX_HEADING_LENGTH:
+        return None
+    match = _HEADING_PATTERN.match(line)
+    if not match:
+        return None
+    number = match.group("number")
+    if not number and not match.group("heading")[0].isupper():
+        return None
+    if match.group("end") == "." and not allow_period:
+        return None
+    heading = match.group("heading").strip().lower()
+    if heading not in _HEADING_TO_SECTION:
+        # Lettered headings such as "Appendix A"
+        heading = re.sub(r"\s+\w{1,2}$", "", heading)
+    name = _HEADING_TO_SECTION.get(heading)
+    return (name, number) if name else None
+
+
+def detect_sections(text: str) -> List[Dict[str, str]]:
+    """
+    Split paper text into canonical sections in a single pass over its lines.
+    Returns [{"name", "title", "text"}]; text before the first heading is "front_matter".
+    Unknown headings stay inside the current section. References end at an appendix
+    or a numbered top-level heading (some papers put them before the appendix sections).
+    """
+    sections = [{"name": "front_matter", "title": "Front Matter", "lines": []}]
+
+    for line in text.splitlines():
+        inline = _INLINE_ABSTRACT.match(line)
+        if inline and sections[-1]["name"] == "front_matter":
+            sections.append({"name": "abstract", "title": "Abstract", "lines": [inline.group("body")]})
+            continue
+
+        # "Abstract." style run-in headings only occur before the body starts
+        heading = _match_heading(line, allow_period=sections[-1]["name"] == "front_matter")
+        if heading:
+            name, number = heading
+            in_references = sections[-1]["name"] == "references"
+            if not in_references or name == "appendix" or (number and _MAIN_SECTION_NUMBER.match(number)):
+                sections.append({"name": name, "title": line.strip(), "lines": []})
+                continue
+
+        sections[-1]["lines"].append(line)
+
+    result = []
+    for section in sections:
+        body = "\n".join(section["lines"]).strip()
+        if body:
+            result.append({"name": section["name"], "title": section["title"], "text": body})
+    return result
+
+
+def split_references(text: str) -> List[str]:
+    """Split a references section into individual entries."""
+    entries: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if _REFERENCE_START.match(line) or not entries:
+            entries.append(line)
+        else:
+            # Continuation of a wrapped entry
+            entries[-1] = f"{entries[-1]} {line}"
+    return entries
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.services.ai.cache import normalize_query
+from app.services.ai.vector_store import vector_store
+
+
+class _UserIndex:
+    """Normalized query embeddings of one user's cached responses, searched by inner product."""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.empty((0, dimension), dtype="float32")
+        self.entries: List[Dict[str, Any]] = []
+
+    def search(self, vector: np.ndarray, fingerprint: str, threshold: float, now: float) -> Optional[Dict[str, Any]]:
+        if not self.entries:
+            return None
+        scores = self.vectors @ vector
+        for i in np.argsort(-scores):
+            if scores[i] < threshold:
+                break
+            entry = self.entries[i]
+            if entry["fingerprint"] == fingerprint and entry["expires_at"] > now:
+                return {**entry, "similarity": float(scores[i])}
+        return None
+
+    def add(self, vector: np.ndarray, entry: Dict[str, Any], max_entries: int, now: float):
+        # Drop expired entries and the oldest ones beyond capacity
+        keep = [i for i, e in enumerate(self.entries) if e["expires_at"] > now]
+        keep = keep[max(0, len(keep) - max_entries + 1):]
+        self.vectors = np.vstack([self.vectors[keep], vector[None, :]])
+        self.entries = [self.entries[i] for i in keep] + [entry]
+
+
+class SemanticCache:
+    """
+    Response cache keyed by meaning rather than exact prompt text.
+
+    Sits behind AICache: a lookup embeds the normalized final user query and searches
+    that user's cached queries for a neighbour above the similarity threshold whose
+    retrieved-context fingerprint is identical. Entries expire after a TTL and a user's
+    whole index is dropped whenever their documents change in the vector store.
+    """
+
+    def __init__(
+        self,
+        threshold: float = settings.SEMANTIC_CACHE_THRESHOLD,
+        ttl: int = settings.SEMANTIC_CACHE_TTL,
+        max_entries: int = settings.SEMANTIC_CACHE_MAX_ENTRIES
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = settings.SEMANTIC_CACHE_ENABLED
+        self._indexes: Dict[str, _UserIndex] = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        vector_store.add_change_listener(self.invalidate)
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return normalize_query(query)
+
+    @staticmethod
+    def fingerprint(contexts: Iterable[str], *extra: Optional[str]) -> str:
+        """Order-independent hash of the retrieved context set (plus any extra scoping strings)."""
+        digests = sorted(hashlib.sha256(c.encode("utf-8", errors="ignore")).hexdigest() for c in contexts if c)
+        digests.extend(e or "" for e in extra)
+        return hashlib.sha256("|".join(digests).encode()).hexdigest()
+
+    async def _embed(self, query: str) -> np.ndarray:
+        text = self.normalize_query(query)
+        if vector_store.is_bge:
+            text = f"Represent this query for retrieving relevant documents: {text}"
+        vector = await asyncio.to_thread(vector_store.model.encode, [text], normalize_embeddings=True)
+        return np.asarray(vector[0], dtype="float32")
+
+    async def get(self, user_id: Any, query: str, fingerprint: str) -> Optional[Any]:
+        if not self.enabled or user_id is None or not query.strip():
+            return None
+        index = self._indexes.get(str(user_id))
+        if index is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            vector = await self._embed(query)
+            match = index.search(vector, fingerprint, self.threshold, time.time())
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None
+
+        if match is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        logger.info(f"Semantic cache hit for user {user_id} (similarity {match['similarity']:.3f})")
+        return match["value"]
+
+    async def set(self, user_id: Any, query: str, fingerprint: str, value: Any):
+        if not self.enabled or user_id is None or not query.strip() or not value:
+            return
+        try:
+            vector = await self._embed(query)
+        except Exception as e:
+            logger.warning(f"Semantic cache store failed: {e}")
+            return
+
+        now = time.time()
+        index = self._indexes.setdefault(str(user_id), _UserIndex(vector.shape[0]))
+        index.add(
+            vector,
+            {"query": query, "fingerprint": fingerprint, "value": value, "expires_at": now + self.ttl},
+            self.max_entries,
+            now
+        )
+
+    def invalidate(self, user_id: Any):
+        if self._indexes.pop(str(user_id), None) is not None:
+            self.stats["invalidations"] += 1
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,101 @@
+"""
+In-flight request coalescing ("singleflight") for LLM calls.
+
+Concurrent callers that ask for the same key share one upstream call: the first
+caller starts it, later callers await the same result. Streams are fanned out so
+every subscriber sees the full token sequence, including chunks produced before
+it joined.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.core.tracing import tracer
+
+
+class _StreamFanout:
+    """Pumps one upstream stream into a buffer that any number of subscribers replay."""
+
+    def __init__(self, source: AsyncIterator[Any], on_done: Callable[[], None]):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._wake()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._on_done()
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        try:
+            i = 0
+            while True:
+                while i < len(self.chunks):
+                    yield self.chunks[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # Last listener gone (e.g. client disconnected): stop the upstream call
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls and streams by key."""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _StreamFanout] = {}
+        self.stats = {"calls": 0, "coalesced": 0, "streams": 0, "coalesced_streams": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            self.stats["calls"] += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(self._calls, key, f))
+        else:
+            self.stats["coalesced"] += 1
+            tracer.annotate(coalesced=True)
+        # Shielded so one caller being cancelled does not cancel the shared call
+        return await asyncio.shield(future)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]):
+        fanout = self._streams.get(key)
+        if fanout is None:
+            self.stats["streams"] += 1
+            fanout = _StreamFanout(factory(), on_done=lambda: self._forget(self._streams, key, fanout))
+            self._streams[key] = fanout
+        else:
+            self.stats["coalesced_streams"] += 1
+            tracer.annotate(coalesced=True)
+
+        async for chunk in fanout.subscribe():
+            yield chunk
+
+    @staticmethod
+    def _forget(registry: Dict[str, Any], key: str, value: Any):
+        if registry.get(key) is value:
+            registry.pop(key, None)
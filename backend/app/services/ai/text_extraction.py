@@ -0,0 +1,110 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Kept free of model imports so it can run inside worker processes
+# (bulk ingestion) without loading the embedding model.
+
+RECURSIVE_CHUNK_SIZE = 800
+RECURSIVE_CHUNK_OVERLAP = 120
+
+# PDFs with at least this many pages are extracted in parallel page ranges
+PARALLEL_PDF_MIN_PAGES = 16
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def make_recursive_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=RECURSIVE_CHUNK_SIZE,
+        chunk_overlap=RECURSIVE_CHUNK_OVERLAP,
+        length_function=len,
+        is_separator_regex=False,
+    )
+
+def get_file_extension(file_name: str) -> str:
+    return file_name.split('.')[-1].lower() if '.' in file_name else ""
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: workers only import this module, never the parent's torch state
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+def _extract_page_range(file_content: bytes, start: int, end: int) -> List[str]:
+    """Worker: text of pages [start, end). Empty pages come back as "" for OCR in the parent."""
+    import pdfplumber
+    with pdfplumber.open(io.BytesIO(file_content)) as pdf:
+        return [pdf.pages[i].extract_text() or "" for i in range(start, end)]
+
+def _ocr_page(pdf, page_number: int) -> str:
+    try:
+        from app.services.ai.ocr_client import ocr_client
+        # Convert page to image for OCR
+        page_image = pdf.pages[page_number].to_image().original
+        img_byte_arr = io.BytesIO()
+        page_image.save(img_byte_arr, format='PNG')
+        ocr_text = ocr_client.extract_text(img_byte_arr.getvalue())
+        return f"[OCR]: {ocr_text}" if ocr_text else ""
+    except Exception as e:
+        print(f"OCR Error on PDF page: {e}")
+        return ""
+
+def extract_pdf_pages(file_content: bytes) -> List[str]:
+    """
+    Extract text per page. Large PDFs are split into page ranges across a process pool;
+    scanned (text-less) pages are OCR'd in the calling process.
+    """
+    import pdfplumber
+    with pdfplumber.open(io.BytesIO(file_content)) as pdf:
+        page_count = len(pdf.pages)
+
+        # Worker processes (e.g. bulk ingestion) are already parallel; don't nest pools
+        in_worker = multiprocessing.parent_process() is not None
+        if page_count >= PARALLEL_PDF_MIN_PAGES and PDF_WORKERS > 1 and not in_worker:
+            step = -(-page_count // PDF_WORKERS)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            try:
+                pool = _get_pdf_pool()
+                futures = [pool.submit(_extract_page_range, file_content, start, end) for start, end in ranges]
+                pages = [text for future in futures for text in future.result()]
+            except Exception as e:
+                print(f"Parallel PDF extraction failed: {e}, falling back to sequential")
+                pages = [page.extract_text() or "" for page in pdf.pages]
+        else:
+            pages = [page.extract_text() or "" for page in pdf.pages]
+
+        for i, page_text in enumerate(pages):
+            if not page_text:
+                # Attempt OCR on empty pages (scanned)
+                pages[i] = _ocr_page(pdf, i)
+
+    return pages
+
+def extract_text(file_content: bytes, file_name: str) -> str:
+    text = ""
+    file_ext = get_file_extension(file_name)
+
+    if file_ext == "pdf":
+        text = "".join(page + "\n" for page in extract_pdf_pages(file_content) if page)
+
+    elif file_ext in ["docx", "doc"]:
+        import docx
+        doc = docx.Document(io.BytesIO(file_content))
+        for para in doc.paragraphs:
+            text += para.text + "\n"
+    elif file_ext in ["png", "jpg", "jpeg", "webp"]:
+        # Direct OCR for image files
+        from app.services.ai.ocr_client import ocr_client
+        text = ocr_client.extract_text(file_content)
+    else:
+        # Fallback to plain text
+        try:
+            text = file_content.decode("utf-8", errors="ignore")
+        except Exception:
+            text = ""
+    return text
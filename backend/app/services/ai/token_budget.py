@@ -0,0 +1,204 @@
+"""
+Token-accurate prompt budgeting.
+
+Counts tokens with a tokenizer matching the Groq-hosted Llama models and packs
+prompt sections (system prompt, current turn, documents, memory, history) into a
+fixed input budget by priority, so calls neither overflow the model context nor
+the per-key tokens-per-minute allowance.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+
+# Input + output tokens each model accepts
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Chat formatting overhead (role header and end-of-turn markers)
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_PROMPT = 3
+
+
+class TokenCounter:
+    """
+    Counts tokens with the configured Hugging Face tokenizer (LLM_TOKENIZER), else
+    tiktoken's cl100k_base (the base of the Llama 3 vocabulary), else ~4 chars/token.
+    Counts of individual texts are memoized.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer_name = tokenizer_name
+        self._encoder = None
+        self._loaded = False
+        self.backend = "heuristic"
+        self.count = lru_cache(maxsize=20000)(self._count)
+
+    def _load(self):
+        self._loaded = True
+        if self.tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name, use_fast=True)
+                self._encoder = (
+                    lambda text: tokenizer.encode(text, add_special_tokens=False),
+                    lambda ids: tokenizer.decode(ids),
+                )
+                self.backend = self.tokenizer_name
+                return
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer {self.tokenizer_name}: {e}")
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            self._encoder = (
+                lambda text: encoding.encode(text, disallowed_special=()),
+                encoding.decode,
+            )
+            self.backend = "cl100k_base"
+        except Exception:
+            logger.warning("No tokenizer available, estimating tokens from characters")
+
+    def encode(self, text: str) -> Optional[List[int]]:
+        if not self._loaded:
+            self._load()
+        if self._encoder is None:
+            return None
+        return self._encoder[0](text)
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        ids = self.encode(text)
+        if ids is None:
+            return len(text) // 4 + 1
+        return len(ids)
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return TOKENS_PER_PROMPT + sum(
+            TOKENS_PER_MESSAGE + self.count(m.get("content") or "") for m in messages
+        )
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens, preferring to end on a sentence or line break."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        ids = self.encode(text)
+        if ids is None:
+            # Inverse of the heuristic count (len // 4 + 1)
+            cut = text[:max_tokens * 4 - 1]
+        else:
+            cut = self._encoder[1](ids[:max_tokens])
+        # Back off to the last clean break if it keeps most of the text
+        for sep in ("\n\n", "\n", ". "):
+            idx = cut.rfind(sep)
+            if idx > len(cut) * 0.7:
+                return cut[:idx + len(sep)].rstrip()
+        return cut.rstrip()
+
+
+token_counter = TokenCounter(settings.LLM_TOKENIZER)
+
+
+def input_token_limit(model: Optional[str], max_tokens: int) -> int:
+    """Largest prompt a call can send: context window and per-key TPM, minus the completion."""
+    window = MODEL_CONTEXT_WINDOWS.get(model or "", DEFAULT_CONTEXT_WINDOW)
+    return max(256, min(window, settings.GROQ_TOKENS_PER_MINUTE) - max_tokens)
+
+
+def allocate(total: int, sections: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Split a token budget between prompt sections.
+
+    Each section is {"name", "tokens" (what it would like), "priority" (lower first),
+    "min" (optional floor)}. Floors are granted first in priority order, then the rest
+    of the budget fills sections greedily, again by priority.
+    """
+    ordered = sorted(sections, key=lambda s: s["priority"])
+    grants = {s["name"]: 0 for s in ordered}
+    remaining = total
+
+    for section in ordered:
+        floor = min(section.get("min", 0), section["tokens"], remaining)
+        grants[section["name"]] = floor
+        remaining -= floor
+
+    for section in ordered:
+        if remaining <= 0:
+            break
+        extra = min(section["tokens"] - grants[section["name"]], remaining)
+        grants[section["name"]] += extra
+        remaining -= extra
+
+    return grants
+
+
+def pack_texts(texts: List[str], budget: int, min_tail: int = 64) -> List[str]:
+    """
+    Keep texts in rank order while they fit. The first one that does not fit is
+    truncated if at least min_tail tokens remain; everything after it is dropped.
+    """
+    packed = []
+    remaining = budget
+    for text in texts:
+        tokens = token_counter.count(text)
+        if tokens <= remaining:
+            packed.append(text)
+            remaining -= tokens
+            continue
+        if remaining >= min_tail:
+            packed.append(token_counter.truncate(text, remaining))
+        break
+    return packed
+
+
+def trim_history(messages: List[Dict[str, Any]], budget: int) -> List[Dict[str, Any]]:
+    """Keep the most recent messages that fit. The latest message is always kept, truncated if needed."""
+    if not messages:
+        return []
+    kept = []
+    remaining = budget
+    for msg in reversed(messages):
+        tokens = TOKENS_PER_MESSAGE + token_counter.count(msg.get("content") or "")
+        if tokens > remaining:
+            if not kept:
+                kept.append({**msg, "content": token_counter.truncate(msg.get("content") or "", max(remaining - TOKENS_PER_MESSAGE, 0))})
+            break
+        kept.append(msg)
+        remaining -= tokens
+    return list(reversed(kept))
+
+
+def fit_messages(messages: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    Last-resort guard before a call: drop the oldest non-system turns, then truncate
+    the system prompt, until the prompt fits the limit.
+    """
+    total = token_counter.count_messages(messages)
+    if total <= limit:
+        return messages
+
+    system = [m for m in messages if m.get("role") == "system"]
+    turns = [m for m in messages if m.get("role") != "system"]
+    system_tokens = token_counter.count_messages(system) if system else 0
+
+    # Turns get what the system prompt leaves, but never less than half the budget
+    turn_budget = max(limit - system_tokens, limit // 2) - TOKENS_PER_PROMPT
+    turns = trim_history(turns, turn_budget)
+    turn_tokens = sum(TOKENS_PER_MESSAGE + token_counter.count(m.get("content") or "") for m in turns)
+
+    if system:
+        room = max(limit - turn_tokens - TOKENS_PER_PROMPT - TOKENS_PER_MESSAGE * len(system), 0)
+        system = [{**system[0], "content": token_counter.truncate("\n\n".join(m.get("content") or "" for m in system), room)}]
+
+    fitted = system + turns
+    logger.warning(f"Prompt trimmed from {total} to {token_counter.count_messages(fitted)} tokens (limit {limit})")
+    return fitted
@@ -5,9 +5,15 @@ from sentence_transformers import SentenceTransformer
 import os
 import pickle
 import re
-from typing import List, Dict, Any, Optional
+import asyncio
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from app.services.ai.chunk_diff import content_hash, diff_chunks
 
 class VectorStore:
+    # Rebuild the HNSW graph once this share of rows is tombstoned
+    COMPACTION_THRESHOLD = 0.3
+
     def __init__(self, model_name: str = "BAAI/bge-large-en-v1.5", storage_path: str = None):
         print(f"Initializing VectorStore with model: {model_name}")
         self.model = SentenceTransformer(model_name)
@@ -23,6 +29,7 @@ class VectorStore:
         self.index_file = os.path.join(storage_path, "index.faiss")
         self.metadata_file = os.path.join(storage_path, "metadata.pkl")
         self.bm25_file = os.path.join(storage_path, "bm25.pkl")
+        self.writer_lock_file = os.path.join(storage_path, "writer.lock")
 
         # Ensure storage directory exists
         os.makedirs(storage_path, exist_ok=True)
@@ -30,32 +37,123 @@ class VectorStore:
         self.index = None
         self.metadata = []
         self.bm25 = None
+        self._change_listeners = []
+        # user_id -> counter bumped whenever that user's chunks change
+        self._corpus_versions: Dict[str, int] = {}
+        # Uploads index from worker threads while searches run on the event loop: every
+        # read or change of index/metadata holds this lock (embedding happens outside it)
+        self.lock = threading.RLock()
+        # Loop the change listeners run on (set by the app lifespan; None in scripts)
+        self._loop = None
+        self._writer_lock = None
         self.load()
 
     def _tokenize(self, text: str) -> List[str]:
         """Simple tokenization for BM25"""
         return re.findall(r'\w+', text.lower())
 
+    content_hash = staticmethod(content_hash)
+
+    def add_change_listener(self, callback):
+        """Register callback(user_id), called whenever a user's indexed chunks change."""
+        self._change_listeners.append(callback)
+
+    def bind_loop(self, loop):
+        """Run change listeners on this event loop, also for changes made from worker threads."""
+        self._loop = loop
+
+    def acquire_writer_lock(self) -> bool:
+        """
+        Claim storage_path for this process. Every process holds its own in-memory copy
+        of the index and overwrites the files on save, so only the holder may write.
+        Released when the process exits. False if another process holds it.
+        """
+        if self._writer_lock is not None:
+            return True
+        import fcntl
+        handle = open(self.writer_lock_file, "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._writer_lock = handle
+        return True
+
+    def corpus_version(self, user_id: Any) -> int:
+        """Version of a user's indexed chunks; changes on every add, update or delete."""
+        return self._corpus_versions.get(str(user_id), 0)
+
+    def _notify_change(self, metadatas: List[Dict[str, Any]]):
+        user_ids = {meta.get("user_id") for meta in metadatas if meta.get("user_id") is not None}
+        for user_id in user_ids:
+            # Bumped right away: cache keys built from the version go stale immediately
+            self._corpus_versions[str(user_id)] = self.corpus_version(user_id) + 1
+
+        loop = self._loop
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if user_ids and loop is not None and not on_loop and loop.is_running():
+            # Listeners mutate loop-owned caches, so they never run on a worker thread
+            loop.call_soon_threadsafe(self._run_listeners, user_ids)
+        else:
+            self._run_listeners(user_ids)
+
+    def _run_listeners(self, user_ids):
+        for user_id in user_ids:
+            for callback in self._change_listeners:
+                try:
+                    callback(user_id)
+                except Exception as e:
+                    print(f"Vector store change listener failed: {e}")
+
     def _build_bm25(self):
         """Build BM25 index from current metadata"""
         if not self.metadata:
             self.bm25 = None
             return
 
-        corpus = [self._tokenize(meta.get("text", "")) for meta in self.metadata]
+        # Tombstoned rows keep their position (FAISS ids are positional) but get no terms
+        corpus = [
+            [] if meta.get("deleted") else self._tokenize(meta.get("text", ""))
+            for meta in self.metadata
+        ]
         self.bm25 = BM25Okapi(corpus)
 
-    def add_texts(self, texts: List[str], metadatas: List[Dict[str, Any]]):
+    def add_texts(self, texts: List[str], metadatas: List[Dict[str, Any]], persist: bool = True):
+        """
+        Embed and index texts. With persist=False the BM25 rebuild and disk write
+        are deferred to flush(), which bulk loaders call once per checkpoint.
+        """
         if not texts:
             return
 
+        for text, meta in zip(texts, metadatas):
+            meta.setdefault("content_hash", self.content_hash(text))
+
+        embeddings = self._embed(texts)
+        with self.lock:
+            self._append(embeddings, metadatas)
+            if persist:
+                self.flush()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
         # BGE models perform better with instructions
         processed_texts = texts
         if self.is_bge:
             processed_texts = [f"Represent this document for retrieval: {text}" for text in texts]
 
         embeddings = self.model.encode(processed_texts, normalize_embeddings=True)
+        return np.array(embeddings).astype('float32')
 
+    def _append(self, embeddings: np.ndarray, metadatas: List[Dict[str, Any]]):
+        """Add vectors and their metadata rows together (caller holds the lock)."""
         if self.index is None:
             # Use IndexHNSWFlat for production-grade speed and scalability (ChatGPT/Gemini level)
             # M=32 is a good balance between speed and accuracy
@@ -63,17 +161,21 @@ class VectorStore:
             self.index.hnsw.efConstruction = 200
             self.index.hnsw.efSearch = 100
 
-        self.index.add(np.array(embeddings).astype('float32'))
+        self.index.add(embeddings)
         self.metadata.extend(metadatas)
+        self._notify_change(metadatas)
 
-        # Rebuild BM25
-        self._build_bm25()
-        self.save()
+    def flush(self):
+        """Rebuild BM25 and persist the index."""
+        with self.lock:
+            self._build_bm25()
+            self.save()
 
-    def search(self, query: str, user_id: str = None, session_id: str = None, doc_type: str = None, k: int = 5, alpha: float = 0.5):
+    def search(self, query: str, user_id: str = None, session_id: str = None, doc_type: str = None, k: int = 5, alpha: float = 0.5, metadata_filter: Optional[Dict[str, Any]] = None):
         """
         Hybrid search combining Dense (FAISS) and Sparse (BM25)
         alpha: Weight for dense search (0-1). 1.0 = pure vector, 0.0 = pure BM25
+        metadata_filter: Exact-match constraints on chunk metadata (e.g. {"project_id": ...})
         """
         if self.index is None or self.index.ntotal == 0:
             return []
@@ -84,9 +186,34 @@ class VectorStore:
             processed_query = f"Represent this query for retrieving relevant documents: {query}"
 
         query_vector = self.model.encode([processed_query], normalize_embeddings=True)
-        # Search more to allow for fusion and filtering
-        search_k = min(k * 10, self.index.ntotal)
-        dense_distances, dense_indices = self.index.search(np.array(query_vector).astype('float32'), search_k)
+        with self.lock:
+            return self._search(query_vector, query, user_id, session_id, doc_type, k, alpha, metadata_filter)
+
+    def _search(self, query_vector, query, user_id, session_id, doc_type, k, alpha, metadata_filter):
+        if self.index is None or self.index.ntotal == 0:
+            return []
+
+        # Rows the filters allow, applied before candidates are cut to search_k: a small
+        # project or user inside a large corpus would otherwise get few or no hits
+        allowed = None
+        if user_id or session_id or doc_type or metadata_filter:
+            allowed = np.array([
+                i for i, meta in enumerate(self.metadata)
+                if self._matches(meta, user_id, session_id, doc_type, metadata_filter)
+            ], dtype='int64')
+            if len(allowed) == 0:
+                return []
+
+        # Search more to allow for fusion
+        search_k = min(k * 10, self.index.ntotal if allowed is None else len(allowed))
+        params = None
+        if allowed is not None and len(allowed) < self.index.ntotal:
+            selector = faiss.IDSelectorBatch(allowed)
+            if isinstance(self.index, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.index.hnsw.efSearch, search_k))
+            else:
+                params = faiss.SearchParameters(sel=selector)
+        dense_distances, dense_indices = self.index.search(np.array(query_vector).astype('float32'), search_k, params=params)
 
         # 2. Sparse Search (BM25)
         sparse_scores = {}
@@ -113,8 +240,12 @@ class VectorStore:
 
         # Add sparse ranks
         if self.bm25:
-            # Sort all BM25 scores to get ranks
-            sparse_indices = np.argsort(list(sparse_scores.values()))[::-1][:search_k]
+            # Sort the BM25 scores of the allowed rows to get ranks
+            if allowed is None:
+                sparse_indices = np.argsort(list(sparse_scores.values()))[::-1][:search_k]
+            else:
+                rows = allowed[allowed < len(bm25_scores)]
+                sparse_indices = rows[np.argsort(bm25_scores[rows])[::-1][:search_k]]
             for rank, idx in enumerate(sparse_indices):
                 fused_scores[idx] = fused_scores.get(idx, 0) + (1 - alpha) * (1.0 / (k_rrf + rank))
 
@@ -125,23 +256,15 @@ class VectorStore:
         for idx, score in sorted_indices:
             meta = self.metadata[idx]
 
-            # Filter by user_id
-            if user_id and str(meta.get("user_id")) != str(user_id):
-                continue
-
-            # Filter by session_id (if provided, only return docs from this session)
-            if session_id and meta.get("session_id") and str(meta.get("session_id")) != str(session_id):
-                continue
-
-            # Filter by doc_type
-            if doc_type and meta.get("type") != doc_type:
+            if not self._matches(meta, user_id, session_id, doc_type, metadata_filter):
                 continue
 
             results.append({
                 "content": meta.get("text", ""),
                 "metadata": meta,
                 "score": float(score),
-                "rank_score": score
+                "rank_score": score,
+                "row": int(idx)
             })
 
             if len(results) >= k:
@@ -149,23 +272,152 @@ class VectorStore:
 
         return results
 
-    def delete_document(self, document_id: str):
-        """Delete all chunks belonging to a specific document_id."""
-        initial_count = len(self.metadata)
-        keep_indices = [i for i, meta in enumerate(self.metadata) if meta.get("document_id") != document_id]
+    @staticmethod
+    def _matches(meta: Dict[str, Any], user_id, session_id, doc_type, metadata_filter) -> bool:
+        if meta.get("deleted"):
+            return False
 
-        if len(keep_indices) == initial_count:
+        # Filter by user_id
+        if user_id and str(meta.get("user_id")) != str(user_id):
             return False
 
-        remaining_texts = [self.metadata[i].get("text", "") for i in keep_indices]
-        remaining_metadatas = [self.metadata[i] for i in keep_indices]
+        # Filter by session_id (if provided, only return docs from this session)
+        if session_id and meta.get("session_id") and str(meta.get("session_id")) != str(session_id):
+            return False
 
-        # Reset and re-add using HNSW for consistency
-        self.index = faiss.IndexHNSWFlat(self.dimension, 32)
-        self.metadata = []
-        self.add_texts(remaining_texts, remaining_metadatas)
+        # Filter by doc_type
+        if doc_type and meta.get("type") != doc_type:
+            return False
+
+        if metadata_filter and any(str(meta.get(key)) != str(value) for key, value in metadata_filter.items()):
+            return False
         return True
 
+    def get_document_chunks(self, document_id: str) -> List[int]:
+        """Row indices of the live chunks belonging to document_id."""
+        with self.lock:
+            return [
+                i for i, meta in enumerate(self.metadata)
+                if meta.get("document_id") == document_id and not meta.get("deleted")
+            ]
+
+    def document_rows(self, prefix: str = "") -> Dict[str, List[int]]:
+        """document_id -> live row indices for every document whose id starts with prefix, in one pass."""
+        rows: Dict[str, List[int]] = {}
+        with self.lock:
+            for i, meta in enumerate(self.metadata):
+                document_id = meta.get("document_id")
+                if document_id is not None and not meta.get("deleted") and str(document_id).startswith(prefix):
+                    rows.setdefault(document_id, []).append(i)
+        return rows
+
+    def _tombstone(self, indices: List[int]):
+        for i in indices:
+            self.metadata[i]["deleted"] = True
+            self.metadata[i]["text"] = ""
+        self._notify_change([self.metadata[i] for i in indices])
+
+    def update_document(self, document_id: str, texts: List[str], metadatas: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Replace the chunks of document_id with a new version.
+        Chunks are diffed by content hash: unchanged chunks keep their vectors,
+        only new chunks are embedded and removed ones are tombstoned.
+        """
+        hashes = [self.content_hash(text) for text in texts]
+        # Embedded outside the lock; the diff is redone under it against the live rows
+        planned = diff_chunks(self._chunk_hashes(document_id), hashes).added
+        embedded = dict(zip(planned, self._embed([texts[i] for i in planned]))) if planned else {}
+
+        with self.lock:
+            rows = self.get_document_chunks(document_id)
+            # Keep document-level fields (e.g. session_id) from the previous version
+            document_fields = {
+                k: v for k, v in self.metadata[rows[0]].items()
+                if k not in ("text", "chunk_index", "content_hash", "deleted")
+            } if rows else {}
+            for meta, content_hash in zip(metadatas, hashes):
+                for k, v in document_fields.items():
+                    meta.setdefault(k, v)
+                meta["content_hash"] = content_hash
+
+            diff = diff_chunks(self._chunk_hashes(document_id), hashes)
+            for position, row in diff.kept:
+                # Same text already embedded: refresh metadata in place (e.g. chunk_index)
+                self.metadata[row].update(metadatas[position])
+            self._tombstone(diff.removed)
+
+            if diff.added:
+                # Only differs from the planned set if the document changed in between
+                missing = [i for i in diff.added if i not in embedded]
+                if missing:
+                    embedded.update(zip(missing, self._embed([texts[i] for i in missing])))
+                self._append(
+                    np.array([embedded[i] for i in diff.added], dtype='float32'),
+                    [metadatas[i] for i in diff.added]
+                )
+
+            self.flush()
+            self.maybe_compact()
+        return {"added": len(diff.added), "removed": len(diff.removed), "unchanged": len(diff.kept)}
+
+    def _chunk_hashes(self, document_id: str) -> List[Tuple[int, str]]:
+        with self.lock:
+            return [(i, self.metadata[i].get("content_hash")) for i in self.get_document_chunks(document_id)]
+
+    def delete_document(self, document_id: str, persist: bool = True, rows: Optional[List[int]] = None):
+        """
+        Delete all chunks belonging to a specific document_id. Bulk callers pass the
+        rows (from document_rows()) to avoid a scan of the whole index per document.
+        """
+        with self.lock:
+            indices = rows
+            if indices is not None and not all(
+                i < len(self.metadata) and self.metadata[i].get("document_id") == document_id for i in indices
+            ):
+                # Rows shifted by a compaction since they were looked up
+                indices = None
+            if indices is None:
+                indices = self.get_document_chunks(document_id)
+            if not indices:
+                return False
+
+            self._tombstone(indices)
+            if persist:
+                self.flush()
+                self.maybe_compact()
+        return True
+
+    def maybe_compact(self):
+        with self.lock:
+            deleted = sum(1 for meta in self.metadata if meta.get("deleted"))
+            if self.metadata and deleted / len(self.metadata) >= self.COMPACTION_THRESHOLD:
+                self.compact()
+
+    def compact(self):
+        """
+        Drop tombstoned rows and rebuild the HNSW graph.
+        Vectors are reconstructed from the flat storage, so nothing is re-embedded.
+        """
+        with self.lock:
+            keep_indices = [i for i, meta in enumerate(self.metadata) if not meta.get("deleted")]
+
+            vectors = None
+            if keep_indices and self.index is not None and self.index.ntotal > 0:
+                all_vectors = self.index.reconstruct_n(0, self.index.ntotal)
+                vectors = all_vectors[keep_indices]
+
+            self.index = faiss.IndexHNSWFlat(self.dimension, 32)
+            self.index.hnsw.efConstruction = 200
+            self.index.hnsw.efSearch = 100
+            if vectors is not None:
+                self.index.add(np.ascontiguousarray(vectors, dtype='float32'))
+
+            # Rows after the first tombstone shift down: cached row references for their owners are void
+            moved = [self.metadata[i] for row, i in enumerate(keep_indices) if row != i]
+            self.metadata = [self.metadata[i] for i in keep_indices]
+            self.flush()
+            self._notify_change(moved)
+
     def save(self):
         if self.index is not None:
             # HNSW indices must be saved to disk
@@ -1,6 +1,8 @@
 from app.core.mongodb import mongodb
 from app.services.ai.vector_store import vector_store
-from app.services.ai.groq_client import groq_client
+from app.services.ai.semantic_cache import semantic_cache
+from app.services.ai.model_policy import model_policy
+from app.services.ai.token_budget import token_counter, allocate, pack_texts, trim_history
 from typing import List, Dict, Any, Tuple
 import json
 
@@ -8,11 +10,12 @@ async def build_context(session_id: str, user_id: str = None, query: str = None,
     """
     Build context for AI by retrieving recent messages, relevant document chunks,
     and utilizing hierarchical memory (summarization of older context).
+    The whole prompt is packed into max_tokens (see "Context Packing" below).
     Returns (messages, retrieved_docs, metadata)
     """
     messages = []
     retrieved_docs = []
-    context_metadata = {"memory_active": False, "memory_summary": None}
+    context_metadata = {"memory_active": False, "memory_summary": None, "context_fingerprint": None}
 
     # 1. Base System Prompt
     system_prompt_content = (
@@ -25,23 +28,24 @@ async def build_context(session_id: str, user_id: str = None, query: str = None,
     # 2. Hybrid Search (Dense + Sparse) & Multi-Query results would normally be here,
     # but the pipeline handles the complex RAG flow. This function serves as the
     # default context builder for simpler paths or history retrieval.
-    rag_context = ""
+    rag_blocks = []
     if query and user_id and vector_store:
         try:
             # Enhanced search with hybrid logic
             # Pass session_id to filter documents to only this chat session
             results = vector_store.search(query, user_id=user_id, session_id=session_id, k=5, alpha=0.5)
             if results:
-                rag_context = "\n\n[CONTEXT FROM KNOWLEDGE BASE]\n"
-                doc_names = set()
                 for res in results:
                     filename = res["metadata"].get("filename", "Unknown")
-                    doc_names.add(filename)
-                    rag_context += f"--- Source: {filename} ---\n{res['content']}\n"
-                retrieved_docs = list(doc_names)
+                    rag_blocks.append((filename, f"--- Source: {filename} ---\n{res['content']}\n"))
+            # Identifies the retrieved chunk set for the semantic response cache
+            context_metadata["context_fingerprint"] = semantic_cache.fingerprint(res["content"] for res in results)
         except Exception as e:
             print(f"Context retrieval error: {e}")
 
+    if query and user_id and context_metadata["context_fingerprint"] is None:
+        context_metadata["context_fingerprint"] = semantic_cache.fingerprint([])
+
     # 3. Hierarchical Memory Implementation
     # We fetch more history than needed, summarize the tail, and keep the head (recent) intact.
     history_messages = []
@@ -67,12 +71,8 @@ async def build_context(session_id: str, user_id: str = None, query: str = None,
                         {"role": "system", "content": "Summarize the following chat history into a concise paragraph focusing on key facts and user preferences revealed."},
                         {"role": "user", "content": older_text}
                     ]
-                    memory_summary = await groq_client.get_completion(
-                        summary_prompt,
-                        model="llama-3.1-8b-instant", # Fast model for summarization
-                        max_tokens=200,
-                        temperature=0.3
-                    )
+                    # Fast model for summarization (see the "memory_summary" stage policy)
+                    memory_summary = await model_policy.for_stage("memory_summary").get_completion(summary_prompt)
                 except Exception as e:
                     print(f"Memory summarization failed: {e}")
                     # Fallback: just use a subset without summary
@@ -92,14 +92,35 @@ async def build_context(session_id: str, user_id: str = None, query: str = None,
                 history_messages.append({"role": msg["role"], "content": msg["content"]})
 
     # 4. Context Packing & Assembly
+    # Priority: system prompt, latest turn, documents, memory, older history.
+    # Floors keep a minimum of each; the remainder is filled greedily in that order.
+    rag_header = "\n\n[CONTEXT FROM KNOWLEDGE BASE]\n"
+    memory_header = "\n\n[HIERARCHICAL MEMORY (PREVIOUS CONTEXT)]\n"
+    latest, older = history_messages[-1:], history_messages[:-1]
+    budget = max_tokens - token_counter.count_messages([{"role": "system", "content": system_prompt_content}])
+    grants = allocate(budget, [
+        {"name": "latest", "priority": 0, "tokens": token_counter.count_messages(latest)},
+        {"name": "documents", "priority": 1, "min": budget // 4,
+         "tokens": token_counter.count(rag_header) + sum(token_counter.count(b) for _, b in rag_blocks)},
+        {"name": "memory", "priority": 2, "min": min(200, budget // 10),
+         "tokens": token_counter.count(memory_header + memory_summary) if memory_summary else 0},
+        {"name": "history", "priority": 3, "tokens": token_counter.count_messages(older)},
+    ])
+
     final_system_content = system_prompt_content
+    memory_room = grants["memory"] - token_counter.count(memory_header)
+    memory_summary = token_counter.truncate(memory_summary, memory_room) if memory_summary else ""
     if memory_summary:
-        final_system_content += f"\n\n[HIERARCHICAL MEMORY (PREVIOUS CONTEXT)]\n{memory_summary}"
-    if rag_context:
-        final_system_content += rag_context
+        final_system_content += memory_header + memory_summary
+    packed_blocks = pack_texts([b for _, b in rag_blocks], grants["documents"] - token_counter.count(rag_header))
+    if packed_blocks:
+        final_system_content += rag_header + "".join(packed_blocks)
+        retrieved_docs = list({name for name, _ in rag_blocks[:len(packed_blocks)]})
 
     messages.append({"role": "system", "content": final_system_content})
-    messages.extend(history_messages)
+    messages.extend(trim_history(older, grants["history"]))
+    messages.extend(trim_history(latest, grants["latest"]))
+    context_metadata["prompt_tokens"] = token_counter.count_messages(messages)
 
     if memory_summary:
         context_metadata["memory_active"] = True
@@ -0,0 +1,255 @@
+"""
+Post-response work (answer critique, quality scoring, memory writes) run after the
+answer has been sent.
+
+Tasks are persisted in MongoDB before they are queued, so work interrupted by a
+restart is picked up again on startup. A fixed number of workers drains an
+in-process bounded queue. Tasks that find the queue full stay pending in MongoDB
+(or in a bounded in-memory overflow without it) and are swept back in periodically
+once there is room; results are published by key (the assistant message id)
+so an open SSE stream can push them to the client when they are ready.
+"""
+
+import asyncio
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.mongodb import mongodb
+
+COLLECTION = "post_response_tasks"
+
+
+class PostResponseQueue:
+    def __init__(self, workers: int, max_pending: int, max_attempts: int = 3):
+        self.worker_count = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        self.sweeper: Optional[asyncio.Task] = None
+        # Ids of persisted tasks held in memory (queued, running or waiting to retry)
+        self._held: set = set()
+        # Deferred tasks that could not be persisted
+        self._overflow: deque = deque(maxlen=max_pending)
+        self._backlog = False
+        # Blocking parts of handlers (file writes, mem0), off the event loop
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        # Recent results, for subscribers that arrive after the task finished
+        self._results: "OrderedDict[str, Any]" = OrderedDict()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "retried": 0, "deferred": 0, "recovered": 0, "swept": 0, "dropped": 0}
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        self.handlers[kind] = handler
+
+    @property
+    def _collection(self):
+        return mongodb.db[COLLECTION] if mongodb.db is not None else None
+
+    async def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix="post-response")
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        self.sweeper = asyncio.create_task(self._sweep_loop())
+        await self._sweep(["pending", "running"], stat="recovered")
+        logger.info(f"Post-response queue started ({self.worker_count} workers)")
+
+    async def stop(self):
+        # Unfinished tasks stay in MongoDB and are recovered on the next start
+        tasks = self.workers + ([self.sweeper] if self.sweeper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.sweeper = None
+        self.queue = None
+        self._held.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def _enqueue(self, doc: Dict[str, Any]) -> bool:
+        """Queue a task if there is room; otherwise leave it for the next sweep."""
+        try:
+            self.queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            self.stats["deferred"] += 1
+            self._backlog = True
+            if doc.get("_id") is None:
+                if len(self._overflow) == self._overflow.maxlen:
+                    self.stats["dropped"] += 1
+                    logger.error("Post-response overflow full, dropping oldest unpersisted task")
+                self._overflow.append(doc)
+            else:
+                self._held.discard(doc["_id"])
+            return False
+        if doc.get("_id") is not None:
+            self._held.add(doc["_id"])
+        return True
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(settings.POST_RESPONSE_SWEEP_INTERVAL)
+            if self._backlog:
+                await self._sweep(["pending"], stat="swept")
+
+    async def _sweep(self, statuses: List[str], stat: str):
+        """Move deferred tasks (overflow, then MongoDB rows not held in memory) into the queue while it has room."""
+        self._backlog = False
+        while self._overflow and not self.queue.full():
+            self.queue.put_nowait(self._overflow.popleft())
+            self.stats[stat] += 1
+        if self._overflow:
+            self._backlog = True
+            return
+        if self._collection is None:
+            return
+        try:
+            async for doc in self._collection.find({"status": {"$in": statuses}}).sort("created_at", 1):
+                if doc["_id"] in self._held:
+                    continue
+                if self.queue.full():
+                    self._backlog = True
+                    break
+                self._enqueue(doc)
+                self.stats[stat] += 1
+        except Exception as e:
+            self._backlog = True
+            logger.error(f"Could not load pending post-response tasks: {e}")
+
+    async def submit(self, kind: str, payload: Dict[str, Any], key: Optional[str] = None):
+        """Persist and enqueue a task. Never raises: post-response work must not fail the request."""
+        if self.queue is None:
+            # Before persisting, so the startup recovery does not pick this task up as well
+            await self.start()
+        doc = {
+            "kind": kind,
+            "key": key,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": datetime.utcnow()
+        }
+        self.stats["submitted"] += 1
+        if self._collection is not None:
+            try:
+                result = await self._collection.insert_one(doc)
+                doc["_id"] = result.inserted_id
+            except Exception as e:
+                logger.error(f"Could not persist post-response task {kind}: {e}")
+
+        if not self._enqueue(doc):
+            logger.warning(f"Post-response queue full, deferring {kind} task")
+
+    async def run_blocking(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run blocking handler work on the queue's bounded thread pool."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix="post-response")
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def _worker(self, index: int):
+        while True:
+            doc = await self.queue.get()
+            try:
+                await self._run(doc)
+            except Exception as e:
+                logger.error(f"Post-response worker {index} error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, doc: Dict[str, Any]):
+        handler = self.handlers.get(doc["kind"])
+        if handler is None:
+            logger.error(f"No handler registered for post-response task {doc['kind']}")
+            self._held.discard(doc.get("_id"))
+            return
+
+        await self._mark(doc, {"status": "running"})
+        try:
+            result = await handler(doc["payload"])
+        except Exception as e:
+            doc["attempts"] = doc.get("attempts", 0) + 1
+            if doc["attempts"] < self.max_attempts:
+                # Still held (not swept) while waiting for the retry
+                self.stats["retried"] += 1
+                await self._mark(doc, {"status": "pending", "attempts": doc["attempts"]})
+                logger.warning(f"Post-response task {doc['kind']} failed ({e}), retrying")
+                asyncio.get_running_loop().call_later(2 ** doc["attempts"], self._requeue, doc)
+            else:
+                self.stats["failed"] += 1
+                self._held.discard(doc.get("_id"))
+                await self._mark(doc, {"status": "failed", "attempts": doc["attempts"], "error": str(e)})
+                logger.error(f"Post-response task {doc['kind']} failed permanently: {e}")
+            return
+
+        self.stats["completed"] += 1
+        self._held.discard(doc.get("_id"))
+        if doc.get("_id") is not None and self._collection is not None:
+            try:
+                await self._collection.delete_one({"_id": doc["_id"]})
+            except Exception as e:
+                logger.error(f"Could not clear post-response task: {e}")
+        if doc.get("key"):
+            self.publish(doc["key"], result)
+
+    def _requeue(self, doc: Dict[str, Any]):
+        if self.queue is None:
+            return
+        self._enqueue(doc)
+
+    async def _mark(self, doc: Dict[str, Any], fields: Dict[str, Any]):
+        if doc.get("_id") is None or self._collection is None:
+            return
+        try:
+            await self._collection.update_one({"_id": doc["_id"]}, {"$set": fields})
+        except Exception as e:
+            logger.error(f"Could not update post-response task: {e}")
+
+    def publish(self, key: str, result: Any):
+        self._results[key] = result
+        while len(self._results) > 1000:
+            self._results.popitem(last=False)
+        for future in self._waiters.pop(key, []):
+            if not future.done():
+                future.set_result(result)
+
+    async def wait_result(self, key: str, timeout: float) -> Optional[Any]:
+        """Result of the task submitted under key, or None if it is not ready within timeout."""
+        if key in self._results:
+            return self._results[key]
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    self._waiters.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "overflow": len(self._overflow),
+            "backlog": self._backlog,
+            "workers": len(self.workers),
+        }
+
+
+post_response_queue = PostResponseQueue(
+    workers=settings.POST_RESPONSE_WORKERS,
+    max_pending=settings.POST_RESPONSE_MAX_PENDING
+)
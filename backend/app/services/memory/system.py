@@ -1,7 +1,9 @@
 from typing import Dict, List, Optional
+import asyncio
 import logging
 import json
 import os
+import threading
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -26,6 +28,8 @@ class HierarchicalMemory:
         """
         self.use_mem0 = use_mem0
         self.storage_path = "./storage/memory"
+        # store_interaction runs in worker threads; user files are read-modify-write
+        self._write_lock = threading.Lock()
         
         if use_mem0:
             try:
@@ -98,6 +102,16 @@ class HierarchicalMemory:
         """
         Store interaction and extract memories
         """
+        await asyncio.to_thread(self.store_interaction, user_id, message, response, metadata)
+
+    def store_interaction(
+        self,
+        user_id: str,
+        message: str,
+        response: str,
+        metadata: Optional[Dict] = None
+    ):
+        """Blocking part of remember() (mem0 add or a file rewrite); call it off the event loop."""
         if self.use_mem0:
             messages = [
                 {"role": "user", "content": message},
@@ -110,23 +124,24 @@ class HierarchicalMemory:
             self.memory.add(messages=messages, user_id=user_id)
         else:
             # Simple storage
-            memories = self._load_user_memories(user_id)
-            
-            # Store conversation
-            memories['conversations'].append({
-                'timestamp': datetime.now().isoformat(),
-                'message': message,
-                'response': response,
-                'metadata': metadata or {}
-            })
-            
-            # Keep only last 50 conversations
-            memories['conversations'] = memories['conversations'][-50:]
-            
-            # Extract preferences and facts (simple keyword-based)
-            self._extract_insights(memories, message, response)
-            
-            self._save_user_memories(user_id, memories)
+            with self._write_lock:
+                memories = self._load_user_memories(user_id)
+
+                # Store conversation
+                memories['conversations'].append({
+                    'timestamp': datetime.now().isoformat(),
+                    'message': message,
+                    'response': response,
+                    'metadata': metadata or {}
+                })
+
+                # Keep only last 50 conversations
+                memories['conversations'] = memories['conversations'][-50:]
+
+                # Extract preferences and facts (simple keyword-based)
+                self._extract_insights(memories, message, response)
+
+                self._save_user_memories(user_id, memories)
         
         logger.info(f"Stored memory for user {user_id}")
     
@@ -7,6 +7,7 @@ from .pipeline import OmniRAGPipeline
 from .graph_store import KnowledgeGraph
 from .extractor import EntityExtractor
 from .rewriter import QueryRewriter
+from .planner import QueryPlanner
 
 __all__ = [
     "HyDEEngine",
@@ -19,5 +20,6 @@ __all__ = [
     "OmniRAGPipeline",
     "KnowledgeGraph",
     "EntityExtractor",
-    "QueryRewriter"
+    "QueryRewriter",
+    "QueryPlanner"
 ]
@@ -0,0 +1,124 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+from app.services.ai.token_budget import token_counter
+
+# Sentence ends, or line breaks (headings, list items, table rows)
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[A-Z0-9])|\s*\n+\s*")
+MIN_SENTENCE_CHARS = 25
+
+
+class ExtractiveCompressor:
+    """
+    Contextual compression without LLM calls: documents are split into sentences,
+    each sentence is scored against the query by embedding similarity (optionally
+    blended with cross-encoder scores), and the best sentences are kept up to a
+    token budget, in their original order within each document.
+    Sentence embeddings are cached by content hash, so chunks that come back for
+    later queries are not re-encoded.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        cross_encoder=None,
+        query_prefix: str = "",
+        cross_encoder_weight: float = 0.5,
+        cross_encoder_candidates: int = 32,
+        cache_size: int = 20000
+    ):
+        self.embedder = embedder
+        self.cross_encoder = cross_encoder
+        self.query_prefix = query_prefix
+        self.cross_encoder_weight = cross_encoder_weight
+        self.cross_encoder_candidates = cross_encoder_candidates
+        self.cache_size = cache_size
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # compress() runs in worker threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        sentences = []
+        for part in SENTENCE_SPLIT.split(text or ""):
+            part = part.strip()
+            if not part:
+                continue
+            # Fold fragments (bullets, numbering, short headings) into the next sentence
+            if sentences and len(sentences[-1]) < MIN_SENTENCE_CHARS:
+                sentences[-1] = f"{sentences[-1]} {part}"
+            else:
+                sentences.append(part)
+        return sentences
+
+    def _encode(self, texts: List[str], prefix: str = "") -> np.ndarray:
+        """Normalized embeddings, encoding only texts not in the cache (one batch)."""
+        keys = [hashlib.sha256(f"{prefix}{t}".encode("utf-8", errors="ignore")).hexdigest() for t in texts]
+        with self._lock:
+            found = {key: self._embeddings[key] for key in keys if key in self._embeddings}
+            for key in found:
+                self._embeddings.move_to_end(key)
+
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            vectors = self.embedder.encode([f"{prefix}{texts[i]}" for i in missing], normalize_embeddings=True, batch_size=64)
+            fresh = {keys[i]: np.asarray(vector, dtype="float32") for i, vector in zip(missing, vectors)}
+            found.update(fresh)
+            with self._lock:
+                self._embeddings.update(fresh)
+                while len(self._embeddings) > self.cache_size:
+                    self._embeddings.popitem(last=False)
+        return np.vstack([found[key] for key in keys])
+
+    def _scores(self, query: str, sentences: List[str]) -> np.ndarray:
+        query_vector = self._encode([query], prefix=self.query_prefix)[0]
+        scores = self._encode(sentences) @ query_vector
+
+        if self.cross_encoder is not None:
+            # Only the best embedding matches are re-scored; the rest count as irrelevant to it
+            candidates = np.argsort(-scores)[:self.cross_encoder_candidates]
+            try:
+                logits = np.asarray(self.cross_encoder.predict([[query, sentences[i]] for i in candidates]), dtype="float32")
+                relevance = np.zeros_like(scores)
+                relevance[candidates] = 1 / (1 + np.exp(-logits))
+                scores = (1 - self.cross_encoder_weight) * scores + self.cross_encoder_weight * relevance
+            except Exception as e:
+                logger.warning(f"Cross-encoder scoring failed, using embedding scores only: {e}")
+        return scores
+
+    def compress(self, query: str, documents: List[str], token_budget: int) -> List[str]:
+        """
+        One compressed text per document (documents with no kept sentence are dropped).
+        The budget is shared: the highest-scoring sentences across all documents win.
+        """
+        sentences = []  # (doc index, position, text, tokens)
+        for d, document in enumerate(documents):
+            for p, sentence in enumerate(self.split_sentences(document)):
+                sentences.append((d, p, sentence, token_counter.count(sentence)))
+        if not sentences:
+            return []
+
+        try:
+            scores = self._scores(query, [s[2] for s in sentences])
+        except Exception as e:
+            logger.error(f"Extractive compression failed, keeping documents as-is: {e}")
+            return [doc for doc in documents if doc]
+
+        kept, used = set(), 0
+        for i in np.argsort(-scores):
+            tokens = sentences[i][3]
+            if used + tokens > token_budget:
+                continue
+            kept.add(int(i))
+            used += tokens
+
+        compressed: List[List[str]] = [[] for _ in documents]
+        for i in sorted(kept, key=lambda i: (sentences[i][0], sentences[i][1])):
+            compressed[sentences[i][0]].append(sentences[i][2])
+        return [" ".join(parts) for parts in compressed if parts]
@@ -0,0 +1,123 @@
+"""
+Per-request latency budgets for the RAG pipeline.
+
+Optional stages (compression, refinement, the CRAG LLM check, web search) only run
+when their projected cost still fits the remaining budget, leaving room for the
+stages that must follow. Projections come from live per-stage latency histograms.
+"""
+
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.tracing import tracer
+
+# Seconds assumed for a stage until enough samples exist
+DEFAULT_STAGE_COST = {
+    "crag_eval": 0.8,
+    "web_search": 2.0,
+    "compression": 0.3,
+    "refine": 2.5,
+    "generation": 4.0,
+    "generation_ttft": 0.8,
+}
+MIN_SAMPLES = 5
+PROJECTION_PERCENTILE = 0.9
+
+
+class StageLatency:
+    """Rolling latency samples per stage."""
+
+    def __init__(self, window: int = 200):
+        self.samples: Dict[str, deque] = {}
+        self.window = window
+
+    def record(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def projected(self, stage: str) -> float:
+        samples = self.samples.get(stage)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return DEFAULT_STAGE_COST.get(stage, 1.0)
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(PROJECTION_PERCENTILE * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: {"samples": len(samples), "projected_ms": round(self.projected(stage) * 1000, 1)}
+            for stage, samples in self.samples.items()
+        }
+
+
+stage_latency = StageLatency()
+
+
+def resolve_budget_ms(tier: Optional[str] = None, requested_ms: Optional[int] = None) -> Optional[int]:
+    """Requested budget, capped by the tier's (LATENCY_BUDGET_TIERS maps tier -> ms). None: no budget."""
+    budget = settings.LATENCY_BUDGET_MS
+    if tier and settings.LATENCY_BUDGET_TIERS:
+        try:
+            budget = int(json.loads(settings.LATENCY_BUDGET_TIERS).get(tier, budget))
+        except Exception as e:
+            logger.error(f"Ignoring invalid LATENCY_BUDGET_TIERS: {e}")
+    if requested_ms:
+        budget = min(budget, requested_ms) if budget > 0 else requested_ms
+    return budget if budget > 0 else None
+
+
+class Deadline:
+    """
+    Tracks one request's budget. `allows(stage)` is True when the stage's projected
+    cost plus that of the stages that must still run after it (`then`, by default
+    the `reserve` stages, e.g. generation) fits the remaining time; refused stages
+    are recorded in `skipped`.
+    """
+
+    def __init__(self, budget_ms: Optional[int], reserve: Iterable[str] = ("generation",)):
+        self.budget = budget_ms / 1000 if budget_ms is not None else None
+        self.reserve = tuple(reserve)
+        self.start = time.monotonic()
+        self.skipped: List[str] = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> float:
+        if self.budget is None:
+            return float("inf")
+        return self.budget - self.elapsed()
+
+    def allows(self, stage: str, then: Optional[Iterable[str]] = None) -> bool:
+        if self.budget is None:
+            return True
+        then = self.reserve if then is None else tuple(then)
+        needed = sum(stage_latency.projected(s) for s in (stage, *then))
+        if needed <= self.remaining():
+            return True
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+            with tracer.span(stage, skipped=True, projected_ms=round(needed * 1000, 1), remaining_ms=round(self.remaining() * 1000, 1)):
+                pass
+        logger.info(f"Skipping stage '{stage}': needs ~{needed:.2f}s, {self.remaining():.2f}s left")
+        return False
+
+    @asynccontextmanager
+    async def track(self, stage: str):
+        """Trace the stage and record its duration in the shared histograms."""
+        start = time.monotonic()
+        try:
+            with tracer.span(stage):
+                yield
+        finally:
+            stage_latency.record(stage, time.monotonic() - start)
+
+    def metadata(self) -> Dict[str, object]:
+        return {
+            "latency_budget_ms": int(self.budget * 1000) if self.budget is not None else None,
+            "skipped_stages": list(self.skipped),
+        }
@@ -1,6 +1,9 @@
+import time
 from typing import List, Dict
 from loguru import logger
 from .web_search import WebSearchFallback
+from .deadline import stage_latency
+from app.services.ai.key_scheduler import LLMPriority
 
 class RetrievalEvaluator:
     """
@@ -11,7 +14,7 @@ class RetrievalEvaluator:
         self.threshold_correct = threshold_correct
         self.threshold_incorrect = threshold_incorrect
 
-    async def evaluate(self, query: str, retrieved_docs: List[Dict]) -> str:
+    async def evaluate(self, query: str, retrieved_docs: List[Dict], deadline=None) -> str:
         """
         Evaluate if retrieved docs are relevant to the query
         Returns: 'CORRECT', 'AMBIGUOUS', or 'INCORRECT'
@@ -27,6 +30,10 @@ class RetrievalEvaluator:
         if min_score < 0.5:
             return "CORRECT"
 
+        # No time left for the LLM check
+        if deadline is not None and not deadline.allows("crag_eval"):
+            return self._score_rating(min_score)
+
         # Step 2: LLM-based verification (robust)
         context_snippet = "\n\n".join([f"Source {i+1}: {doc['content'][:500]}" for i, doc in enumerate(retrieved_docs[:3])])
 
@@ -44,12 +51,15 @@ INCORRECT - Context is irrelevant or completely off-topic.
 Rating:"""
 
         try:
+            start = time.monotonic()
             rating = await self.llm.get_completion(
                 [{"role": "system", "content": "You are a retrieval relevance evaluator."},
                  {"role": "user", "content": prompt}],
                 max_tokens=10,
-                temperature=0.1
+                temperature=0.1,
+                priority=LLMPriority.INTERACTIVE_OPTIONAL
             )
+            stage_latency.record("crag_eval", time.monotonic() - start)
 
             rating = rating.strip().upper()
             if "CORRECT" in rating: return "CORRECT"
@@ -59,9 +69,13 @@ Rating:"""
         except Exception as e:
             logger.error(f"Error in LLM evaluation: {e}")
             # Fallback to score heuristic
-            if min_score < 1.2: return "CORRECT"
-            if min_score < 1.7: return "AMBIGUOUS"
-            return "INCORRECT"
+            return self._score_rating(min_score)
+
+    @staticmethod
+    def _score_rating(min_score: float) -> str:
+        if min_score < 1.2: return "CORRECT"
+        if min_score < 1.7: return "AMBIGUOUS"
+        return "INCORRECT"
 
 class CRAGPipeline:
     """
@@ -71,24 +85,23 @@ class CRAGPipeline:
         self.evaluator = evaluator
         self.web_search = web_search
 
-    async def retrieve_with_correction(self, query: str, retrieved_docs: List[Dict]) -> Dict:
+    async def retrieve_with_correction(self, query: str, retrieved_docs: List[Dict], deadline=None) -> Dict:
         """
-        Evaluate and optionally correct retrieval with web search
+        Evaluate and optionally correct retrieval with web search.
+        With a deadline, the LLM check and web search only run if they fit the budget.
         """
-        quality = await self.evaluator.evaluate(query, retrieved_docs)
+        quality = await self.evaluator.evaluate(query, retrieved_docs, deadline=deadline)
 
         final_docs = retrieved_docs
         used_web_search = False
 
-        if quality == "INCORRECT":
-            # Discard and use web search
-            final_docs = await self.web_search.search(query)
-            used_web_search = True
-        elif quality == "AMBIGUOUS":
-            # Combine with web search
+        if quality in ("INCORRECT", "AMBIGUOUS") and (deadline is None or deadline.allows("web_search")):
+            start = time.monotonic()
             web_docs = await self.web_search.search(query)
-            final_docs = retrieved_docs + web_docs
+            stage_latency.record("web_search", time.monotonic() - start)
             used_web_search = True
+            # Incorrect retrieval is discarded, ambiguous retrieval is combined with the web results
+            final_docs = web_docs if quality == "INCORRECT" else retrieved_docs + web_docs
 
         return {
             "documents": final_docs,
@@ -128,7 +141,8 @@ Provide a short critique and a final confidence score (0.0 to 1.0).
             critique_text = await self.llm.get_completion(
                 [{"role": "system", "content": "You are a factual accuracy evaluator."},
                  {"role": "user", "content": prompt}],
-                temperature=0.1
+                temperature=0.1,
+                priority=LLMPriority.BACKGROUND
             )
 
             # Simple parsing of confidence score
@@ -1,6 +1,7 @@
 import json
 from typing import List, Dict, Tuple, Any
 from loguru import logger
+from app.services.ai.key_scheduler import LLMPriority
 
 class EntityExtractor:
     """
@@ -31,7 +32,8 @@ JSON Result:"""
             response = await self.llm.get_completion(
                 [{"role": "system", "content": "You are an expert at information extraction and knowledge graph construction. Always return valid JSON."},
                  {"role": "user", "content": prompt}],
-                temperature=0.1
+                temperature=0.1,
+                priority=LLMPriority.BACKGROUND
             )
 
             # Attempt to parse JSON from response
@@ -4,6 +4,7 @@ from typing import List, Dict, Any, Optional
 import networkx as nx
 from community import community_louvain
 from loguru import logger
+from app.services.ai.key_scheduler import LLMPriority
 
 class KnowledgeGraph:
     """
@@ -102,7 +103,8 @@ Summary (focus on the collective significance):"""
                 summary = await self.llm.get_completion(
                     [{"role": "system", "content": "You are a knowledge graph analyst. Create concise, thematic summaries of entity communities."},
                      {"role": "user", "content": prompt}],
-                    max_tokens=300
+                    max_tokens=300,
+                    priority=LLMPriority.BACKGROUND
                 )
                 self.community_summaries[str(comm_id)] = summary.strip()
             except Exception as e:
@@ -1,6 +1,10 @@
 from typing import List, Dict, Optional
 import asyncio
 from loguru import logger
+from app.services.ai.key_scheduler import LLMPriority
+from app.services.ai.cache import query_key
+from app.core.tiered_cache import TieredCache
+from app.core.tracing import tracer
 
 class HyDEEngine:
     """
@@ -10,7 +14,7 @@ class HyDEEngine:
     def __init__(self, llm_client, embedding_model):
         self.llm = llm_client
         self.embedder = embedding_model
-        self.cache = {}  # Cache for common queries
+        self.cache = TieredCache("hyde", default_ttl=86400)  # Shared across workers via Redis
 
     async def generate_hypothetical_document(
         self,
@@ -21,9 +25,11 @@ class HyDEEngine:
         Generate a hypothetical document that would answer the query
         """
         # Check cache
-        cache_key = f"{query}_{document_style}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        cache_key = query_key(query, document_style)
+        cached = await self.cache.get(cache_key)
+        tracer.annotate(cache_hit=bool(cached))
+        if cached:
+            return cached
 
         # Prompt engineering for different document styles
         prompts = {
@@ -44,11 +50,12 @@ Explain as if teaching someone, using examples and accessible language."""
             hypothetical_doc = await self.llm.get_completion(
                 [{"role": "user", "content": prompts.get(document_style, prompts["informative"])}],
                 max_tokens=200,
-                temperature=0.3
+                temperature=0.3,
+                priority=LLMPriority.INTERACTIVE_OPTIONAL
             )
 
             # Cache result
-            self.cache[cache_key] = hypothetical_doc
+            await self.cache.set(cache_key, hypothetical_doc)
             return hypothetical_doc
         except Exception as e:
             logger.error(f"Error generating hypothetical document: {e}")
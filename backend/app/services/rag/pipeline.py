@@ -1,5 +1,6 @@
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 import asyncio
+import time
 from loguru import logger
 from .hyde import HyDEEngine
 from .reranker import FlashRankReranker
@@ -14,6 +15,41 @@ from .refiner import get_answer_refiner
 from .density_controller import DensityController
 from .language_optimizer import get_language_optimizer
 from .quality_metrics import get_quality_metrics, get_quality_logger
+from .stage_graph import StageGraph
+from .planner import QueryPlanner
+from .compressor import ExtractiveCompressor
+from .retrieval_cache import RetrievalCache
+from .deadline import Deadline, stage_latency
+from app.services.ai.semantic_cache import semantic_cache
+from app.services.ai.key_scheduler import LLMPriority
+from app.services.ai.model_policy import ModelPolicy
+from app.services.ai.token_budget import token_counter, allocate, pack_texts, trim_history
+from app.services.ai.cache import query_key
+from app.core.tiered_cache import TieredCache
+from app.core.config import settings
+from app.core.mongodb import mongodb
+from app.core.tracing import tracer
+from app.services.chat.post_response import post_response_queue
+from bson import ObjectId
+
+# Static rules, headings and instructions of the generation system prompt
+GENERATION_PROMPT_TOKENS = 300
+
+# Metadata describing one request's execution, not its answer: never stored in or replayed from the semantic cache
+PER_REQUEST_METADATA = ("stage_timings", "latency_budget_ms", "skipped_stages", "review_pending")
+
+# Per-stage timeouts (seconds) for the stage graphs; optional stages fall back on expiry
+STAGE_TIMEOUTS = {
+    "memory": 5.0,
+    "visual": 60.0,
+    "plan": 20.0,
+    "rewrite": 15.0,
+    "complexity": 5.0,
+    "multi_query": 15.0,
+    "search": 30.0,
+    "rerank": 20.0,
+    "crag": 45.0,
+}
 
 class OmniRAGPipeline:
     """
@@ -29,25 +65,41 @@ class OmniRAGPipeline:
         self.vector_store = vector_store
         self.llm_client = llm_client
         self.embedder = vector_store.model
-
-        self.hyde_engine = HyDEEngine(llm_client, self.embedder)
+        # Per-stage model/max_tokens/temperature/priority (see model_policy.STAGE_POLICIES)
+        self.model_policy = ModelPolicy(llm_client)
+        stage = self.model_policy.for_stage
+
+        self.hyde_engine = HyDEEngine(stage("hyde"), self.embedder)
+        self.retrieval_cache = RetrievalCache(
+            vector_store,
+            max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+            ttl=settings.RETRIEVAL_CACHE_TTL
+        )
         self.reranker = FlashRankReranker()
+        self.compressor = ExtractiveCompressor(
+            self.embedder,
+            cross_encoder=self.reranker.reranker if settings.COMPRESSION_CROSS_ENCODER else None,
+            query_prefix="Represent this query for retrieving relevant documents: " if vector_store.is_bge else ""
+        )
         self.complexity_classifier = QueryComplexityClassifier()
-        self.knowledge_graph = KnowledgeGraph(llm_client=llm_client)
-        self.entity_extractor = EntityExtractor(llm_client)
+        self.knowledge_graph = KnowledgeGraph(llm_client=stage("community_summary"))
+        self.entity_extractor = EntityExtractor(stage("entity_extraction"))
 
-        self.evaluator = RetrievalEvaluator(llm_client=llm_client)
+        self.evaluator = RetrievalEvaluator(llm_client=stage("crag_eval"))
         self.web_search = WebSearchFallback(api_key=web_search_api_key)
         self.crag_pipeline = CRAGPipeline(self.evaluator, self.web_search)
-        self.self_critique = SelfCritique(llm_client)
-        self.query_rewriter = QueryRewriter(llm_client)
+        self.self_critique = SelfCritique(stage("critique"))
+        self.query_rewriter = QueryRewriter(stage("rewrite"))
+        self.multi_query_cache = TieredCache("multi_query", default_ttl=3600)
+        self.query_planner = QueryPlanner(stage("query_plan"))
         
         # Text Quality Upgrades
-        self.refiner = get_answer_refiner(llm_client)
+        self.refiner = get_answer_refiner(stage("refine"))
         self.density_controller = DensityController()
         self.language_optimizer = get_language_optimizer()
         self.quality_metrics = get_quality_metrics()
         self.quality_logger = get_quality_logger()
+        post_response_queue.register("answer_review", self.review_answer)
 
     async def process_query(
         self,
@@ -60,74 +112,33 @@ class OmniRAGPipeline:
         image_ids: Optional[List[str]] = None,
         db = None,
         memory_summary: Optional[str] = None,
-        use_memory: bool = True
+        use_memory: bool = True,
+        latency_budget_ms: Optional[int] = None
     ) -> Dict:
         """
-        Process query through the advanced pipeline with memory integration
+        Process query through the advanced pipeline with memory integration.
+        Optional stages are skipped when they would exceed latency_budget_ms.
         """
-        # 0. Memory Recall (If enabled and user_id provided)
-        memory_context = ""
-        user_profile = {}
-        
-        if use_memory and user_id:
-            try:
-                from app.services.memory.system import memory_system
-                
-                # Get relevant memories
-                memories = await memory_system.recall(user_id, query, limit=3)
-                if memories:
-                    memory_texts = [m.get('memory', '') for m in memories if m.get('memory')]
-                    if memory_texts:
-                        memory_context = "Previous relevant context:\n" + "\n".join(memory_texts)
-                        logger.info(f"Retrieved {len(memory_texts)} relevant memories")
-                
-                # Get user profile for personalization
-                user_profile = await memory_system.get_user_profile(user_id)
-            except Exception as e:
-                logger.warning(f"Memory recall failed: {e}")
-        
-        # Combine with provided memory_summary
-        if memory_summary:
-            if memory_context:
-                memory_context = f"{memory_context}\n\nSession Summary:\n{memory_summary}"
-            else:
-                memory_context = f"Session Summary:\n{memory_summary}"
-        
-        # 0.1 Visual Perception (If images present)
-        visual_context = ""
-        if image_urls or image_ids:
-            from app.services.ai.image_processor import image_processor
-            visual_context = await image_processor.get_visual_context(
-                image_urls=image_urls,
-                image_ids=image_ids,
-                db=db
-            )
-            if visual_context:
-                logger.info(f"Generated visual context using helper")
-
-        # 0.2 Query Re-writing (Context Optimization with memory)
-        # Enhanced query with memory context for better retrieval
-        enhanced_query = query
-        if memory_context:
-            enhanced_query = f"{memory_context}\n\nCurrent question: {query}"
-        
-        optimized_query = await self.query_rewriter.rewrite(enhanced_query, history)
-
-        # 0.2 Multi-Query Generation (ChatGPT/Gemini style for better coverage)
-        queries = await self._generate_multi_queries(optimized_query)
+        deadline = Deadline(latency_budget_ms)
+        # 0. Memory recall, visual perception, query re-writing and complexity as a stage graph
+        prep = await self._understand(
+            query, history, strategy, image_urls, image_ids, db,
+            recall_user_id=user_id if use_memory else None,
+            memory_summary=memory_summary
+        )
+        memory_context, user_profile = prep["memory_context"], prep["memory"][1]
+        visual_context = prep["visual"]
+        optimized_query = prep["rewrite"]
+        complexity = prep["complexity"]
+        stage_timings = dict(prep["timings"])
 
         if visual_context:
             llm_query = f"{visual_context}\n\nUser Question: {optimized_query}"
         else:
             llm_query = optimized_query
 
-        # 1. Strategy Selection (Adaptive or Explicit)
-        if strategy:
-            complexity = "SIMPLE" if strategy == "direct_generation" else ("MULTI_HOP" if strategy == "graph_rag" else "SINGLE_HOP")
-            logger.info(f"Using explicit strategy: {strategy} (mapped to complexity: {complexity})")
-        else:
-            complexity = self.complexity_classifier.predict_complexity(optimized_query)
-            logger.info(f"Query complexity (adaptive): {complexity}")
+        # 1. Strategy Selection (Adaptive or Explicit), resolved in _understand
+        logger.info(f"Query complexity ({'explicit' if strategy else 'adaptive'}): {complexity}")
 
         messages = history or []
         if not any(msg.get("role") == "user" and msg.get("content") == query for msg in messages):
@@ -141,7 +152,7 @@ class OmniRAGPipeline:
             elif not any(msg.get("role") == "user" and msg.get("content") == query for msg in messages):
                  messages.append({"role": "user", "content": query})
 
-            response = await self.llm_client.get_completion(messages)
+            response = await self.model_policy.for_stage("direct_answer").get_completion(messages)
             return {
                 "query": query,
                 "strategy": "direct_generation",
@@ -154,47 +165,54 @@ class OmniRAGPipeline:
         if complexity == "MULTI_HOP":
             return await self._graph_rag_flow(optimized_query, user_id, session_id, history, visual_context=visual_context)
 
-        # 3. SINGLE_HOP flow with Hybrid Search and Multi-Query Fusion
-        all_retrieved_docs = []
-        for q in queries:
-            # HyDE transformation for each query
-            hyde_result = await self.hyde_engine.transform_query(q)
-
-            # Hybrid search retrieval
-            results = self.vector_store.search(
-                query=hyde_result['hypothetical_document'],
-                user_id=user_id,
-                session_id=session_id,
-                k=20,
-                alpha=0.6 # Favor semantic but include keyword
-            )
-            all_retrieved_docs.extend(results)
-
-        # 4. Deduplicate and Rerank
-        unique_docs = self._deduplicate_docs(all_retrieved_docs)
-
-        reranked_results = self.reranker.rerank(
-            query=optimized_query,
-            documents=unique_docs,
-            top_k=10
-        )
-
-        # 5. CRAG evaluation and correction
-        crag_result = await self.crag_pipeline.retrieve_with_correction(
-            query=optimized_query,
-            retrieved_docs=reranked_results
-        )
+        # 3-5. SINGLE_HOP flow: Multi-Query + HyDE hybrid search, rerank, CRAG (stage graph)
+        retrieval = await self._retrieve(optimized_query, user_id, session_id, plan=prep["plan"], deadline=deadline)
+        queries = retrieval["multi_query"]
+        crag_result = retrieval["crag"]
+        stage_timings.update(retrieval["timings"])
 
         final_docs = crag_result['documents']
 
+        # 5b. Semantic response cache: same standalone question over the same retrieved context
+        cache_fingerprint = None
+        if not visual_context:
+            cache_fingerprint = semantic_cache.fingerprint(d.get('content', '') for d in final_docs[:5])
+            with tracer.span("semantic_cache"):
+                cached = await semantic_cache.get(user_id, optimized_query, cache_fingerprint)
+                tracer.annotate(cache_hit=bool(cached))
+            if cached:
+                # The answer is reused, but it is reviewed (and remembered) as a new message
+                metadata = {
+                    **{k: v for k, v in cached["metadata"].items() if k not in PER_REQUEST_METADATA},
+                    "semantic_cache_hit": True,
+                    "stage_timings": stage_timings,
+                    **deadline.metadata(),
+                    "review_pending": True
+                }
+                return {
+                    "query": query,
+                    "strategy": "vector_rag",
+                    "response": cached["response"],
+                    "documents": final_docs[:5],
+                    "metadata": metadata,
+                    "review": self._review_payload(
+                        query, cached["response"], final_docs, metadata, "vector_rag",
+                        remember_user_id=user_id if use_memory else None
+                    )
+                }
+
         # 6. Contextual Compression (Refining results to reduce noise)
-        compressed_docs = await self._compress_all_contexts(optimized_query, final_docs[:5])
-        context_text = "\n\n".join(compressed_docs)
+        compressed_docs = await self._compress_all_contexts(optimized_query, final_docs[:5], deadline)
 
         # 7. Generate final response with Text Quality Upgrades
         
         # Get schema prompt based on complexity
         schema_instructions = get_schema_prompt(AnswerComplexity(complexity))
+
+        memory_summary, visual_context, context_text, history = self._fit_prompt_sections(
+            GENERATION_PROMPT_TOKENS + token_counter.count(schema_instructions),
+            query, history, compressed_docs, memory_summary, visual_context
+        )
         
         system_prompt = f"""You are Engunity AI, an advanced multimodal assistant.
 
@@ -231,7 +249,8 @@ Instructions:
             final_messages.append({"role": "user", "content": query})
 
         # STAGE A: Draft Generation (Fast, Factual)
-        draft_response = await self.llm_client.get_completion(final_messages, temperature=0.3)
+        async with deadline.track("generation"):
+            draft_response = await self.model_policy.for_stage("generation").get_completion(final_messages, temperature=0.3)
         
         # Validate draft structure
         validation = validate_answer_structure(draft_response, AnswerComplexity(complexity))
@@ -247,12 +266,16 @@ Instructions:
             f"Naturalness={naturalness_score:.2f}"
         )
         
-        # STAGE B: Refinement (Clarity-focused)
-        refinement_result = await self.refiner.refine(
-            draft_answer=draft_response,
-            complexity=complexity,
-            validation_scores=validation['scores']
-        )
+        # STAGE B: Refinement (Clarity-focused), only if it still fits the latency budget
+        if deadline.allows("refine", then=()):
+            async with deadline.track("refine"):
+                refinement_result = await self.refiner.refine(
+                    draft_answer=draft_response,
+                    complexity=complexity,
+                    validation_scores=validation['scores']
+                )
+        else:
+            refinement_result = {'refined_answer': draft_response, 'refinement_applied': False, 'reason': 'Latency budget'}
         
         # Use refined version if applied
         response = refinement_result['refined_answer']
@@ -266,52 +289,12 @@ Instructions:
                 f"{improvements['filler_phrases_removed']} filler phrases removed"
             )
         
-        # 7. Self-Critique / Reflection
-        critique_result = await self.self_critique.critique(query, response, final_docs)
-        logger.info(f"Self-critique confidence: {critique_result['confidence']}")
-
-        # 8. Store interaction in memory (if enabled)
-        if use_memory and user_id:
-            try:
-                from app.services.memory.system import memory_system
-                await memory_system.remember(
-                    user_id=user_id,
-                    message=query,
-                    response=response,
-                    metadata={
-                        'sources': [d.get('metadata', {}).get('filename', 'Unknown') for d in final_docs[:3]],
-                        'strategy': 'vector_rag',
-                        'confidence': critique_result['confidence']
-                    }
-                )
-                logger.info(f"Stored interaction in memory for user {user_id}")
-            except Exception as e:
-                logger.warning(f"Memory storage failed: {e}")
-
-        # 9. Calculate Overall Quality Metrics
-        overall_quality = self.quality_metrics.calculate_overall_quality(
-            structure_score=validation['overall_structure_score'],
-            density_score=density_analysis['density_score'],
-            naturalness_score=naturalness_score,
-            confidence=critique_result['confidence'],
-            complexity=complexity
-        )
-        
-        # Log quality metrics
-        self.quality_metrics.log_generation_quality(
-            query=query,
-            response=response,
-            quality_data=overall_quality,
-            refinement_data=refinement_result if refinement_result['refinement_applied'] else None
-        )
-        
-        # Prepare metadata with quality scores
+        # Prepare metadata with quality scores. Self-critique, the overall quality score,
+        # the memory write and quality logging run after the response is sent (review_answer).
         metadata = {
             "complexity": complexity,
             "retrieval_quality": crag_result['retrieval_quality'],
             "used_web_search": crag_result['used_web_search'],
-            "confidence": critique_result['confidence'],
-            "critique": critique_result['critique'],
             "multi_queries": queries,
             "context_compressed": len(compressed_docs) > 0,
             "memory_used": bool(memory_context),
@@ -320,34 +303,428 @@ Instructions:
             "structure_score": validation['overall_structure_score'],
             "density_score": density_analysis['density_score'],
             "naturalness_score": naturalness_score,
-            "overall_quality_score": overall_quality['overall_score'],
-            "quality_tier": overall_quality['quality_tier'],
             "refinement_applied": refinement_result['refinement_applied'],
-            "refinement_improvements": refinement_result.get('improvements', {})
+            "refinement_improvements": refinement_result.get('improvements', {}),
+            "stage_timings": stage_timings,
+            **deadline.metadata(),
+            "review_pending": True
         }
-        
-        # Log to quality logger
-        self.quality_logger.log_interaction(query, response, metadata)
+
+        if cache_fingerprint:
+            await semantic_cache.set(user_id, optimized_query, cache_fingerprint, {
+                "response": response,
+                "metadata": {k: v for k, v in metadata.items() if k not in PER_REQUEST_METADATA}
+            })
         
         return {
             "query": query,
             "strategy": "vector_rag",
             "response": response,
             "documents": final_docs[:5],
-            "metadata": metadata
+            "metadata": metadata,
+            "review": self._review_payload(
+                query, response, final_docs, metadata, "vector_rag",
+                remember_user_id=user_id if use_memory else None,
+                refinement=refinement_result if refinement_result['refinement_applied'] else None
+            )
         }
 
+    def _review_payload(
+        self,
+        query: str,
+        response: str,
+        documents: List[Dict],
+        metadata: Dict[str, Any],
+        strategy: str,
+        remember_user_id: Optional[str] = None,
+        refinement: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """JSON-serializable input of review_answer; the caller adds the stored message_id."""
+        return {
+            "query": query,
+            "response": response,
+            "strategy": strategy,
+            "documents": [
+                {"content": d.get('content', ''), "metadata": {"filename": d.get('metadata', {}).get('filename', 'Unknown')}}
+                for d in documents[:5]
+            ],
+            "metadata": {k: v for k, v in metadata.items() if k != "stage_timings"},
+            "remember_user_id": remember_user_id,
+            "refinement": refinement
+        }
+
+    async def review_answer(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Post-response stage (see post_response_queue): self-critique, overall quality,
+        memory write and quality logs. The result is attached to the stored message.
+        """
+        query, response, metadata = payload["query"], payload["response"], payload["metadata"]
+
+        # Self-Critique / Reflection
+        critique_result = await self.self_critique.critique(query, response, payload["documents"])
+        logger.info(f"Self-critique confidence ({payload['strategy']}): {critique_result['confidence']}")
+        review = {"confidence": critique_result['confidence'], "critique": critique_result['critique']}
+
+        # Overall Quality Metrics (vector RAG answers carry the text quality scores)
+        if "structure_score" in metadata:
+            overall_quality = self.quality_metrics.calculate_overall_quality(
+                structure_score=metadata['structure_score'],
+                density_score=metadata['density_score'],
+                naturalness_score=metadata['naturalness_score'],
+                confidence=critique_result['confidence'],
+                complexity=metadata['complexity']
+            )
+            self.quality_metrics.log_generation_quality(
+                query=query,
+                response=response,
+                quality_data=overall_quality,
+                refinement_data=payload.get("refinement")
+            )
+            review["overall_quality_score"] = overall_quality['overall_score']
+            review["quality_tier"] = overall_quality['quality_tier']
+
+        message_id = payload.get("message_id")
+        if message_id and mongodb.db is not None:
+            try:
+                await mongodb.db.chat_messages.update_one(
+                    {"_id": ObjectId(message_id)},
+                    {"$set": {**review, "review_pending": False}}
+                )
+            except Exception as e:
+                logger.warning(f"Could not attach review to message {message_id}: {e}")
+
+        # Store interaction in memory (if enabled)
+        user_id = payload.get("remember_user_id")
+        if user_id:
+            try:
+                from app.services.memory.system import memory_system
+                await post_response_queue.run_blocking(
+                    memory_system.store_interaction,
+                    user_id=user_id,
+                    message=query,
+                    response=response,
+                    metadata={
+                        'sources': [d['metadata']['filename'] for d in payload["documents"][:3]],
+                        'strategy': payload['strategy'],
+                        'confidence': critique_result['confidence']
+                    }
+                )
+                logger.info(f"Stored interaction in memory for user {user_id}")
+            except Exception as e:
+                logger.warning(f"Memory storage failed: {e}")
+
+        # Log to quality logger
+        if "structure_score" in metadata:
+            await post_response_queue.run_blocking(self.quality_logger.log_interaction, query, response, {**metadata, **review})
+
+        return review
+
+    async def _understand(
+        self,
+        query: str,
+        history: Optional[List[Dict[str, str]]],
+        strategy: Optional[str],
+        image_urls: Optional[List[str]],
+        image_ids: Optional[List[str]],
+        db,
+        recall_user_id: Optional[str] = None,
+        memory_summary: Optional[str] = None,
+        on_stage: Optional[Callable] = None
+    ) -> Dict[str, Any]:
+        """
+        Memory recall and visual perception run concurrently; the query plan waits
+        only for memory. Without a usable plan the rewrite and the complexity
+        classifier run as separate stages.
+        """
+        graph = StageGraph("understand", on_stage=on_stage)
+        if recall_user_id:
+            graph.add("memory", lambda: self._recall_memory(recall_user_id, query),
+                      timeout=STAGE_TIMEOUTS["memory"], fallback=("", {}))
+        else:
+            graph.add("memory", lambda: ("", {}))
+        graph.add("memory_context", lambda memory: self._combine_memory(memory[0], memory_summary), inputs=["memory"])
+
+        if image_urls or image_ids:
+            graph.add("visual", lambda: self._visual_context(image_urls, image_ids, db),
+                      timeout=STAGE_TIMEOUTS["visual"], fallback="")
+        else:
+            graph.add("visual", lambda: "")
+
+        # Fused plan: standalone query, variants, HyDE passages and complexity in one call
+        if settings.QUERY_PLANNER_ENABLED:
+            graph.add("plan", lambda memory_context: self.query_planner.plan(query, history, memory_context),
+                      inputs=["memory_context"], timeout=STAGE_TIMEOUTS["plan"], fallback=None)
+        else:
+            graph.add("plan", lambda: None)
+
+        # Enhanced query with memory context for better retrieval
+        def rewrite(plan, memory_context):
+            if plan:
+                return plan["standalone_query"]
+            return self.query_rewriter.rewrite(
+                f"{memory_context}\n\nCurrent question: {query}" if memory_context else query, history
+            )
+        graph.add("rewrite", rewrite, inputs=["plan", "memory_context"], timeout=STAGE_TIMEOUTS["rewrite"],
+                  fallback=lambda plan, memory_context: query)
+
+        if strategy:
+            complexity = "SIMPLE" if strategy == "direct_generation" else ("MULTI_HOP" if strategy == "graph_rag" else "SINGLE_HOP")
+            graph.add("complexity", lambda: complexity)
+        else:
+            def classify(plan, optimized_query):
+                if plan and plan["complexity"]:
+                    return plan["complexity"]
+                return self.complexity_classifier.predict_complexity(optimized_query)
+            graph.add("complexity", classify, inputs=["plan", "rewrite"],
+                      blocking=True, timeout=STAGE_TIMEOUTS["complexity"], fallback="SINGLE_HOP")
+
+        state = await graph.run()
+        state["timings"] = graph.timings
+        return state
+
+    async def _recall_memory(self, user_id: str, query: str):
+        """(relevant memories as text, user profile)"""
+        from app.services.memory.system import memory_system
+
+        memory_context = ""
+        memories = await memory_system.recall(user_id, query, limit=3)
+        if memories:
+            memory_texts = [m.get('memory', '') for m in memories if m.get('memory')]
+            if memory_texts:
+                memory_context = "Previous relevant context:\n" + "\n".join(memory_texts)
+                logger.info(f"Retrieved {len(memory_texts)} relevant memories")
+
+        # Get user profile for personalization
+        user_profile = await memory_system.get_user_profile(user_id)
+        return memory_context, user_profile
+
+    @staticmethod
+    def _combine_memory(memory_context: str, memory_summary: Optional[str]) -> str:
+        if not memory_summary:
+            return memory_context
+        if memory_context:
+            return f"{memory_context}\n\nSession Summary:\n{memory_summary}"
+        return f"Session Summary:\n{memory_summary}"
+
+    async def _visual_context(self, image_urls, image_ids, db) -> str:
+        from app.services.ai.image_processor import image_processor
+        visual_context = await image_processor.get_visual_context(
+            image_urls=image_urls,
+            image_ids=image_ids,
+            db=db
+        )
+        if visual_context:
+            logger.info(f"Generated visual context using helper")
+        return visual_context
+
+    async def _retrieve(
+        self,
+        optimized_query: str,
+        user_id: str,
+        session_id: Optional[str],
+        plan: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
+        on_stage: Optional[Callable] = None,
+        defer_crag: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Multi-query + HyDE hybrid search, rerank and CRAG as a stage graph. Search for the
+        optimized query starts right away; the variants follow once they are generated.
+        With a query plan, its variants and hypothetical passages replace those LLM calls.
+        Results are served from the retrieval cache while the user's corpus is unchanged.
+        With defer_crag, "crag" holds the reranked documents (quality PENDING) and
+        "crag_task" resolves to the corrected result.
+        """
+        start = time.perf_counter()
+        with tracer.span("retrieval_cache"):
+            cached = self.retrieval_cache.get(user_id, session_id, optimized_query)
+            tracer.annotate(cache_hit=cached is not None)
+        if cached is not None:
+            logger.info(f"Retrieval cache hit for '{optimized_query}'")
+            timings = {"retrieval_cache": {"ms": round((time.perf_counter() - start) * 1000, 3), "status": "hit"}}
+            if on_stage is not None:
+                on_stage("retrieval_cache", cached["documents"], timings["retrieval_cache"])
+            return {
+                "multi_query": cached["multi_query"],
+                "crag": {**cached["crag"], "documents": cached["documents"]},
+                "timings": timings
+            }
+
+        hypothetical = dict(plan["hypothetical"]) if plan else {}
+        if plan:
+            # Keep retrieval to the single planning round trip: the standalone query is
+            # searched as-is (the variants carry the hypothetical passages)
+            hypothetical.setdefault(optimized_query, optimized_query)
+
+        def search_many(queries):
+            variants = [q for q in queries if q != optimized_query]
+            return asyncio.gather(*[
+                self._hyde_search(q, user_id, session_id, hypothetical.get(q)) for q in variants
+            ])
+
+        graph = StageGraph("retrieve", on_stage=on_stage)
+        if plan:
+            graph.add("multi_query", lambda: plan["queries"])
+        else:
+            graph.add("multi_query", lambda: self._generate_multi_queries(optimized_query),
+                      timeout=STAGE_TIMEOUTS["multi_query"], fallback=lambda: [optimized_query])
+        graph.add("primary", lambda: self._hyde_search(optimized_query, user_id, session_id, hypothetical.get(optimized_query)),
+                  timeout=STAGE_TIMEOUTS["search"], fallback=[])
+        graph.add("variants", search_many, inputs=["multi_query"],
+                  timeout=STAGE_TIMEOUTS["search"], fallback=lambda queries: [])
+        graph.add("candidates", lambda primary, variants: self._deduplicate_docs(primary + [d for r in variants for d in r]),
+                  inputs=["primary", "variants"])
+        graph.add("rerank", lambda docs: self.reranker.rerank(query=optimized_query, documents=docs, top_k=10),
+                  inputs=["candidates"], blocking=True, timeout=STAGE_TIMEOUTS["rerank"], fallback=lambda docs: docs[:10])
+        if not defer_crag:
+            graph.add("crag", lambda docs: self.crag_pipeline.retrieve_with_correction(query=optimized_query, retrieved_docs=docs, deadline=deadline),
+                      inputs=["rerank"], timeout=STAGE_TIMEOUTS["crag"],
+                      fallback=lambda docs: {"documents": docs, "retrieval_quality": "UNKNOWN", "used_web_search": False})
+
+        state = await graph.run()
+        state["timings"] = graph.timings
+
+        if not defer_crag:
+            self._cache_retrieval(user_id, session_id, optimized_query, state, deadline)
+        elif not state["rerank"]:
+            # Nothing to answer from until the web search fallback has run
+            state["crag"] = await self._deferred_crag(optimized_query, user_id, session_id, state)
+        else:
+            state["crag"] = {"documents": state["rerank"], "retrieval_quality": "PENDING", "used_web_search": False}
+            state["crag_task"] = asyncio.ensure_future(self._deferred_crag(optimized_query, user_id, session_id, state))
+        return state
+
+    def _cache_retrieval(self, user_id: str, session_id: Optional[str], optimized_query: str, state: Dict[str, Any], deadline: Optional[Deadline] = None):
+        # Degraded results (fallbacks, checks skipped for the latency budget) are not cached
+        degraded = any(t["status"] != "ok" for t in state["timings"].values()) or (
+            deadline is not None and {"crag_eval", "web_search"} & set(deadline.skipped)
+        )
+        if not degraded:
+            crag = state["crag"]
+            self.retrieval_cache.set(user_id, session_id, optimized_query, {
+                "multi_query": state["multi_query"],
+                "crag": {k: v for k, v in crag.items() if k != "documents"},
+                "documents": crag["documents"],
+            })
+
+    async def _deferred_crag(self, optimized_query: str, user_id: str, session_id: Optional[str], state: Dict[str, Any]) -> Dict[str, Any]:
+        """CRAG outside the retrieval graph, for answers streamed from the reranked documents."""
+        docs = state["rerank"]
+        start = time.perf_counter()
+        status = "ok"
+        with tracer.span("retrieve.crag", deferred=True):
+            try:
+                crag = await asyncio.wait_for(
+                    self.crag_pipeline.retrieve_with_correction(query=optimized_query, retrieved_docs=docs),
+                    timeout=STAGE_TIMEOUTS["crag"]
+                )
+            except Exception as e:
+                status = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                logger.warning(f"Deferred CRAG {status}, keeping reranked documents: {e!r}")
+                tracer.set_status(status)
+                crag = {"documents": docs, "retrieval_quality": "UNKNOWN", "used_web_search": False}
+
+        state["crag"] = crag
+        state["timings"]["crag"] = {"ms": round((time.perf_counter() - start) * 1000, 1), "status": status}
+        self._cache_retrieval(user_id, session_id, optimized_query, state)
+        return crag
+
+    async def _hyde_search(self, query: str, user_id: str, session_id: Optional[str], passage: Optional[str] = None) -> List[Dict]:
+        # HyDE transformation (unless the query plan already wrote the passage), then hybrid search retrieval
+        if not passage:
+            passage = (await self.hyde_engine.transform_query(query))['hypothetical_document']
+        return self.vector_store.search(
+            query=passage,
+            user_id=user_id,
+            session_id=session_id,
+            k=20,
+            alpha=0.6 # Favor semantic but include keyword
+        )
+
+    async def _graph_sources(self, query: str, user_id: str, session_id: Optional[str], on_stage: Optional[Callable] = None) -> Dict[str, Any]:
+        """Community search and HyDE + vector search for GraphRAG, concurrently."""
+        async def hyde_vector(hyde_result):
+            return self.vector_store.search(
+                query=hyde_result['hypothetical_document'],
+                user_id=user_id,
+                session_id=session_id,
+                k=10
+            )
+
+        graph = StageGraph("graph_sources", on_stage=on_stage)
+        graph.add("communities", lambda: self.knowledge_graph.search_communities(query, embedder=self.embedder, top_k=3, user_id=user_id),
+                  blocking=True, timeout=STAGE_TIMEOUTS["search"], fallback=[])
+        graph.add("hyde", lambda: self.hyde_engine.transform_query(query), timeout=STAGE_TIMEOUTS["search"])
+        graph.add("vector", hyde_vector, inputs=["hyde"], timeout=STAGE_TIMEOUTS["search"], fallback=lambda hyde_result: [])
+        return await graph.run()
+
+    @staticmethod
+    def _progress_event(stage: str, result: Any, timing: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Client-facing progress event for a finished stage (None for internal stages)."""
+        if stage == "rewrite":
+            details = {"query": result}
+        elif stage == "complexity":
+            details = {"complexity": result}
+        elif stage == "multi_query":
+            details = {"queries": result}
+        elif stage == "variants":
+            details = {"sources_found": sum(len(docs) for docs in result)}
+        elif stage in ("primary", "candidates", "communities", "vector"):
+            details = {"sources_found": len(result)}
+        elif stage in ("rerank", "retrieval_cache"):
+            details = {"documents_selected": [doc['metadata'].get('filename') for doc in result[:5]]}
+        else:
+            return None
+        return {"type": "progress", "stage": stage, "status": timing.get("status", "ok"), "ms": timing.get("ms"), **details}
+
+    def _progress_reporter(self, queue: asyncio.Queue) -> Callable:
+        """StageGraph on_stage callback that queues progress events."""
+        def report(stage: str, result: Any, timing: Dict[str, Any]):
+            event = self._progress_event(stage, result, timing)
+            if event is not None:
+                queue.put_nowait(event)
+        return report
+
+    @staticmethod
+    async def _drain_progress(task: asyncio.Future, queue: asyncio.Queue):
+        """Yield queued progress events until task finishes (the task is cancelled if the stream is)."""
+        getter = None
+        try:
+            while not task.done():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            while not queue.empty():
+                yield queue.get_nowait()
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not task.done():
+                task.cancel()
+
     async def _generate_multi_queries(self, query: str) -> List[str]:
         """Generate multiple search queries and a 'step-back' abstraction to improve retrieval"""
+        cache_key = query_key(query)
+        cached = await self.multi_query_cache.get(cache_key)
+        tracer.annotate(cache_hit=bool(cached))
+        if cached:
+            return cached
+
         prompt = [
             {"role": "system", "content": "You are an AI assistant that improves retrieval by generating search variations. Return exactly 4 lines:\nLine 1-3: Diverse variations of the user's search intent.\nLine 4: A broader, more abstract 'step-back' version of the query to capture high-level concepts.\nNo numbering, just the queries."},
             {"role": "user", "content": f"Query: {query}"}
         ]
         try:
-            res = await self.llm_client.get_completion(prompt, max_tokens=150, temperature=0.6)
+            res = await self.model_policy.for_stage("multi_query").get_completion(
+                prompt, max_tokens=150, temperature=0.6, priority=LLMPriority.INTERACTIVE_OPTIONAL
+            )
             queries = [q.strip() for q in res.split('\n') if q.strip()][:4]
             if not queries:
                 return [query]
+            await self.multi_query_cache.set(cache_key, queries)
             return queries
         except:
             return [query]
@@ -363,23 +740,58 @@ Instructions:
                 deduped.append(doc)
         return deduped
 
-    async def _compress_context(self, query: str, document: str) -> str:
-        """Refine document content to only relevant parts for the query"""
-        prompt = [
-            {"role": "system", "content": "Extract only the parts of the document that are relevant to answering the query. Keep original wording. If the entire document is relevant, return it as is. If none is relevant, return an empty string."},
-            {"role": "user", "content": f"Query: {query}\n\nDocument: {document}\n\nRelevant Excerpts:"}
-        ]
-        try:
-            res = await self.llm_client.get_completion(prompt, max_tokens=300, temperature=0.1)
-            return res.strip()
-        except:
-            return document[:1000]
+    def _fit_prompt_sections(
+        self,
+        reserved: int,
+        query: str,
+        history: Optional[List[Dict[str, str]]],
+        context_docs: List[str],
+        memory_summary: Optional[str],
+        visual_context: str
+    ):
+        """
+        Size the generation prompt to PROMPT_TOKEN_BUDGET. Priority: current turn,
+        visual context, documents (greedily, in rank order), memory summary, older history.
+        Returns (memory_summary, visual_context, context_text, history)
+        """
+        turns = [m for m in (history or []) if m.get("role") != "system"]
+        latest, older = turns[-1:], turns[:-1]
+        budget = settings.PROMPT_TOKEN_BUDGET - reserved
+        grants = allocate(budget, [
+            {"name": "latest", "priority": 0,
+             "tokens": token_counter.count_messages(latest) if latest else token_counter.count(query)},
+            {"name": "visual", "priority": 1, "min": budget // 10, "tokens": token_counter.count(visual_context or "")},
+            {"name": "documents", "priority": 2, "min": budget // 4,
+             "tokens": sum(token_counter.count(d) for d in context_docs)},
+            {"name": "memory", "priority": 3, "min": min(200, budget // 10), "tokens": token_counter.count(memory_summary or "")},
+            {"name": "history", "priority": 4, "tokens": token_counter.count_messages(older)},
+        ])
+
+        context_text = "\n\n".join(pack_texts(context_docs, grants["documents"]))
+        if memory_summary:
+            memory_summary = token_counter.truncate(memory_summary, grants["memory"])
+        if visual_context:
+            visual_context = token_counter.truncate(visual_context, grants["visual"])
+        fitted_history = trim_history(older, grants["history"]) + trim_history(latest, grants["latest"]) if turns else history
+        return memory_summary, visual_context, context_text, fitted_history
 
-    async def _compress_all_contexts(self, query: str, docs: List[Dict]) -> List[str]:
-        """Compress multiple documents in parallel"""
-        tasks = [self._compress_context(query, doc['content']) for doc in docs]
-        compressed = await asyncio.gather(*tasks)
-        return [c for c in compressed if c]
+    async def _compress_all_contexts(self, query: str, docs: List[Dict], deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Extract the query-relevant sentences of the documents (local, no LLM calls);
+        raw content (packed to the prompt budget) when out of time
+        """
+        contents = [doc['content'] for doc in docs if doc.get('content')]
+        if deadline is not None and not deadline.allows("compression"):
+            return contents
+        start = time.monotonic()
+        with tracer.span("compression", documents=len(contents)):
+            compressed = await asyncio.to_thread(
+                self.compressor.compress, query, contents, settings.COMPRESSION_TOKEN_BUDGET
+            )
+            tracer.annotate(input_tokens=sum(token_counter.count(c) for c in contents),
+                            output_tokens=sum(token_counter.count(c) for c in compressed))
+        stage_latency.record("compression", time.monotonic() - start)
+        return compressed
 
     async def _graph_rag_flow(
         self,
@@ -395,16 +807,9 @@ Instructions:
         """
         # ... rest of method
         # Search relevant communities
-        relevant_communities = self.knowledge_graph.search_communities(query, embedder=self.embedder, top_k=3, user_id=user_id)
-
-        # HyDE + Vector Search
-        hyde_result = await self.hyde_engine.transform_query(query)
-        vector_results = self.vector_store.search(
-            query=hyde_result['hypothetical_document'],
-            user_id=user_id,
-            session_id=session_id,
-            k=10
-        )
+        # and HyDE + Vector Search, concurrently
+        sources = await self._graph_sources(query, user_id, session_id)
+        relevant_communities, vector_results = sources["communities"], sources["vector"]
 
         # Step 1: MAP Phase - Generate partial answers from each source
         map_tasks = []
@@ -441,29 +846,27 @@ Instructions:
 
 Comprehensive Answer:"""
 
-        response = await self.llm_client.get_completion(
+        response = await self.model_policy.for_stage("synthesis").get_completion(
             [{"role": "system", "content": "You are a specialized synthesizer for multi-hop reasoning."},
              {"role": "user", "content": reduce_prompt}],
             temperature=0.3
         )
 
-        # Step 3: Self-Critique
-        critique_result = await self.self_critique.critique(query, response, vector_results)
-        logger.info(f"GraphRAG self-critique confidence: {critique_result['confidence']}")
-
+        # Step 3: Self-Critique runs after the response is sent (review_answer)
+        metadata = {
+            "complexity": "MULTI_HOP",
+            "communities_used": len(relevant_communities),
+            "partial_answers_count": len(partial_answers),
+            "map_reduce_used": True,
+            "review_pending": True
+        }
         return {
             "query": query,
             "strategy": "graph_rag",
             "response": response,
             "documents": vector_results[:5],
-            "metadata": {
-                "complexity": "MULTI_HOP",
-                "communities_used": len(relevant_communities),
-                "partial_answers_count": len(partial_answers),
-                "map_reduce_used": True,
-                "confidence": critique_result['confidence'],
-                "critique": critique_result['critique']
-            }
+            "metadata": metadata,
+            "review": self._review_payload(query, response, vector_results, metadata, "graph_rag")
         }
 
     async def _generate_partial_answer(self, query: str, content: str, source_name: str) -> str:
@@ -477,7 +880,7 @@ Question: {query}
 Partial Answer (cite source):"""
 
         try:
-            return await self.llm_client.get_completion(
+            return await self.model_policy.for_stage("partial_answer").get_completion(
                 [{"role": "system", "content": "Generate a concise partial answer based on provided context."},
                  {"role": "user", "content": prompt}],
                 max_tokens=250,
@@ -497,40 +900,35 @@ Partial Answer (cite source):"""
         image_urls: Optional[List[str]] = None,
         image_ids: Optional[List[str]] = None,
         db = None,
-        memory_summary: Optional[str] = None
+        memory_summary: Optional[str] = None,
+        latency_budget_ms: Optional[int] = None
     ):
         """
-        Stream query response through the advanced pipeline
+        Stream query response through the advanced pipeline.
+        Progress events are sent as stages finish. With STREAM_DEFER_CRAG the answer
+        starts from the reranked documents and CRAG's verdict follows as a refinement
+        event; an answer the verdict would have changed is not cached. The latency
+        budget covers the time to the first answer token.
         """
-        # 0. Visual Perception (If images present)
-        visual_context = ""
+        deadline = Deadline(latency_budget_ms, reserve=("generation_ttft",))
+        progress = asyncio.Queue()
+        report = self._progress_reporter(progress)
+        # 0. Visual perception, query re-writing and complexity (stage graph)
         if image_urls or image_ids:
-            from app.services.ai.image_processor import image_processor
-            if not any(event.get("type") == "content" for event in []): # Just a trick to yield if we were in a generator
-                 yield {"type": "content", "content": "🔍 *Analyzing images...*\n\n"}
-
-            visual_context = await image_processor.get_visual_context(
-                image_urls=image_urls,
-                image_ids=image_ids,
-                db=db
-            )
-            if visual_context:
-                logger.info(f"Generated visual context using helper for streaming")
-
-        # 0.1 Query Re-writing
-        optimized_query = await self.query_rewriter.rewrite(query, history)
+            yield {"type": "content", "content": "🔍 *Analyzing images...*\n\n"}
+
+        understand = asyncio.ensure_future(self._understand(query, history, strategy, image_urls, image_ids, db, on_stage=report))
+        async for event in self._drain_progress(understand, progress):
+            yield event
+        prep = understand.result()
+        visual_context = prep["visual"]
+        optimized_query = prep["rewrite"]
+        complexity = prep["complexity"]
         if visual_context:
             llm_query = f"{visual_context}\n\nUser Question: {optimized_query}"
         else:
             llm_query = optimized_query
 
-        # 1. Strategy Selection
-        if strategy:
-            complexity = "SIMPLE" if strategy == "direct_generation" else ("MULTI_HOP" if strategy == "graph_rag" else "SINGLE_HOP")
-            logger.info(f"Using explicit strategy for stream: {strategy} (mapped to complexity: {complexity})")
-        else:
-            complexity = self.complexity_classifier.predict_complexity(optimized_query)
-
         yield {"type": "metadata", "complexity": complexity}
 
         messages = history or []
@@ -544,32 +942,35 @@ Partial Answer (cite source):"""
             elif not any(msg.get("role") == "user" and msg.get("content") == query for msg in messages):
                  messages.append({"role": "user", "content": query})
 
-            async for chunk in self.llm_client.get_streaming_completion(messages):
+            async for chunk in self.model_policy.for_stage("direct_answer").get_streaming_completion(messages):
                 yield {"type": "content", "content": chunk}
             yield {"type": "done", "strategy": "direct_generation"}
             return
 
         if complexity == "MULTI_HOP":
             # GraphRAG Stream Flow
-            hyde_result = await self.hyde_engine.transform_query(optimized_query)
+            gathering = asyncio.ensure_future(self._graph_sources(optimized_query, user_id, session_id, on_stage=report))
+            async for event in self._drain_progress(gathering, progress):
+                yield event
+            sources = gathering.result()
+            hyde_result, relevant_communities, vector_results = sources["hyde"], sources["communities"], sources["vector"]
             yield {"type": "metadata", "hyde_doc": hyde_result['hypothetical_document']}
 
-            relevant_communities = self.knowledge_graph.search_communities(optimized_query, embedder=self.embedder, top_k=3, user_id=user_id)
-            vector_results = self.vector_store.search(
-                query=hyde_result['hypothetical_document'],
-                user_id=user_id,
-                session_id=session_id,
-                k=10
-            )
-
-            # Step 1: MAP Phase
+            # Step 1: MAP Phase (progress reported as each partial answer lands)
             map_tasks = []
             for comm in relevant_communities:
-                map_tasks.append(self._generate_partial_answer(optimized_query, comm['summary'], f"Community {comm['community_id']}"))
+                map_tasks.append(asyncio.ensure_future(self._generate_partial_answer(optimized_query, comm['summary'], f"Community {comm['community_id']}")))
             for doc in vector_results[:5]:
-                map_tasks.append(self._generate_partial_answer(optimized_query, doc['content'], doc['metadata'].get('filename', 'Unknown')))
+                map_tasks.append(asyncio.ensure_future(self._generate_partial_answer(optimized_query, doc['content'], doc['metadata'].get('filename', 'Unknown'))))
 
-            partial_answers = list(await asyncio.gather(*map_tasks))
+            try:
+                for completed, future in enumerate(asyncio.as_completed(map_tasks), 1):
+                    await future
+                    yield {"type": "progress", "stage": "partial_answer", "completed": completed, "total": len(map_tasks)}
+            finally:
+                for task in map_tasks:
+                    task.cancel()
+            partial_answers = [task.result() for task in map_tasks]
 
             # Add visual context and memory summary to synthesis
             if visual_context:
@@ -606,48 +1007,62 @@ Comprehensive Answer:"""
             ]
 
             full_response = ""
-            async for chunk in self.llm_client.get_streaming_completion(final_messages, temperature=0.3):
+            async for chunk in self.model_policy.for_stage("synthesis").get_streaming_completion(final_messages, temperature=0.3):
                 full_response += chunk
                 yield {"type": "content", "content": chunk}
 
-            # Step 3: Self-Critique
-            critique_result = await self.self_critique.critique(optimized_query, full_response, vector_results)
-            yield {
-                "type": "metadata",
-                "confidence": critique_result['confidence'],
-                "critique": critique_result['critique']
-            }
+            # Step 3: Self-Critique, after the response (handed to the caller, not sent to the client)
+            yield {"type": "review", "review": self._review_payload(optimized_query, full_response, vector_results, {"complexity": complexity}, "graph_rag")}
 
             yield {"type": "done", "strategy": "graph_rag"}
             return
 
-        # SINGLE_HOP flow with Hybrid Search and Multi-Query Fusion
-        all_retrieved_docs = []
-        queries = await self._generate_multi_queries(optimized_query)
+        # SINGLE_HOP flow with Hybrid Search and Multi-Query Fusion (stage graph)
+        retrieving = asyncio.ensure_future(self._retrieve(
+            optimized_query, user_id, session_id, plan=prep["plan"], deadline=deadline,
+            on_stage=report, defer_crag=settings.STREAM_DEFER_CRAG
+        ))
+        async for event in self._drain_progress(retrieving, progress):
+            yield event
+        retrieval = retrieving.result()
+        queries = retrieval["multi_query"]
+        crag_result = retrieval["crag"]
+        crag_task = retrieval.get("crag_task")
 
         yield {"type": "metadata", "multi_queries": queries}
 
-        for q in queries:
-            hyde_result = await self.hyde_engine.transform_query(q)
-            results = self.vector_store.search(
-                query=hyde_result['hypothetical_document'],
-                user_id=user_id,
-                session_id=session_id,
-                k=20,
-                alpha=0.6
-            )
-            all_retrieved_docs.extend(results)
-
-        unique_docs = self._deduplicate_docs(all_retrieved_docs)
-        reranked_results = self.reranker.rerank(query=optimized_query, documents=unique_docs, top_k=10)
-
-        crag_result = await self.crag_pipeline.retrieve_with_correction(optimized_query, reranked_results)
         final_docs = crag_result['documents']
         retrieved_doc_names = [doc['metadata'].get('filename') for doc in final_docs[:5]]
 
+        cache_fingerprint = None
+        if not visual_context:
+            cache_fingerprint = semantic_cache.fingerprint(d.get('content', '') for d in final_docs[:5])
+            with tracer.span("semantic_cache"):
+                cached = await semantic_cache.get(user_id, optimized_query, cache_fingerprint)
+                tracer.annotate(cache_hit=bool(cached))
+            if cached:
+                if crag_task is not None:
+                    crag_task.cancel()
+                metadata = {
+                    **{k: v for k, v in cached["metadata"].items() if k not in PER_REQUEST_METADATA},
+                    "strategy": "vector_rag",
+                    "retrieved_docs": retrieved_doc_names,
+                    "semantic_cache_hit": True,
+                    **deadline.metadata()
+                }
+                yield {"type": "metadata", **metadata}
+                yield {"type": "content", "content": cached["response"]}
+                # Reviewed as a new message, like a cache hit in process_query
+                yield {"type": "review", "review": self._review_payload(optimized_query, cached["response"], final_docs, metadata, "vector_rag")}
+                yield {"type": "done", "strategy": "vector_rag"}
+                return
+
         # 6. Contextual Compression (Refining streaming context)
-        compressed_docs = await self._compress_all_contexts(optimized_query, final_docs[:5])
-        context_text = "\n\n".join(compressed_docs)
+        compressed_docs = await self._compress_all_contexts(optimized_query, final_docs[:5], deadline)
+        memory_summary, visual_context, context_text, history = self._fit_prompt_sections(
+            GENERATION_PROMPT_TOKENS, query, history, compressed_docs, memory_summary, visual_context
+        )
+        yield {"type": "progress", "stage": "context", "documents_used": len(compressed_docs), "context_tokens": token_counter.count(context_text)}
 
         yield {
             "type": "metadata",
@@ -655,7 +1070,8 @@ Comprehensive Answer:"""
             "retrieval_quality": crag_result['retrieval_quality'],
             "used_web_search": crag_result['used_web_search'],
             "retrieved_docs": retrieved_doc_names,
-            "context_compressed": len(compressed_docs) > 0
+            "context_compressed": len(compressed_docs) > 0,
+            **deadline.metadata()
         }
 
         system_prompt = f"""You are Engunity AI, an advanced multimodal assistant.
@@ -683,16 +1099,50 @@ Instructions:
             final_messages.append({"role": "user", "content": query})
 
         full_response = ""
-        async for chunk in self.llm_client.get_streaming_completion(final_messages, temperature=0.3):
+        generation_start = time.monotonic()
+        async for chunk in self.model_policy.for_stage("generation").get_streaming_completion(final_messages, temperature=0.3):
+            if not full_response:
+                stage_latency.record("generation_ttft", time.monotonic() - generation_start)
             full_response += chunk
             yield {"type": "content", "content": chunk}
 
-        # Self-Critique
-        critique_result = await self.self_critique.critique(optimized_query, full_response, final_docs)
-        yield {
-            "type": "metadata",
-            "confidence": critique_result['confidence'],
-            "critique": critique_result['critique']
+        # Whether the answer was generated from CRAG's final documents
+        answer_grounded = True
+        if crag_task is not None:
+            # Finished alongside generation, or shortly after
+            crag_result = await crag_task
+            corrected_docs = crag_result['documents']
+            # The answer only reflects the verdict if CRAG kept the documents it was generated from
+            answer_grounded = semantic_cache.fingerprint(d.get('content', '') for d in corrected_docs[:5]) == \
+                semantic_cache.fingerprint(d.get('content', '') for d in final_docs[:5])
+            yield {
+                "type": "refinement",
+                "stage": "crag",
+                "retrieval_quality": crag_result['retrieval_quality'],
+                "used_web_search": crag_result['used_web_search'] and answer_grounded,
+                "answer_grounded": answer_grounded,
+                "web_sources": [
+                    {"title": doc['metadata'].get('title'), "url": doc['metadata'].get('url')}
+                    for doc in corrected_docs if doc['metadata'].get('source') == "web_search"
+                ]
+            }
+
+        stream_metadata = {
+            "complexity": complexity,
+            "retrieval_quality": crag_result['retrieval_quality'],
+            "used_web_search": crag_result['used_web_search'] and answer_grounded,
+            "answer_grounded": answer_grounded
         }
 
+        # Self-Critique, after the response (handed to the caller, not sent to the client);
+        # judged against the documents the answer was actually generated from
+        yield {"type": "review", "review": self._review_payload(optimized_query, full_response, final_docs, stream_metadata, "vector_rag")}
+
+        # An answer CRAG would have grounded differently is not replayed to later queries
+        if cache_fingerprint and answer_grounded:
+            await semantic_cache.set(user_id, optimized_query, cache_fingerprint, {
+                "response": full_response,
+                "metadata": stream_metadata
+            })
+
         yield {"type": "done", "strategy": "vector_rag"}
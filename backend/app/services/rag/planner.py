@@ -0,0 +1,104 @@
+import json
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from app.services.ai.cache import query_key, history_key, normalize_query
+from app.core.tiered_cache import TieredCache
+from app.core.tracing import tracer
+
+COMPLEXITY_LABELS = ("SIMPLE", "SINGLE_HOP", "MULTI_HOP")
+
+
+class QueryPlanner:
+    """
+    Plans retrieval in one structured completion: standalone query, search variants,
+    a short hypothetical passage per variant (HyDE) and a complexity label.
+    Returns None when the answer cannot be parsed, so callers fall back to the
+    separate rewrite / multi-query / HyDE / classifier stages.
+    """
+
+    def __init__(self, llm_client):
+        self.llm = llm_client
+        self.cache = TieredCache("query_plan", default_ttl=3600)
+
+    async def plan(
+        self,
+        query: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        memory_context: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        history_tail = [(m.get("role"), m.get("content")) for m in (history or [])[-5:]]
+        cache_key = query_key(query, history_key(history), normalize_query(memory_context))
+        cached = await self.cache.get(cache_key)
+        tracer.annotate(cache_hit=bool(cached))
+        if cached:
+            return cached
+
+        history_text = "\n".join([f"{role}: {content}" for role, content in history_tail])
+        prompt = f"""Plan the retrieval for the latest user query.
+
+Conversation History:
+{history_text or "None"}
+
+{f"Known Context:{chr(10)}{memory_context}{chr(10)}" if memory_context else ""}
+Latest User Query: {query}
+
+Return ONLY a JSON object with these keys:
+"standalone_query": the query rewritten as a standalone search term. Resolve references to previous messages (like 'it', 'the report'), remove conversational filler, keep any request about an image, and do not expand common acronyms (RAG, AI, LLM, API).
+"complexity": "SIMPLE" (general knowledge, no retrieval needed), "SINGLE_HOP" (a factual lookup in one document) or "MULTI_HOP" (comparison, aggregation or reasoning across documents).
+"queries": exactly 4 strings: 3 diverse variations of the search intent, then a broader 'step-back' version capturing high-level concepts.
+"hypothetical_passages": exactly 4 strings, one per query in the same order: a 2-3 sentence encyclopedia-style passage that would answer it, with specific facts and terminology."""
+
+        try:
+            res = await self.llm.get_completion(
+                [{"role": "system", "content": "You are a retrieval planner for a search engine. Answer with a single JSON object and nothing else."},
+                 {"role": "user", "content": prompt}]
+            )
+            plan = self._parse(res)
+        except Exception as e:
+            logger.error(f"Error planning query: {e}")
+            return None
+
+        if plan is None:
+            logger.warning("Query plan could not be parsed, falling back to per-stage calls")
+            return None
+
+        logger.info(f"Query planned: '{query}' -> '{plan['standalone_query']}' ({plan['complexity']}, {len(plan['queries'])} variants)")
+        await self.cache.set(cache_key, plan)
+        return plan
+
+    @staticmethod
+    def _parse(text: str) -> Optional[Dict[str, Any]]:
+        text = text.strip()
+        if "```" in text:
+            text = text.split("```json")[-1] if "```json" in text else text.split("```")[1]
+            text = text.split("```")[0]
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+
+        standalone = data.get("standalone_query")
+        if not isinstance(standalone, str) or not standalone.strip():
+            return None
+        standalone = standalone.strip().split("\n")[0].strip().strip('"').strip("'")
+
+        queries = [q.strip() for q in data.get("queries") or [] if isinstance(q, str) and q.strip()][:4]
+        passages = data.get("hypothetical_passages") or []
+        # Passage for each variant, only where the model returned one in the right slot
+        hypothetical = {
+            q: p.strip()
+            for q, p in zip(queries, passages)
+            if isinstance(p, str) and p.strip()
+        }
+
+        complexity = str(data.get("complexity", "")).strip().upper()
+        return {
+            "standalone_query": standalone,
+            "queries": queries or [standalone],
+            "hypothetical": hypothetical,
+            # None lets the caller use the local classifier instead
+            "complexity": complexity if complexity in COMPLEXITY_LABELS else None,
+        }
@@ -7,6 +7,7 @@ Part 2 of Text Quality Upgrade Plan
 import logging
 import re
 from typing import Dict, Any
+from app.services.ai.key_scheduler import LLMPriority
 
 logger = logging.getLogger(__name__)
 
@@ -99,7 +100,8 @@ Produce the refined version now."""
                 ],
                 temperature=0.5,
                 max_tokens=2048,
-                model=self.model
+                model=self.model,
+                priority=LLMPriority.INTERACTIVE_OPTIONAL
             )
             
             # Validate that refinement didn't break anything
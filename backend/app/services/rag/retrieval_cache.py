@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.ai.cache import normalize_query
+
+
+class RetrievalCache:
+    """
+    Final retrieval results (reranked, CRAG-corrected documents) per
+    (user, session scope, normalized optimized query, user's corpus version).
+
+    Indexed chunks are stored as vector store row references checked against their
+    content hash on the way out, so an entry costs a few bytes per document and is
+    rebuilt from the live index. Any change to a user's chunks bumps their corpus
+    version in the vector store, which makes all older entries unreachable; they are
+    also dropped eagerly. Compaction shifts row ids, so it bumps the owners of moved
+    rows. The index lives in this process, so the cache does too.
+    """
+
+    def __init__(self, vector_store, max_entries: int, ttl: int):
+        self.vector_store = vector_store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = settings.RETRIEVAL_CACHE_ENABLED
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "sets": 0, "invalidations": 0}
+        vector_store.add_change_listener(self.invalidate)
+
+    def _key(self, user_id: str, session_id: Optional[str], query: str) -> Tuple:
+        return (
+            str(user_id),
+            str(session_id) if session_id else "*",
+            normalize_query(query),
+            self.vector_store.corpus_version(user_id),
+        )
+
+    def get(self, user_id: str, session_id: Optional[str], query: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled or not user_id:
+            return None
+        key = self._key(user_id, session_id, query)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+
+        documents = self._resolve(entry[1]["documents"], key[0])
+        if documents is None:
+            # A referenced chunk changed without a version bump (e.g. another writer)
+            del self._entries[key]
+            self.stats["stale"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return {**entry[1], "documents": documents}
+
+    def set(self, user_id: str, session_id: Optional[str], query: str, result: Dict[str, Any]):
+        if not self.enabled or not user_id:
+            return
+        key = self._key(user_id, session_id, query)
+        self._entries[key] = (time.monotonic() + self.ttl, {**result, "documents": self._references(result["documents"])})
+        self._entries.move_to_end(key)
+        self.stats["sets"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _references(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        refs = []
+        for doc in documents:
+            row = doc.get("row")
+            if row is None:
+                # Not from the index (web search results): kept as-is
+                refs.append({"doc": doc})
+                continue
+            refs.append({
+                "row": row,
+                "hash": doc["metadata"].get("content_hash"),
+                "extra": {k: v for k, v in doc.items() if k not in ("content", "metadata")},
+            })
+        return refs
+
+    def _resolve(self, refs: List[Dict[str, Any]], user_id: str) -> Optional[List[Dict[str, Any]]]:
+        documents = []
+        with self.vector_store.lock:
+            metadata = self.vector_store.metadata
+            for ref in refs:
+                if "doc" in ref:
+                    documents.append(dict(ref["doc"]))
+                    continue
+                row = ref["row"]
+                if row >= len(metadata):
+                    return None
+                meta = metadata[row]
+                # Identical chunks can exist under another user; the row must still be this user's
+                if meta.get("deleted") or meta.get("content_hash") != ref["hash"] or str(meta.get("user_id")) != user_id:
+                    return None
+                documents.append({"content": meta.get("text", ""), "metadata": meta, **ref["extra"]})
+        return documents
+
+    def invalidate(self, user_id: Any):
+        user_id = str(user_id)
+        stale = [key for key in self._entries if key[0] == user_id]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            self.stats["invalidations"] += 1
+            logger.info(f"Retrieval cache: dropped {len(stale)} entries for user {user_id} after a corpus change")
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["stale"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else None,
+        }
@@ -1,5 +1,9 @@
 from typing import List, Dict, Optional
 from loguru import logger
+from app.services.ai.key_scheduler import LLMPriority
+from app.services.ai.cache import query_key, history_key
+from app.core.tiered_cache import TieredCache
+from app.core.tracing import tracer
 
 class QueryRewriter:
     """
@@ -7,12 +11,19 @@ class QueryRewriter:
     """
     def __init__(self, llm_client):
         self.llm = llm_client
+        self.cache = TieredCache("rewrite", default_ttl=3600)
 
     async def rewrite(self, query: str, history: Optional[List[Dict[str, str]]] = None) -> str:
         """
         Rewrite the user query to be more descriptive and suitable for vector search.
         Handles conversational context by resolving anaphora (e.g., 'it', 'they', 'that').
         """
+        cache_key = query_key(query, history_key(history))
+        cached = await self.cache.get(cache_key)
+        tracer.annotate(cache_hit=bool(cached))
+        if cached:
+            return cached
+
         if not history:
             # Simple optimization for a single query
             prompt = f"""Given the following user query, rewrite it to be more suitable for a semantic search engine.
@@ -46,7 +57,8 @@ Standalone Optimized Query:"""
                 [{"role": "system", "content": "You are a search query optimization expert. Your task is to provide the single best search term or phrase. Do not include any explanations, preambles, or conversational text."},
                  {"role": "user", "content": prompt}],
                 max_tokens=100,
-                temperature=0.2
+                temperature=0.2,
+                priority=LLMPriority.INTERACTIVE_OPTIONAL
             )
 
             # Clean up the response
@@ -62,6 +74,8 @@ Standalone Optimized Query:"""
                 clean_query = clean_query.split("\n")[0].strip()
 
             logger.info(f"Query rewritten: '{query}' -> '{clean_query}'")
+            if clean_query:
+                await self.cache.set(cache_key, clean_query)
             return clean_query
         except Exception as e:
             logger.error(f"Error rewriting query: {e}")
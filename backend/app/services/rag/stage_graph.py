@@ -0,0 +1,132 @@
+"""
+Small dependency-graph executor for pipeline stages.
+
+Each stage names the earlier outputs it needs. A stage starts as soon as all of
+its inputs exist, so independent stages overlap and the wall time approaches the
+critical path. Every stage can have its own timeout and a fallback value used
+when it fails or times out; stages without a fallback are required and abort the run.
+"""
+
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+from app.core.tracing import tracer
+
+REQUIRED = object()
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable,
+        inputs: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Any = REQUIRED,
+        blocking: bool = False
+    ):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.timeout = timeout
+        self.fallback = fallback
+        # Synchronous CPU-bound function, run in a worker thread
+        self.blocking = blocking
+
+    def fallback_value(self, args):
+        return self.fallback(*args) if callable(self.fallback) else self.fallback
+
+
+class StageGraph:
+    """
+    Stages are called as fn(*inputs) and their result is stored under the stage name.
+    Build one graph per request; after run(), `timings` holds per-stage ms and status.
+    on_stage(name, result, timing) is called as each stage finishes (progress reporting).
+    """
+
+    def __init__(self, name: str, on_stage: Optional[Callable[[str, Any, Dict[str, Any]], None]] = None):
+        self.name = name
+        self.on_stage = on_stage
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, Dict[str, Any]] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable,
+        inputs: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Any = REQUIRED,
+        blocking: bool = False
+    ) -> "StageGraph":
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage '{name}' in {self.name}")
+        self.stages[name] = Stage(name, fn, inputs, timeout, fallback, blocking)
+        return self
+
+    async def _run_stage(self, stage: Stage, args: tuple) -> Any:
+        with tracer.span(f"{self.name}.{stage.name}"):
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                if stage.blocking:
+                    call = asyncio.to_thread(stage.fn, *args)
+                else:
+                    call = stage.fn(*args)
+                    if not inspect.isawaitable(call):
+                        return call
+                return await asyncio.wait_for(call, timeout=stage.timeout)
+            except Exception as e:
+                status = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                if stage.fallback is REQUIRED:
+                    raise
+                logger.warning(f"[{self.name}] stage '{stage.name}' {status}, using fallback: {e!r}")
+                tracer.set_status(status)
+                tracer.annotate(fallback=True, error=repr(e)[:200])
+                return stage.fallback_value(args)
+            finally:
+                self.timings[stage.name] = {
+                    "ms": round((time.perf_counter() - start) * 1000, 1),
+                    "status": status,
+                }
+
+    async def run(self, **initial: Any) -> Dict[str, Any]:
+        """Run every stage; returns the initial values plus each stage's output."""
+        with tracer.span(self.name, stages=len(self.stages)):
+            return await self._run(dict(initial))
+
+    async def _run(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        pending = dict(self.stages)
+        running: Dict[asyncio.Task, str] = {}
+
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(i in state for i in stage.inputs):
+                        args = tuple(state[i] for i in stage.inputs)
+                        running[asyncio.ensure_future(self._run_stage(stage, args))] = name
+                        del pending[name]
+
+                if not running:
+                    missing = {n: [i for i in s.inputs if i not in state] for n, s in pending.items()}
+                    raise ValueError(f"Unsatisfiable stages in {self.name}: {missing}")
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    state[name] = task.result()
+                    if self.on_stage is not None:
+                        try:
+                            self.on_stage(name, state[name], self.timings.get(name, {}))
+                        except Exception as e:
+                            logger.warning(f"[{self.name}] on_stage callback failed for '{name}': {e!r}")
+        finally:
+            # A required stage failed or the caller was cancelled
+            for task in running:
+                task.cancel()
+
+        return state
@@ -1,8 +1,7 @@
 from typing import List, Dict, Optional
-import httpx
-import certifi
 from loguru import logger
 import os
+from app.core.http_client import get_http_client
 
 class WebSearchFallback:
     """
@@ -40,23 +39,22 @@ class WebSearchFallback:
         }
 
         try:
-            async with httpx.AsyncClient(verify=certifi.where()) as client:
-                response = await client.post(url, json=payload, timeout=10.0)
-                response.raise_for_status()
-                data = response.json()
+            response = await get_http_client("tavily").post(url, json=payload)
+            response.raise_for_status()
+            data = response.json()
 
-                results = []
-                for res in data.get("results", []):
-                    results.append({
-                        "content": res.get("content", ""),
-                        "metadata": {
-                            "title": res.get("title", ""),
-                            "url": res.get("url", ""),
-                            "source": "web_search",
-                            "score": res.get("score", 0)
-                        }
-                    })
-                return results
+            results = []
+            for res in data.get("results", []):
+                results.append({
+                    "content": res.get("content", ""),
+                    "metadata": {
+                        "title": res.get("title", ""),
+                        "url": res.get("url", ""),
+                        "source": "web_search",
+                        "score": res.get("score", 0)
+                    }
+                })
+            return results
         except Exception as e:
             logger.error(f"Error in Tavily search: {e}")
             return []
@@ -1,6 +1,7 @@
-import redis.asyncio as redis
+from typing import Dict, List
 from supabase import create_client, Client
 from app.core.config import settings
+from app.core.tiered_cache import TieredCache
 import os
 import json
 
@@ -12,16 +13,10 @@ class SupabaseStorage:
         if settings.SUPABASE_URL and key:
             self.supabase = create_client(settings.SUPABASE_URL, key)
 
-        # Initialize Redis for URL caching
-        try:
-            self.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
-            self.redis_available = True
-        except Exception as e:
-            print(f"WARNING: Redis not available at {settings.REDIS_URL}: {e}")
-            self.redis = None
-            self.redis_available = False
-
-    async def upload_file(self, bucket: str, path: str, file_content: bytes, content_type: str):
+        # Signed URL cache (in-process LRU in front of Redis)
+        self.url_cache = TieredCache("img_url")
+
+    async def upload_file(self, bucket: str, path: str, file_content: bytes, content_type: str, upsert: bool = False):
         if not self.supabase:
             raise Exception("Supabase not configured")
 
@@ -34,10 +29,14 @@ class SupabaseStorage:
             except Exception as e:
                 print(f"Error creating bucket {bucket}: {e}")
 
+        file_options = {"content-type": content_type}
+        if upsert:
+            file_options["upsert"] = "true"
+
         return self.supabase.storage.from_(bucket).upload(
             path=path,
             file=file_content,
-            file_options={"content-type": content_type}
+            file_options=file_options
         )
 
     async def get_file_url(self, bucket: str, path: str, signed: bool = True, expires_in: int = 3600):
@@ -45,17 +44,23 @@ class SupabaseStorage:
             raise Exception("Supabase not configured")
 
         if signed:
-            # Check Redis cache first
-            cache_key = f"img_url:{bucket}:{path}"
-            if self.redis_available:
-                try:
-                    cached_url = await self.redis.get(cache_key)
-                    if cached_url:
-                        return cached_url
-                except Exception as e:
-                    print(f"WARNING: Redis error during get: {e}")
-                    self.redis_available = False
+            return (await self.get_file_urls(bucket, [path], expires_in))[path]
 
+        return self.supabase.storage.from_(bucket).get_public_url(path)
+
+    async def get_file_urls(self, bucket: str, paths: List[str], expires_in: int = 3600) -> Dict[str, str]:
+        """Signed URLs for many paths: one cache lookup, then a signing call per miss."""
+        if not self.supabase:
+            raise Exception("Supabase not configured")
+
+        paths = list(dict.fromkeys(paths))
+        cached = await self.url_cache.get_many(f"{bucket}:{path}" for path in paths)
+        urls = {path: url for path, url in zip(paths, cached) if url}
+
+        fresh = {}
+        for path in paths:
+            if path in urls:
+                continue
             # Generate a signed URL for secure access
             res = self.supabase.storage.from_(bucket).create_signed_url(path, expires_in)
 
@@ -64,31 +69,22 @@ class SupabaseStorage:
                 url = res["signedURL"]
             else:
                 url = res # Depending on version, it might return the string directly
+            urls[path] = url
+            if url:
+                fresh[f"{bucket}:{path}"] = url
 
-            # Cache the URL in Redis with a TTL slightly less than the signed expiry
-            if url and self.redis_available:
-                try:
-                    await self.redis.set(cache_key, url, ex=expires_in - 60)
-                except Exception as e:
-                    print(f"WARNING: Redis error during set: {e}")
-                    self.redis_available = False
-
-            return url
+        # Cache with a TTL slightly less than the signed expiry
+        if fresh:
+            await self.url_cache.set_many(fresh, expire=expires_in - 60)
 
-        return self.supabase.storage.from_(bucket).get_public_url(path)
+        return urls
 
     async def delete_file(self, bucket: str, path: str):
         if not self.supabase:
             raise Exception("Supabase not configured")
 
         # Invalidate cache
-        if self.redis_available:
-            try:
-                cache_key = f"img_url:{bucket}:{path}"
-                await self.redis.delete(cache_key)
-            except Exception as e:
-                print(f"WARNING: Redis error during delete: {e}")
-                self.redis_available = False
+        await self.url_cache.delete(f"{bucket}:{path}")
 
         return self.supabase.storage.from_(bucket).remove([path])
 
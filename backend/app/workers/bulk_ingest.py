@@ -0,0 +1,340 @@
+"""
+Bulk ingestion of a local directory or zip/tar archive into the vector store.
+
+Text extraction and chunking fan out to a process pool, embeddings are batched
+across files in the parent, and a checkpoint manifest makes interrupted runs
+resumable. Each ingested file gets a Postgres Document row (no stored copy of the
+file), so the documents API lists, re-indexes and deletes it like an upload.
+
+The ingestor writes the index files directly: stop the API server first. It refuses
+to start while another process (the server) holds the vector store's writer lock.
+
+Usage:
+    python -m app.workers.bulk_ingest ./customer_docs --user-id 42
+    python -m app.workers.bulk_ingest export.tar.gz --user-id 42 --workers 8
+"""
+
+import argparse
+import json
+import mimetypes
+import multiprocessing
+import os
+import tarfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SUPPORTED_EXTENSIONS = {
+    "pdf", "docx", "doc", "txt", "md", "markdown", "rst", "csv", "json", "html", "htm",
+    "png", "jpg", "jpeg", "webp"
+}
+
+MAX_FILE_SIZE = 50 * 1024 * 1024  # Skip anything larger than 50MB
+
+# Per-worker splitter, created lazily after the worker process starts
+_splitter = None
+
+
+def _extract_and_split(file_name: str, path: Optional[str] = None, content: Optional[bytes] = None) -> List[str]:
+    """Runs in a worker process: extract text from one file and chunk it."""
+    global _splitter
+    from app.services.ai.text_extraction import extract_text, make_recursive_splitter
+
+    if _splitter is None:
+        _splitter = make_recursive_splitter()
+
+    if content is None:
+        with open(path, "rb") as f:
+            content = f.read()
+
+    text = extract_text(content, file_name)
+    if not text.strip():
+        return []
+    return _splitter.split_text(text)
+
+
+def _is_supported(name: str, size: int) -> bool:
+    parts = [p for p in name.replace("\\", "/").split("/") if p]
+    # Skip hidden files and anything under hidden directories (.git, .cache, ...)
+    if not parts or any(p.startswith(".") for p in parts):
+        return False
+    base = parts[-1]
+    ext = base.rsplit(".", 1)[-1].lower() if "." in base else ""
+    return ext in SUPPORTED_EXTENSIONS and 0 < size <= MAX_FILE_SIZE
+
+
+def iter_source_files(source: str) -> Iterator[Tuple[str, Optional[str], Optional[bytes]]]:
+    """
+    Yield (key, path, content) for every supported file in a directory or archive.
+    Directory entries are read by the workers; archive members are streamed one at a time.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if _is_supported(name, os.path.getsize(path)):
+                    yield os.path.relpath(path, source), path, None
+
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_supported(info.filename, info.file_size):
+                    yield info.filename, None, archive.read(info)
+
+    elif tarfile.is_tarfile(source):
+        # Stream mode: members are read sequentially without seeking
+        with tarfile.open(source, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and _is_supported(member.name, member.size):
+                    handle = archive.extractfile(member)
+                    if handle is not None:
+                        yield member.name, None, handle.read()
+    else:
+        raise ValueError(f"Unsupported source (expected a directory, zip or tar archive): {source}")
+
+
+class BulkIngestor:
+    """
+    Ingests many files through DocumentProcessor chunk metadata and VectorStore.
+
+    Completed files are recorded in a JSON manifest after each checkpoint, only once
+    their embeddings have been flushed to disk, so a rerun skips them. Document ids are
+    derived from (user, source, path), which also makes re-runs idempotent.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        user_id: str,
+        workers: int = None,
+        batch_size: int = 256,
+        checkpoint_every: int = 50,
+        manifest_path: Optional[str] = None,
+        session_id: Optional[str] = None
+    ):
+        self.source = os.path.abspath(source)
+        self.user_id = str(user_id)
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self.session_id = session_id
+        self.manifest_path = manifest_path or f"{self.source.rstrip(os.sep)}.ingest-manifest.json"
+
+        self.manifest = self._load_manifest()
+
+        self._pending_texts: List[str] = []
+        self._pending_metadatas: List[Dict[str, Any]] = []
+        self._pending_docs: List[Tuple[str, str, int]] = []  # (key, document_id, chunks) not yet embedded
+        self._embedded_docs: List[Tuple[str, str, int]] = []  # embedded but not yet checkpointed
+        self._sizes: Dict[str, int] = {}  # key -> file size, for the Document rows
+        self._unregistered: List[str] = []  # indexed by an earlier run, Document row not confirmed
+
+        self.stats = {"documents": 0, "chunks": 0, "skipped": 0, "failed": 0}
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("source") == self.source and manifest.get("user_id") == self.user_id:
+                return manifest
+            print(f"WARNING: Manifest {self.manifest_path} belongs to another run, starting fresh")
+        return {"source": self.source, "user_id": self.user_id, "completed": {}, "failed": {}}
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _document_id(self, key: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.user_id}:{self.source}:{key}"))
+
+    def run(self) -> Dict[str, Any]:
+        from app.services.ai.vector_store import vector_store
+        from app.services.ai.document_processor import document_processor
+
+        if not vector_store.acquire_writer_lock():
+            raise RuntimeError(
+                f"{vector_store.writer_lock_file} is held by another process (is the API server running?). "
+                "Its in-memory index would overwrite this run's documents: stop it and retry."
+            )
+
+        self.vector_store = vector_store
+        self.document_processor = document_processor
+        # One pass over the store up front instead of a metadata scan per input file
+        self._indexed = set(vector_store.document_rows())
+
+        start = time.perf_counter()
+        # spawn keeps workers free of the parent's torch/model state
+        context = multiprocessing.get_context("spawn")
+        in_flight: Dict[Future, Tuple[str, str]] = {}
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            for key, path, content in iter_source_files(self.source):
+                if key in self.manifest["completed"]:
+                    self.stats["skipped"] += 1
+                    continue
+
+                document_id = self._document_id(key)
+                self._sizes[key] = len(content) if content is not None else os.path.getsize(path)
+                if document_id in self._indexed:
+                    # Indexed by an earlier run that stopped before its checkpoint
+                    self.manifest["completed"][key] = {"document_id": document_id}
+                    self._unregistered.append(key)
+                    self.stats["skipped"] += 1
+                    continue
+
+                future = pool.submit(_extract_and_split, os.path.basename(key), path, content)
+                in_flight[future] = (key, document_id)
+
+                # Bound the number of archive members held in memory
+                if len(in_flight) >= self.workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._collect(future, *in_flight.pop(future))
+
+            for future in list(in_flight):
+                self._collect(future, *in_flight.pop(future))
+
+        self._checkpoint()
+
+        elapsed = time.perf_counter() - start
+        report = {
+            **self.stats,
+            "seconds": round(elapsed, 2),
+            "docs_per_sec": round(self.stats["documents"] / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_sec": round(self.stats["chunks"] / elapsed, 2) if elapsed else 0.0,
+            "manifest": self.manifest_path
+        }
+        return report
+
+    def _collect(self, future: Future, key: str, document_id: str):
+        try:
+            chunks = future.result()
+        except Exception as e:
+            print(f"Failed to process {key}: {e}")
+            self.manifest["failed"][key] = str(e)
+            self.stats["failed"] += 1
+            return
+
+        self.manifest["failed"].pop(key, None)
+        metadata = {
+            "document_id": document_id,
+            "user_id": self.user_id,
+            "title": os.path.basename(key),
+            "filename": os.path.basename(key),
+            "source_path": key,
+            "session_id": self.session_id
+        }
+        self._pending_texts.extend(chunks)
+        self._pending_metadatas.extend(self.document_processor.build_chunk_metadatas(chunks, metadata))
+        self._pending_docs.append((key, document_id, len(chunks)))
+        self._indexed.add(document_id)
+
+        if len(self._pending_texts) >= self.batch_size:
+            self._embed_pending()
+        if len(self._embedded_docs) >= self.checkpoint_every:
+            self._checkpoint()
+
+    def _embed_pending(self):
+        if self._pending_texts:
+            # One encode call for chunks from many files; persistence waits for the checkpoint
+            self.vector_store.add_texts(self._pending_texts, self._pending_metadatas, persist=False)
+
+        for key, document_id, chunk_count in self._pending_docs:
+            self.stats["documents"] += 1
+            self.stats["chunks"] += chunk_count
+        self._embedded_docs.extend(self._pending_docs)
+
+        self._pending_texts = []
+        self._pending_metadatas = []
+        self._pending_docs = []
+
+    def _checkpoint(self):
+        self._embed_pending()
+        self.vector_store.flush()
+
+        # Rows before the manifest: a failed write leaves the files to the next run
+        self._register_documents([key for key, _, _ in self._embedded_docs] + self._unregistered)
+        for key, document_id, chunk_count in self._embedded_docs:
+            self.manifest["completed"][key] = {"document_id": document_id, "chunks": chunk_count}
+        self._embedded_docs = []
+        self._unregistered = []
+        self._save_manifest()
+
+    def _register_documents(self, keys: List[str]):
+        """Create the Postgres Document rows (and chat links) of indexed files that have none."""
+        if not keys:
+            return
+        from app.core.database import SessionLocal
+        from app.models.document import Document, DocumentLink
+
+        db = SessionLocal()
+        try:
+            for key in keys:
+                document_id = self._document_id(key)
+                filename = os.path.basename(key)
+                if db.get(Document, document_id) is None:
+                    db.add(Document(
+                        id=document_id,
+                        user_id=self.user_id,
+                        title=filename,
+                        type="note",
+                        status="draft",
+                        filename=filename,
+                        file_path=None,  # Not uploaded to storage
+                        file_type=mimetypes.guess_type(filename)[0],
+                        size=self._sizes.get(key)
+                    ))
+                if self.session_id and not db.query(DocumentLink).filter(
+                    DocumentLink.document_id == document_id, DocumentLink.target_id == self.session_id
+                ).first():
+                    db.add(DocumentLink(
+                        document_id=document_id,
+                        target_type="chat",
+                        target_id=self.session_id,
+                        title=f"Bulk ingest: {filename}"
+                    ))
+            db.commit()
+        finally:
+            db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk-ingest a directory or zip/tar archive into the vector store.",
+        epilog="Stop the API server first: both write the same index files, and the run refuses to start "
+               "while the server holds the store. Files get Document rows but no copy in cloud storage."
+    )
+    parser.add_argument("source", help="Directory, .zip or .tar(.gz/.bz2/.xz) archive")
+    parser.add_argument("--user-id", required=True, help="Owner of the ingested documents")
+    parser.add_argument("--session-id", default=None, help="Optional chat session to scope the documents to")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count - 1)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="Documents between checkpoints")
+    parser.add_argument("--manifest", default=None, help="Checkpoint manifest path")
+    args = parser.parse_args()
+
+    ingestor = BulkIngestor(
+        source=args.source,
+        user_id=args.user_id,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_every=args.checkpoint_every,
+        manifest_path=args.manifest,
+        session_id=args.session_id
+    )
+    report = ingestor.run()
+
+    print(
+        f"Ingested {report['documents']} documents ({report['chunks']} chunks) in {report['seconds']}s: "
+        f"{report['docs_per_sec']} docs/sec, {report['chunks_per_sec']} chunks/sec. "
+        f"Skipped {report['skipped']}, failed {report['failed']}."
+    )
+
+
+if __name__ == "__main__":
+    main()
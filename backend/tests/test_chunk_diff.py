@@ -0,0 +1,58 @@
+"""
+Content-hash diffing of document versions: only chunks whose text changed are
+embedded again, unchanged ones keep their rows.
+"""
+
+import os
+import sys
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.services.ai.chunk_diff import content_hash, diff_chunks
+
+
+def _indexed(chunks, first_row=0):
+    return [(first_row + i, content_hash(chunk)) for i, chunk in enumerate(chunks)]
+
+
+def _hashes(chunks):
+    return [content_hash(chunk) for chunk in chunks]
+
+
+CHUNKS = [f"Section {i}: the component handles step {i} of the workflow." for i in range(10)]
+
+
+def test_unchanged_version_reuses_every_row():
+    diff = diff_chunks(_indexed(CHUNKS), _hashes(CHUNKS))
+    assert diff.added == [] and diff.removed == []
+    assert sorted(diff.kept) == [(i, i) for i in range(10)]
+
+
+def test_one_edited_chunk_is_the_only_one_embedded():
+    edited = list(CHUNKS)
+    edited[6] = edited[6].replace("handles", "validates")
+    diff = diff_chunks(_indexed(CHUNKS, first_row=100), _hashes(edited))
+    assert diff.added == [6]
+    assert diff.removed == [106]
+    assert len(diff.kept) == 9
+
+
+def test_inserted_chunk_keeps_rows_of_shifted_chunks():
+    edited = ["A new introduction."] + CHUNKS
+    diff = diff_chunks(_indexed(CHUNKS), _hashes(edited))
+    assert diff.added == [0]
+    assert diff.removed == []
+    assert dict(diff.kept) == {i + 1: i for i in range(10)}
+
+
+def test_repeated_chunks_match_as_many_rows_as_they_have():
+    diff = diff_chunks(_indexed(["same", "other"]), _hashes(["same", "same", "other"]))
+    assert diff.added == [1]
+    assert sorted(row for _, row in diff.kept) == [0, 1]
+
+
+def test_deleted_document_content_removes_all_rows():
+    diff = diff_chunks(_indexed(CHUNKS), [])
+    assert diff.kept == [] and diff.added == []
+    assert sorted(diff.removed) == list(range(10))
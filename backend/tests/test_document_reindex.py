@@ -0,0 +1,78 @@
+"""
+Incremental re-indexing: editing one paragraph of an uploaded document must only
+re-embed the chunks around the edit.
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("rank_bm25")
+pytest.importorskip("langchain_text_splitters")
+pytest.importorskip("langchain_experimental")
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+DIMENSION = 16
+
+
+class HashEncoder:
+    """Deterministic stand-in for the embedding model (no download, no GPU)."""
+
+    def __init__(self, model_name: str = ""):
+        self.encoded = 0
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return DIMENSION
+
+    def encode(self, texts, normalize_embeddings: bool = True, **kwargs):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        self.encoded += len(texts)
+        vectors = np.array([
+            np.frombuffer(hashlib.sha256(t.encode("utf-8")).digest()[:DIMENSION], dtype=np.uint8).astype("float32") + 1
+            for t in texts
+        ])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    # The module-level stores are created at import; keep them off the real model
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=HashEncoder))
+    from app.services.ai import document_processor as module
+    from app.services.ai.vector_store import VectorStore
+
+    store = VectorStore(storage_path=str(tmp_path))
+    monkeypatch.setattr(module, "vector_store", store)
+    return module.DocumentProcessor(), store
+
+
+def _document(paragraphs):
+    return "\n\n".join(paragraphs).encode("utf-8")
+
+
+def test_one_paragraph_edit_reembeds_one_or_two_chunks(processor):
+    document_processor, store = processor
+    paragraphs = [
+        f"Section {i}. " + " ".join(f"The component number {i} handles step {j} of the workflow." for j in range(5))
+        for i in range(12)
+    ]
+    metadata = {"document_id": "doc-1", "user_id": "7", "filename": "guide.txt"}
+
+    # Same call as the upload endpoint
+    indexed = asyncio.run(document_processor.process_and_index(_document(paragraphs), "guide.txt", dict(metadata), use_semantic=False))
+    assert indexed > 3
+
+    paragraphs[6] = paragraphs[6].replace("handles step 2", "now validates step 2")
+    result = asyncio.run(document_processor.reindex_document(_document(paragraphs), "guide.txt", dict(metadata)))
+
+    assert 1 <= result["added"] <= 2
+    assert result["removed"] == result["added"]
+    assert result["unchanged"] == indexed - result["added"]
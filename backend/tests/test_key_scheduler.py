@@ -0,0 +1,113 @@
+"""
+Rate-limit-aware key scheduling: calls go to the key with most headroom, wait in
+priority order when keys are saturated, and optional calls are shed.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("loguru")
+pytest.importorskip("pydantic_settings")
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.services.ai.key_scheduler import KeyScheduler, LLMCallShed, LLMPriority, TokenBucket, parse_reset
+
+MODEL = "llama-3.1-8b-instant"
+
+
+def test_parse_reset_durations():
+    assert parse_reset("7.66s") == pytest.approx(7.66)
+    assert parse_reset("2m59.56s") == pytest.approx(179.56)
+    assert parse_reset("1h2m3s") == pytest.approx(3723)
+    assert parse_reset("120ms") == pytest.approx(0.12)
+    assert parse_reset("12") == 12.0
+    assert parse_reset(None) is None and parse_reset("soon") is None
+
+
+def test_token_bucket_wait_time_and_refill():
+    bucket = TokenBucket(60, per_seconds=60)
+    bucket.tokens = 0
+    assert bucket.wait_time(30) == pytest.approx(30)
+    bucket.refill(bucket.updated + 10)
+    assert bucket.tokens == pytest.approx(10)
+    # Requests larger than the bucket only wait for a full bucket
+    assert bucket.wait_time(1000) == pytest.approx(50)
+
+
+def test_calls_go_to_the_key_with_most_headroom():
+    async def scenario():
+        scheduler = KeyScheduler(["key-a", "key-b"], requests_per_minute=10, tokens_per_minute=1000)
+        first = await scheduler.acquire(MODEL, 500)
+        second = await scheduler.acquire(MODEL, 100)
+        return first.client, second.client
+
+    first, second = asyncio.run(scenario())
+    assert {first, second} == {"key-a", "key-b"}
+
+
+def test_release_corrects_the_estimate_with_actual_usage():
+    async def scenario():
+        scheduler = KeyScheduler(["key"], requests_per_minute=10, tokens_per_minute=1000)
+        lease = await scheduler.acquire(MODEL, 600)
+        scheduler.release(lease, used_tokens=100)
+        scheduler.release(lease, used_tokens=100)  # Released twice: no double refund
+        return scheduler.keys[0].model_buckets(MODEL)["tokens"].tokens
+
+    assert asyncio.run(scenario()) == pytest.approx(900, abs=5)
+
+
+def test_saturated_keys_shed_optional_calls_and_queue_critical_ones():
+    async def scenario():
+        scheduler = KeyScheduler(["key"], requests_per_minute=1, tokens_per_minute=1000, queue_timeout=5)
+        lease = await scheduler.acquire(MODEL, 100)
+        with pytest.raises(LLMCallShed):
+            await scheduler.acquire(MODEL, 100, priority=LLMPriority.INTERACTIVE_OPTIONAL)
+
+        waiting = asyncio.ensure_future(scheduler.acquire(MODEL, 100))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        # The provider reports a fresh window: the queued call is served on release
+        scheduler.release(lease, headers={"x-ratelimit-remaining-tokens": "1000"})
+        bucket = scheduler.keys[0].model_buckets(MODEL)["requests"]
+        bucket.tokens = bucket.capacity
+        scheduler._dispatch()
+        queued = await asyncio.wait_for(waiting, 1)
+        return queued, scheduler.stats
+
+    queued, stats = asyncio.run(scenario())
+    assert queued.client == "key"
+    assert stats["shed"] == 1 and stats["queued"] == 1
+
+
+def test_queued_calls_are_served_by_priority():
+    async def scenario():
+        scheduler = KeyScheduler(["key"], requests_per_minute=1, tokens_per_minute=1000, queue_timeout=5)
+        lease = await scheduler.acquire(MODEL, 10)
+        order = []
+
+        async def call(priority, name):
+            granted = await scheduler.acquire(MODEL, 10, priority=priority)
+            order.append(name)
+            return granted
+
+        background = asyncio.ensure_future(call(LLMPriority.BACKGROUND, "background"))
+        await asyncio.sleep(0)
+        critical = asyncio.ensure_future(call(LLMPriority.INTERACTIVE_CRITICAL, "critical"))
+        await asyncio.sleep(0)
+
+        bucket = scheduler.keys[0].model_buckets(MODEL)["requests"]
+        for _ in range(2):
+            bucket.capacity = bucket.tokens = 10
+            scheduler.release(lease)
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(asyncio.gather(background, critical), 1)
+        return order, scheduler.stats["preempted"]
+
+    order, preempted = asyncio.run(scenario())
+    assert order == ["critical", "background"]
+    assert preempted == 1
@@ -0,0 +1,72 @@
+"""
+Section detection for research papers: headings split the text, body lines that
+merely look like a heading word do not.
+"""
+
+import os
+import sys
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.services.ai.section_detector import detect_sections, split_references
+
+
+def _names(text):
+    return [section["name"] for section in detect_sections(text)]
+
+
+def test_numbered_and_capitalized_headings():
+    text = "\n".join([
+        "A Study of Things",
+        "Abstract",
+        "We study things.",
+        "1. Introduction",
+        "Things matter.",
+        "3.1 Methods",
+        "We measured them.",
+        "RESULTS",
+        "They are fine.",
+        "References",
+        "[1] A. Author. A paper. 2020.",
+    ])
+    assert _names(text) == ["front_matter", "abstract", "introduction", "methods", "results", "references"]
+
+
+def test_wrapped_body_line_is_not_a_heading():
+    text = "\n".join([
+        "1 Introduction",
+        "Prior systems are listed in the",
+        "references.",
+        "Their final step is a short",
+        "summary.",
+        "3 Methods",
+        "We measured them.",
+    ])
+    sections = detect_sections(text)
+    assert [s["name"] for s in sections] == ["introduction", "methods"]
+    assert "references." in sections[0]["text"]
+    assert "summary." in sections[0]["text"]
+
+
+def test_numbered_main_section_ends_references():
+    text = "\n".join([
+        "References",
+        "[1] A. Author. A paper. 2020.",
+        "[2] B. Author. Another paper. 2021.",
+        "4 Discussion",
+        "Late section after the bibliography.",
+        "Appendix A",
+        "Extra tables.",
+    ])
+    sections = detect_sections(text)
+    assert [s["name"] for s in sections] == ["references", "discussion", "appendix"]
+    assert split_references(sections[0]["text"]) == [
+        "[1] A. Author. A paper. 2020.",
+        "[2] B. Author. Another paper. 2021.",
+    ]
+
+
+def test_run_in_abstract_heading_only_in_front_matter():
+    assert _names("Title\nAbstract.\nWe study things.") == ["front_matter", "abstract"]
+    assert _names("Abstract: We study things.\n1 Introduction\nText.") == ["abstract", "introduction"]
@@ -0,0 +1,104 @@
+"""
+Request coalescing: identical concurrent calls and streams share one upstream call.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.services.ai.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("key", upstream) for _ in range(5)))
+        # Finished calls are forgotten, so a later call goes upstream again
+        again = await flight.do("key", upstream)
+        return results, again, len(calls), flight.stats
+
+    results, again, calls, stats = asyncio.run(scenario())
+    assert results == ["answer"] * 5 and again == "answer"
+    assert calls == 2
+    assert stats["calls"] == 2 and stats["coalesced"] == 4
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.02)
+            return 42
+
+        first = asyncio.ensure_future(flight.do("key", upstream))
+        second = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_late_stream_subscriber_replays_earlier_chunks():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        release = asyncio.Event()
+        sources = []
+
+        async def tokens():
+            sources.append(1)
+            yield "a"
+            yield "b"
+            started.set()
+            await release.wait()
+            yield "c"
+
+        async def consume():
+            return [chunk async for chunk in flight.stream("key", tokens)]
+
+        early = asyncio.ensure_future(consume())
+        await started.wait()
+        late = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        release.set()
+        return await early, await late, len(sources)
+
+    early, late, sources = asyncio.run(scenario())
+    assert early == late == ["a", "b", "c"]
+    assert sources == 1
+
+
+def test_stream_errors_reach_every_subscriber():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def failing():
+            yield "partial"
+            raise RuntimeError("upstream failed")
+
+        async def consume():
+            chunks = []
+            with pytest.raises(RuntimeError):
+                async for chunk in flight.stream("key", failing):
+                    chunks.append(chunk)
+            return chunks
+
+        return await asyncio.gather(consume(), consume())
+
+    assert asyncio.run(scenario()) == [["partial"], ["partial"]]
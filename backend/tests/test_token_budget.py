@@ -0,0 +1,65 @@
+"""
+Prompt budgeting: sections share a token budget by priority and prompts are
+trimmed to fit a limit.
+"""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("loguru")
+pytest.importorskip("pydantic_settings")
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.services.ai.token_budget import allocate, fit_messages, pack_texts, token_counter, trim_history
+
+
+def test_allocate_grants_floors_then_fills_by_priority():
+    grants = allocate(100, [
+        {"name": "history", "tokens": 80, "priority": 3, "min": 10},
+        {"name": "documents", "tokens": 200, "priority": 2, "min": 20},
+        {"name": "turn", "tokens": 30, "priority": 1},
+    ])
+    assert grants == {"turn": 30, "documents": 60, "history": 10}
+    assert sum(grants.values()) == 100
+
+
+def test_allocate_never_exceeds_what_a_section_asks_for():
+    grants = allocate(1000, [{"name": "a", "tokens": 5, "priority": 1, "min": 50}])
+    assert grants == {"a": 5}
+
+
+def test_pack_texts_keeps_rank_order_and_truncates_the_first_overflow():
+    texts = ["first passage " * 20, "second passage " * 60, "third passage " * 20]
+    budget = token_counter.count(texts[0]) + 80
+    packed = pack_texts(texts, budget, min_tail=64)
+    assert len(packed) == 2
+    assert packed[0] == texts[0]
+    assert texts[1].startswith(packed[1]) and packed[1] != texts[1]
+    assert sum(token_counter.count(t) for t in packed) <= budget
+
+
+def test_trim_history_keeps_most_recent_and_always_the_latest():
+    messages = [{"role": "user", "content": f"message {i} " * 30} for i in range(5)]
+    per_message = 4 + token_counter.count(messages[0]["content"])
+    kept = trim_history(messages, per_message * 2)
+    assert kept == messages[-2:]
+
+    latest_only = trim_history(messages, 10)
+    assert len(latest_only) == 1
+    assert messages[-1]["content"].startswith(latest_only[0]["content"])
+
+
+def test_fit_messages_brings_the_prompt_under_the_limit():
+    messages = [{"role": "system", "content": "Rules. " * 300}] + [
+        {"role": "user" if i % 2 else "assistant", "content": f"turn {i} " * 100} for i in range(8)
+    ]
+    limit = token_counter.count_messages(messages) // 3
+    fitted = fit_messages(messages, limit)
+    assert token_counter.count_messages(fitted) <= limit
+    assert fitted[0]["role"] == "system"
+    assert fitted[-1] == messages[-1]
+    assert fit_messages(messages[:2], 10 ** 6) == messages[:2]